@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+
+"""Benchmark the transfer harness offline against local stand-ins.
+
+Runs ``src/harness.py`` over a matrix of uploaders (the http uploader once
+per HTTP transport), CCD counts, file sizes, and compression settings
+against the endpoints in `standins`, optionally
+with injected latency and bandwidth shaping.  Exposures are scheduled
+back-to-back (``--interval 0`` with a start time that has already passed),
+so each run measures how fast the harness can move data rather than how
+well it keeps to a cadence.
+
+Throughput is that of the bytes sent, compressed if compression is on, as
+reported by the harness; the rate of uncompressed image bytes is given
+separately, so compressed and uncompressed runs can be compared.
+
+Results are written as JSON.  A previous results file can be given as a
+baseline; runs whose throughput drops or whose transfer p95 grows by more
+than the tolerance are reported as regressions and the exit status is 1.
+"""
+
+from __future__ import annotations
+import argparse
+import csv
+from datetime import datetime
+import itertools
+import json
+import os
+from pathlib import Path
+import platform
+import re
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import standins
+
+
+HARNESS = Path(__file__).resolve().parent.parent / "src" / "harness.py"
+UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+# Per-process summary logged by the harness's TransferStats.
+THROUGHPUT_RE = re.compile(r"Throughput: (\d+) transfers of (\d+) bytes")
+# Lines logged by the harness once its metrics are aggregated.
+DONE_MARKERS = ("Main process sleeping", "Supervisor exiting")
+KEY_FIELDS = ("uploader", "transport", "ccds", "size", "compress", "engine",
+              "extra", "latency", "bandwidth")
+
+
+def parse_size(text: str) -> int:
+    """Parse a byte count with an optional K, M, or G suffix."""
+    text = text.strip().upper().removesuffix("B").removesuffix("I")
+    if text and text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def parse_list(convert):
+    """Make an argparse type for comma-separated lists."""
+    return lambda text: [convert(item) for item in text.split(",") if item]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build an argument parser for command-line options."""
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the harness against local stand-in endpoints."
+    )
+    parser.add_argument('-u', '--uploaders', type=parse_list(str),
+                        default=["http", "boto", "minio", "scp"],
+                        help=("comma-separated uploaders"
+                              " (http, boto, minio, scp)"))
+    parser.add_argument('-H', '--transports', type=parse_list(str),
+                        default=["session", "sendfile", "h2"],
+                        help=("comma-separated HTTP transports for the http"
+                              " uploader (session, sendfile, h2)"))
+    parser.add_argument('-c', '--ccds', type=parse_list(int), default=[1, 4],
+                        help="comma-separated CCD counts")
+    parser.add_argument('-s', '--sizes', type=parse_list(parse_size),
+                        default=[parse_size("4M"), parse_size("16M")],
+                        help="comma-separated file sizes (K, M, G suffixes)")
+    parser.add_argument('-z', '--compress', type=parse_list(str),
+                        default=["off", "on"],
+                        help="comma-separated compression settings (off, on)")
+    parser.add_argument('--compressor', default="RICE_1",
+                        help="harness --compressor to use when compressing")
+    parser.add_argument('-e', '--engine', choices=("fork", "asyncio"),
+                        default="fork", help="harness engine")
+    parser.add_argument('-n', '--numexp', metavar='EXPOSURES', type=int,
+                        default=5, help="number of exposures per run")
+    parser.add_argument('-x', '--harness-args', metavar='ARGS', default="",
+                        help="additional harness arguments, as one string")
+    parser.add_argument('-l', '--latency', type=float, default=0.0,
+                        help="latency in seconds added to each request")
+    parser.add_argument('-B', '--bandwidth', type=parse_size, default=0,
+                        help="bandwidth limit in bytes per second")
+    parser.add_argument('-o', '--output', type=Path,
+                        default=Path("bench.json"),
+                        help="results file to write")
+    parser.add_argument('-b', '--baseline', type=Path,
+                        help="previous results file to compare against")
+    parser.add_argument('-T', '--tolerance', type=float, default=0.2,
+                        help="allowed fractional regression")
+    parser.add_argument('-t', '--timeout', type=float, default=600,
+                        help="seconds to allow for each run")
+    parser.add_argument('-k', '--keep', type=Path,
+                        help="directory in which to keep logs and uploads")
+    return parser
+
+
+def make_image(path: Path, size: int):
+    """Write a FITS file with a noisy 32-bit image of about ``size`` bytes.
+
+    The data resemble sky background so that compression ratios are
+    realistic; without NumPy, random bytes are used instead.
+    """
+    width = 2048
+    height = max(1, size // (4 * width))
+    cards = [
+        ("SIMPLE", "T"), ("BITPIX", "32"), ("NAXIS", "2"),
+        ("NAXIS1", str(width)), ("NAXIS2", str(height)),
+    ]
+    header = "".join(f"{key:<8}= {value:>20}".ljust(80)
+                     for key, value in cards) + "END".ljust(80)
+    header = header.ljust(-(-len(header) // 2880) * 2880)
+    try:
+        import numpy as np
+        rng = np.random.default_rng(len(path.name))
+        data = rng.normal(1000, 10, (height, width)).astype(">i4").tobytes()
+    except ImportError:
+        data = os.urandom(4 * width * height)
+    with path.open("wb") as f:
+        f.write(header.encode("ascii"))
+        f.write(data)
+        f.write(b"\0" * (-len(data) % 2880))
+
+
+class Endpoints:
+    """Stand-ins for every uploader, with their harness destinations.
+
+    Parameters
+    ----------
+    workdir: `pathlib.Path`
+        Directory for the ssh stand-in and any stored uploads.
+    latency: `float`
+        Latency in seconds added to each request.
+    bandwidth: `float`
+        Bandwidth limit in bytes per second; 0 disables shaping.
+    store: `bool`
+        Keep uploaded data under ``workdir`` rather than discarding it.
+    """
+
+    def __init__(self, workdir: Path, latency: float, bandwidth: float,
+                 store: bool):
+        root = workdir / "store" if store else None
+        self.http = standins.serve("http", root=root, bandwidth=bandwidth,
+                                   latency=latency)
+        self.h2 = standins.serve("h2", root=root, bandwidth=bandwidth,
+                                 latency=latency)
+        self.s3 = standins.serve("s3", root=root, bandwidth=bandwidth,
+                                 latency=latency)
+        self.scp_root = workdir / "store" / "scp"
+        self.bin = workdir / "bin"
+        self.bin.mkdir(exist_ok=True)
+        ssh = self.bin / "ssh"
+        ssh.write_text(
+            f"#!/bin/sh\nexec {shlex.quote(sys.executable)}"
+            f" {shlex.quote(standins.__file__)} ssh"
+            f" -b {bandwidth} -l {latency}"
+            f" -S {shlex.quote(str(workdir / 'ssh.state'))} \"$@\"\n"
+        )
+        ssh.chmod(0o755)
+        self.store = store
+
+    def destination(self, uploader: str,
+                    transport: Optional[str] = None) -> str:
+        """Harness destination URI for an uploader and HTTP transport."""
+        if uploader == "http":
+            # The h2 transport speaks HTTP/2 with prior knowledge, which
+            # needs its own stand-in.
+            server = self.h2 if transport == "h2" else self.http
+            return f"http://127.0.0.1:{server.server_address[1]}/bench"
+        if uploader == "boto":
+            return f"boto://127.0.0.1:{self.s3.server_address[1]}/bench/run"
+        if uploader == "minio":
+            return f"minio://127.0.0.1:{self.s3.server_address[1]}/bench/run"
+        if uploader == "scp":
+            return f"scp://bench/{self.scp_root}"
+        raise ValueError(f"No stand-in for uploader {uploader}")
+
+    def environment(self) -> Dict[str, str]:
+        """Environment directing the harness to the stand-ins."""
+        env = dict(os.environ)
+        env.update({
+            "PATH": f"{self.bin}{os.pathsep}{env.get('PATH', '')}",
+            "AWS_ENDPOINT_URL_S3":
+                f"http://127.0.0.1:{self.s3.server_address[1]}",
+            "AWS_ACCESS_KEY_ID": "bench",
+            "AWS_SECRET_ACCESS_KEY": "bench",
+            "AWS_DEFAULT_REGION": "us-east-1",
+            "AWS_CONFIG_FILE": os.devnull,
+            "AWS_SHARED_CREDENTIALS_FILE": os.devnull,
+            "MINIO_SECURE": "0",
+        })
+        return env
+
+    def reset(self):
+        """Remove files written by scp unless uploads are being kept."""
+        if not self.store:
+            shutil.rmtree(self.scp_root, ignore_errors=True)
+
+    def close(self):
+        self.http.shutdown()
+        self.h2.shutdown()
+        self.s3.shutdown()
+
+
+def run_harness(cmd: List[str], env: Dict[str, str], log: Path,
+                timeout: float):
+    """Run the harness until it has aggregated its metrics.
+
+    The harness sleeps forever once done, so it is stopped once its log
+    says so.  With ``--supervise`` it exits instead, after logging that the
+    supervisor is exiting.
+    """
+    with log.open("w") as f:
+        # The ssh stand-in forwards stdin, so the harness's must not stay
+        # open.
+        proc = subprocess.Popen(cmd, env=env, stdin=subprocess.DEVNULL,
+                                stdout=f, stderr=subprocess.STDOUT,
+                                start_new_session=True)
+    deadline = time.monotonic() + timeout
+    try:
+        while not any(marker in log.read_text(errors="replace")
+                      for marker in DONE_MARKERS):
+            if proc.poll() is not None:
+                if proc.returncode == 0:
+                    break
+                raise RuntimeError(f"Harness exited with {proc.returncode}"
+                                   f"; see {log}")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Harness timed out; see {log}")
+            time.sleep(0.2)
+    finally:
+        if proc.poll() is None:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait()
+
+
+def sent_bytes(log: Path) -> int:
+    """Return the bytes transferred by all harness processes of a run."""
+    return sum(int(match[2]) for match in
+               THROUGHPUT_RE.finditer(log.read_text(errors="replace")))
+
+
+def summarize(prefix: Path, nbytes: int,
+              image_bytes: int) -> Dict[str, object]:
+    """Compute throughput and stage statistics from a ``--metrics`` run.
+
+    The elapsed time runs from the first exposure starting to the last
+    transfer ending.  CPU time is that of the transferring threads, per GB
+    sent.  ``nbytes`` is the number of bytes sent and ``image_bytes`` that
+    of the uncompressed images.
+    """
+    first, last, transfers, cpu = float("inf"), float("-inf"), 0, 0.0
+    with prefix.with_name(prefix.name + ".csv").open() as f:
+        for row in csv.DictReader(f):
+            end = float(row["time"])
+            if row["stage"] == "lateness":
+                first = min(first, end)
+            elif row["stage"] == "transfer":
+                first = min(first, end - float(row["seconds"]))
+                last = max(last, end)
+                transfers += 1
+            elif row["stage"] == "transfer_cpu":
+                cpu += float(row["seconds"])
+    with prefix.with_name(prefix.name + ".json").open() as f:
+        stages = json.load(f)["stages"]
+    elapsed = last - first
+    return {
+        "transfers": transfers,
+        "elapsed": elapsed,
+        "throughput": nbytes / elapsed if elapsed > 0 else 0.0,
+        "image_throughput": image_bytes / elapsed if elapsed > 0 else 0.0,
+        "cpu_per_gb": cpu / (nbytes / 1e9) if nbytes else 0.0,
+        "stages": stages,
+    }
+
+
+def key_of(result: Dict[str, object]) -> tuple:
+    # Baselines from before a field was added lack it.
+    return tuple(result.get(name) for name in KEY_FIELDS)
+
+
+def compare(results: List[Dict[str, object]], baseline: Path,
+            tolerance: float) -> List[str]:
+    """Find regressions relative to a baseline results file.
+
+    Returns
+    -------
+    regressions: `list` [`str`]
+        One description per regressed run.
+    """
+    with baseline.open() as f:
+        previous = {key_of(r): r for r in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(key_of(result))
+        if old is None:
+            continue
+        name = ", ".join(f"{k}={result[k]}" for k in KEY_FIELDS
+                         if result[k])
+        if result["throughput"] < old["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {result['throughput'] / 1e6:.1f} MB/s"
+                f" < baseline {old['throughput'] / 1e6:.1f} MB/s"
+            )
+        new_p95 = result["stages"].get("transfer", {}).get("p95")
+        old_p95 = old["stages"].get("transfer", {}).get("p95")
+        if new_p95 and old_p95 and new_p95 > old_p95 * (1 + tolerance):
+            regressions.append(
+                f"{name}: transfer p95 {new_p95:.3f} s"
+                f" > baseline {old_p95:.3f} s"
+            )
+    return regressions
+
+
+def main():
+    """Main program."""
+
+    parser = build_parser()
+    args = parser.parse_args()
+    for compress in args.compress:
+        if compress not in ("off", "on"):
+            parser.error(f"Unknown compression setting {compress}")
+    for transport in args.transports:
+        if transport not in ("session", "sendfile", "h2"):
+            parser.error(f"Unknown HTTP transport {transport}")
+    # Only the http uploader has a choice of transport.
+    runs = [(uploader, transport)
+            for uploader in args.uploaders
+            for transport in (args.transports if uploader == "http"
+                              else [None])]
+
+    if args.keep is not None:
+        args.keep.mkdir(parents=True, exist_ok=True)
+        workdir = Path(args.keep)
+        cleanup: Optional[tempfile.TemporaryDirectory] = None
+    else:
+        cleanup = tempfile.TemporaryDirectory(prefix="apxfr-bench-")
+        workdir = Path(cleanup.name)
+    endpoints = Endpoints(workdir, args.latency, args.bandwidth,
+                          args.keep is not None)
+    env = endpoints.environment()
+
+    results = []
+    try:
+        for size in args.sizes:
+            image = workdir / f"image-{size}.fits"
+            make_image(image, size)
+            for (uploader, transport), ccds, compress in itertools.product(
+                runs, args.ccds, args.compress
+            ):
+                label = f"{uploader}-{transport}" if transport else uploader
+                name = f"{label}-{ccds}-{size}-{compress}"
+                prefix = workdir / name
+                # Exposures are due as soon as the harness starts.
+                start = datetime.now()
+                cmd = [
+                    sys.executable, str(HARNESS),
+                    "-d", endpoints.destination(uploader, transport),
+                    "-s", f"{start.hour:02d}:{start.minute:02d}",
+                    "-n", str(args.numexp), "-c", str(ccds), "-i", "0",
+                    "-I", str(image), "-t", str(workdir), "-M", str(prefix),
+                    "-e", args.engine,
+                ]
+                if transport is not None:
+                    cmd += ["--http-transport", transport]
+                if compress == "on":
+                    cmd += ["-z", "--compressor", args.compressor]
+                cmd += shlex.split(args.harness_args)
+                print(f"Running {name}", flush=True)
+                log = workdir / f"{name}.log"
+                try:
+                    run_harness(cmd, env, log, args.timeout)
+                finally:
+                    endpoints.reset()
+                image_bytes = image.stat().st_size * ccds * args.numexp
+                nbytes = sent_bytes(log)
+                result = {
+                    "uploader": uploader,
+                    "transport": transport,
+                    "ccds": ccds,
+                    "size": size,
+                    "compress": compress == "on",
+                    "engine": args.engine,
+                    "extra": args.harness_args,
+                    "latency": args.latency,
+                    "bandwidth": args.bandwidth,
+                    "exposures": args.numexp,
+                    "bytes": nbytes,
+                    "image_bytes": image_bytes,
+                }
+                result.update(summarize(prefix, nbytes, image_bytes))
+                results.append(result)
+                print(f"{name}: {result['throughput'] / 1e6:.1f} MB/s"
+                      f" sent ({result['image_throughput'] / 1e6:.1f} MB/s"
+                      f" of images) in {result['elapsed']:.2f} s"
+                      f", {result['cpu_per_gb']:.2f} CPU s/GB", flush=True)
+    finally:
+        endpoints.close()
+        if cleanup is not None:
+            cleanup.cleanup()
+
+    with args.output.open("w") as f:
+        json.dump({
+            "created": datetime.now().isoformat(),
+            "host": platform.node(),
+            "cpus": os.cpu_count(),
+            "latency": args.latency,
+            "bandwidth": args.bandwidth,
+            "results": results,
+        }, f, indent=2)
+
+    if args.baseline is not None:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
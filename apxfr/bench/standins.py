@@ -0,0 +1,501 @@
+#!/usr/bin/env python
+
+"""Local stand-in endpoints for benchmarking the transfer harness offline.
+
+* ``http``: a sink accepting HTTP PUT (and serving GET/HEAD with ranges).
+* ``h2``: the same sink for HTTP/2 with prior knowledge (h2c), as used by
+  the harness's h2 transport on plain http.
+* ``s3``: a minimal S3-compatible object store (path-style PUT, multipart
+  upload, GET/HEAD), enough for boto3 without credentials checking.
+* ``ssh``: a stand-in for the ``ssh`` client that runs the remote command
+  locally, as used by the scp uploader.
+
+All of them can inject a fixed latency per request and shape the incoming
+bandwidth with a token bucket shared by all connections, approximating a
+long-haul link.
+"""
+
+from __future__ import annotations
+import argparse
+import fcntl
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+from pathlib import Path
+import re
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+import uuid
+
+
+CHUNK = 64 * 1024
+
+
+class Shaper:
+    """Token bucket limiting the aggregate rate of a stand-in.
+
+    Parameters
+    ----------
+    bandwidth: `float`
+        Rate limit in bytes per second; 0 disables shaping.
+    latency: `float`
+        Delay in seconds added once per request or connection.
+    state: `pathlib.Path`, optional
+        File holding the bucket state, so that separate processes (one per
+        ssh connection) share the same link.
+    """
+
+    def __init__(self, bandwidth: float = 0.0, latency: float = 0.0,
+                 state: Optional[Path] = None):
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.state = state
+        self.lock = threading.Lock()
+        self.next_free = 0.0
+
+    def delay(self):
+        """Wait for the injected latency."""
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def consume(self, nbytes: int):
+        """Wait until ``nbytes`` may pass the shared link."""
+        if self.bandwidth <= 0:
+            return
+        with self.lock:
+            if self.state is None:
+                now = time.monotonic()
+                start = max(now, self.next_free)
+                self.next_free = start + nbytes / self.bandwidth
+                wait = self.next_free - now
+            else:
+                with self.state.open("a+") as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    f.seek(0)
+                    # CLOCK_MONOTONIC is system-wide, so comparable across
+                    # processes.
+                    now = time.monotonic()
+                    start = max(now, float(f.read() or 0))
+                    next_free = start + nbytes / self.bandwidth
+                    f.seek(0)
+                    f.truncate()
+                    f.write(repr(next_free))
+                    wait = next_free - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    """HTTP PUT sink with optional storage under a root directory.
+
+    Without a root, bodies are read and counted but discarded, so the sink
+    does not add disk I/O to the measurement.
+    """
+
+    protocol_version = "HTTP/1.1"
+    root: Optional[Path] = None
+    shaper = Shaper()
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+    def _path(self) -> Path:
+        return Path(unquote(urlsplit(self.path).path).lstrip("/"))
+
+    def _read_raw(self, length: int, digest) -> bytes:
+        """Read exactly ``length`` body bytes through the shaper."""
+        parts = []
+        while length > 0:
+            data = self.rfile.read(min(CHUNK, length))
+            if not data:
+                raise ConnectionError("Client closed connection")
+            self.shaper.consume(len(data))
+            length -= len(data)
+            if digest is not None:
+                digest.update(data)
+            if self.root is not None:
+                parts.append(data)
+        return b"".join(parts)
+
+    def _read_chunked(self, digest) -> bytes:
+        """Read a chunked or aws-chunked body, dropping trailers."""
+        parts = []
+        while True:
+            line = self.rfile.readline()
+            self.shaper.consume(len(line))
+            size = int(line.split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                break
+            parts.append(self._read_raw(size, digest))
+            self.rfile.readline()
+        while self.rfile.readline().strip():
+            pass
+        return b"".join(parts)
+
+    def read_body(self) -> Tuple[bytes, str]:
+        """Read the request body.
+
+        Returns
+        -------
+        body: `bytes`
+            The decoded body if it is being stored, otherwise empty.
+        md5: `str`
+            Hex MD5 digest of the decoded body.
+        """
+        digest = hashlib.md5()
+        encoding = self.headers.get("Content-Encoding", "")
+        if (self.headers.get("Transfer-Encoding", "") == "chunked"
+                or "aws-chunked" in encoding):
+            body = self._read_chunked(digest)
+        else:
+            body = self._read_raw(int(self.headers.get("Content-Length", 0)),
+                                  digest)
+        return body, digest.hexdigest()
+
+    def store(self, path: Path, body: bytes):
+        if self.root is not None:
+            dest = self.root / path
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            dest.write_bytes(body)
+
+    def reply(self, code: int, body: bytes = b"", headers: dict = {}):
+        self.send_response(code)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_PUT(self):
+        self.shaper.delay()
+        body, md5 = self.read_body()
+        self.store(self._path(), body)
+        self.reply(201, headers={"ETag": f'"{md5}"'})
+
+    def do_GET(self):
+        self.shaper.delay()
+        path = self.root / self._path() if self.root else None
+        if path is None or not path.is_file():
+            self.reply(404)
+            return
+        data = path.read_bytes()
+        match = re.match(r"bytes=(\d*)-(\d*)$", self.headers.get("Range", ""))
+        if match:
+            if match[1]:
+                start = int(match[1])
+                end = int(match[2]) if match[2] else len(data) - 1
+            else:
+                start = max(len(data) - int(match[2]), 0)
+                end = len(data) - 1
+            end = min(end, len(data) - 1)
+            self.reply(206, data[start:end + 1], {
+                "Content-Range": f"bytes {start}-{end}/{len(data)}"
+            })
+        else:
+            self.reply(200, data)
+
+    do_HEAD = do_GET
+
+
+class H2SinkHandler(socketserver.BaseRequestHandler):
+    """HTTP/2 (h2c) PUT sink with optional storage under a root directory.
+
+    Streams of a connection are multiplexed, so the injected latency delays
+    each response rather than the reading of the connection.
+    """
+
+    root: Optional[Path] = None
+    shaper = Shaper()
+    # Flow-control window granted to the client, so that it is not the
+    # bottleneck on a fast local link.
+    WINDOW = 16 * 1024 * 1024
+
+    def setup(self):
+        from h2.config import H2Configuration
+        from h2.connection import H2Connection
+        from h2.settings import SettingCodes
+        self.conn = H2Connection(H2Configuration(client_side=False,
+                                                 header_encoding="utf-8"))
+        self.lock = threading.Lock()
+        self.streams: dict = {}
+        self.conn.initiate_connection()
+        self.conn.update_settings(
+            {SettingCodes.INITIAL_WINDOW_SIZE: self.WINDOW}
+        )
+        self.conn.increment_flow_control_window(
+            self.WINDOW - self.conn.inbound_flow_control_window
+        )
+        self._flush()
+
+    def _flush(self):
+        with self.lock:
+            data = self.conn.data_to_send()
+            if data:
+                self.request.sendall(data)
+
+    def _respond(self, stream_id: int, status: int, headers: dict = {}):
+        with self.lock:
+            self.conn.send_headers(stream_id, [
+                (":status", str(status)), ("content-length", "0"),
+                *headers.items()
+            ], end_stream=True)
+        self._flush()
+
+    def _ended(self, stream_id: int):
+        stream = self.streams.pop(stream_id)
+        if stream["method"] == "PUT":
+            if self.root is not None:
+                dest = self.root / stream["path"]
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                dest.write_bytes(b"".join(stream["parts"]))
+            status = 201
+            headers = {"etag": f'"{stream["digest"].hexdigest()}"'}
+        else:
+            status, headers = 200, {}
+        if self.shaper.latency > 0:
+            timer = threading.Timer(self.shaper.latency, self._respond,
+                                    (stream_id, status, headers))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._respond(stream_id, status, headers)
+
+    def handle(self):
+        import h2.events
+        import h2.exceptions
+        while True:
+            try:
+                data = self.request.recv(CHUNK)
+            except OSError:
+                return
+            if not data:
+                return
+            self.shaper.consume(len(data))
+            try:
+                with self.lock:
+                    events = self.conn.receive_data(data)
+            except h2.exceptions.ProtocolError as exc:
+                logging.debug("h2: %s", exc)
+                self._flush()
+                return
+            for event in events:
+                if isinstance(event, h2.events.RequestReceived):
+                    headers = dict(event.headers)
+                    path = unquote(urlsplit(headers[":path"]).path)
+                    self.streams[event.stream_id] = {
+                        "method": headers[":method"],
+                        "path": Path(path.lstrip("/")),
+                        "digest": hashlib.md5(),
+                        "parts": [],
+                    }
+                elif isinstance(event, h2.events.DataReceived):
+                    stream = self.streams.get(event.stream_id)
+                    if stream is not None:
+                        stream["digest"].update(event.data)
+                        if self.root is not None:
+                            stream["parts"].append(event.data)
+                    with self.lock:
+                        self.conn.acknowledge_received_data(
+                            event.flow_controlled_length, event.stream_id
+                        )
+                elif isinstance(event, h2.events.StreamEnded):
+                    if event.stream_id in self.streams:
+                        self._ended(event.stream_id)
+                elif isinstance(event, h2.events.StreamReset):
+                    self.streams.pop(event.stream_id, None)
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    self._flush()
+                    return
+            self._flush()
+
+
+class S3Handler(SinkHandler):
+    """Minimal path-style S3 API: buckets, objects, and multipart uploads."""
+
+    uploads: dict = {}
+    uploads_lock = threading.Lock()
+
+    def _xml(self, code: int, tag: str, fields: dict):
+        inner = "".join(f"<{k}>{v}</{k}>" for k, v in fields.items())
+        body = (f'<?xml version="1.0" encoding="UTF-8"?>'
+                f'<{tag} xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                f'{inner}</{tag}>').encode()
+        self.reply(code, body, {"Content-Type": "application/xml"})
+
+    def _bucket_key(self) -> Tuple[str, str]:
+        path = unquote(urlsplit(self.path).path).lstrip("/")
+        bucket, _, key = path.partition("/")
+        return bucket, key
+
+    def do_PUT(self):
+        self.shaper.delay()
+        query = parse_qs(urlsplit(self.path).query)
+        bucket, key = self._bucket_key()
+        body, md5 = self.read_body()
+        if not key:
+            self.reply(200)
+        elif "uploadId" in query:
+            with self.uploads_lock:
+                parts = self.uploads.get(query["uploadId"][0])
+                if parts is None:
+                    self.reply(404)
+                    return
+                parts[int(query["partNumber"][0])] = body
+            self.reply(200, headers={"ETag": f'"{md5}"'})
+        else:
+            self.store(Path(bucket, key), body)
+            self.reply(200, headers={"ETag": f'"{md5}"'})
+
+    def do_POST(self):
+        self.shaper.delay()
+        query = parse_qs(urlsplit(self.path).query, keep_blank_values=True)
+        bucket, key = self._bucket_key()
+        self.read_body()
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            with self.uploads_lock:
+                self.uploads[upload_id] = {}
+            self._xml(200, "InitiateMultipartUploadResult", {
+                "Bucket": bucket, "Key": key, "UploadId": upload_id
+            })
+        elif "uploadId" in query:
+            with self.uploads_lock:
+                parts = self.uploads.pop(query["uploadId"][0], None)
+            if parts is None:
+                self.reply(404)
+                return
+            self.store(Path(bucket, key),
+                       b"".join(parts[n] for n in sorted(parts)))
+            self._xml(200, "CompleteMultipartUploadResult", {
+                "Bucket": bucket, "Key": key,
+                "ETag": f'"{uuid.uuid4().hex}-{len(parts)}"'
+            })
+        else:
+            self.reply(400)
+
+    def do_DELETE(self):
+        self.shaper.delay()
+        query = parse_qs(urlsplit(self.path).query)
+        if "uploadId" in query:
+            with self.uploads_lock:
+                self.uploads.pop(query["uploadId"][0], None)
+        elif self.root is not None:
+            (self.root / Path(*self._bucket_key())).unlink(missing_ok=True)
+        self.reply(204)
+
+    def do_GET(self):
+        bucket, key = self._bucket_key()
+        if not key:
+            self._xml(200, "ListBucketResult", {"Name": bucket})
+            return
+        super().do_GET()
+
+    do_HEAD = do_GET
+
+
+def serve(kind: str, port: int = 0, root: Optional[Path] = None,
+          bandwidth: float = 0.0,
+          latency: float = 0.0) -> socketserver.TCPServer:
+    """Start an HTTP, h2c, or S3 stand-in on a background thread.
+
+    Parameters
+    ----------
+    kind: `str`
+        "http", "h2", or "s3".
+    port: `int`, optional
+        Port to listen on; 0 picks a free port.
+    root: `pathlib.Path`, optional
+        Directory in which to store uploads; discard them if `None`.
+    bandwidth: `float`, optional
+        Aggregate rate limit in bytes per second; 0 disables shaping.
+    latency: `float`, optional
+        Delay in seconds added to each request.
+
+    Returns
+    -------
+    server: `socketserver.TCPServer`
+        The running server; ``server.server_address`` gives its port.
+    """
+    base = {"http": SinkHandler, "h2": H2SinkHandler, "s3": S3Handler}[kind]
+    handler = type(f"Bench{base.__name__}", (base,), {
+        "root": root,
+        "shaper": Shaper(bandwidth, latency),
+    })
+    if kind == "s3":
+        handler.uploads = {}
+    server_class = (socketserver.ThreadingTCPServer if kind == "h2"
+                    else ThreadingHTTPServer)
+    server = server_class(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def fake_ssh(args: argparse.Namespace):
+    """Run the command given to ``ssh`` locally, shaping its input."""
+    shaper = Shaper(args.bandwidth, args.latency, args.state)
+    shaper.delay()
+    proc = subprocess.Popen(["sh", "-c", " ".join(args.command)],
+                            stdin=subprocess.PIPE)
+    while True:
+        data = sys.stdin.buffer.read1(CHUNK)
+        if not data:
+            break
+        shaper.consume(len(data))
+        proc.stdin.write(data)
+    proc.stdin.close()
+    sys.exit(proc.wait())
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build an argument parser for command-line options."""
+
+    parser = argparse.ArgumentParser(
+        description="Run a local stand-in transfer endpoint."
+    )
+    parser.add_argument('kind', choices=("http", "h2", "s3", "ssh"),
+                        help="endpoint to emulate")
+    parser.add_argument('-p', '--port', type=int, default=8000,
+                        help="port to listen on (http, h2, s3)")
+    parser.add_argument('-r', '--root', type=Path,
+                        help=("directory in which to store uploads"
+                              " (http, h2, s3)"))
+    parser.add_argument('-b', '--bandwidth', type=float, default=0.0,
+                        help="bandwidth limit in bytes per second")
+    parser.add_argument('-l', '--latency', type=float, default=0.0,
+                        help="latency in seconds added to each request")
+    parser.add_argument('-S', '--state', type=Path,
+                        help="file sharing the bandwidth limit (ssh)")
+    parser.add_argument('-o', dest='options', action='append', default=[],
+                        help="ssh option, ignored (ssh)")
+    parser.add_argument('command', nargs='*',
+                        help="host and remote command (ssh)")
+    return parser
+
+
+def main():
+    """Main program."""
+
+    args = build_parser().parse_intermixed_args()
+    if args.kind == "ssh":
+        # The first word is the host, which is ignored.
+        args.command = args.command[1:]
+        fake_ssh(args)
+    server = serve(args.kind, args.port, args.root, args.bandwidth,
+                   args.latency)
+    print(f"Serving {args.kind} on port {server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(1000000)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
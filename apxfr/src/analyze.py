@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+"""Reconstruct end-to-end exposure latency from harness output.
+
+The latency of an exposure is the time from its scheduled readout
+(``Waiter.base_time + num * interval``) until the last of its CCDs has been
+transferred.  Inputs are harness logs (plain or gzipped, as captured from
+any number of nodes) or the ``PREFIX.csv`` samples written with
+``--metrics``.  Files are read a line at a time; only one record per
+exposure and CCD is kept, so multi-GB logs are processed in bounded memory.
+"""
+
+from __future__ import annotations
+import argparse
+import csv
+from dataclasses import dataclass, field
+from datetime import datetime
+import gzip
+import json
+import math
+from pathlib import Path
+import re
+import sys
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+
+LOG_LINE = re.compile(
+    r"(?P<ccd>\S+) (?P<ts>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) (?P<msg>.*)"
+)
+SCHEDULE = re.compile(
+    r"(?:Sleeping|Late) \S+ seconds for exposure (?P<num>\d+) at (?P<when>.+)"
+)
+UPLOADER = re.compile(r"Creating uploader for (?P<dest>\S+)")
+TRANSFER_END = re.compile(
+    r"End transfer(?:_async)? = \S+ for exposure (?P<num>\d+)"
+    r" seqnum (?P<seqnum>\d+)"
+)
+
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build an argument parser for command-line options."""
+
+    parser = argparse.ArgumentParser(
+        description="Compute end-to-end exposure latency from harness output."
+    )
+    parser.add_argument('inputs', metavar='FILE', nargs='+', type=Path,
+                        help=("harness log (optionally .gz) or --metrics CSV;"
+                              " '-' reads a log from standard input"))
+    parser.add_argument('-s', '--scheme', metavar='SCHEME',
+                        help=("destination scheme for inputs that do not"
+                              " record one"))
+    parser.add_argument('-o', '--exposures', metavar='CSV', type=Path,
+                        help="write one row per exposure to this file")
+    return parser
+
+
+@dataclass
+class Exposure:
+    """Completion state of one exposure across all nodes and CCDs."""
+
+    scheduled: float
+    ends: Dict[str, float] = field(default_factory=dict)
+
+    def land(self, ccd: str, end: float):
+        """Record the completion of one CCD's transfer.
+
+        Retried or sliced transfers may finish more than once; the last
+        completion counts.
+        """
+        self.ends[ccd] = max(end, self.ends.get(ccd, -math.inf))
+
+    @property
+    def latencies(self) -> List[float]:
+        """Latency of each CCD, sorted (`list` [`float`])."""
+        return sorted(end - self.scheduled for end in self.ends.values())
+
+    @property
+    def slowest(self) -> Tuple[str, float]:
+        """Name and latency of the last CCD to land."""
+        ccd = max(self.ends, key=self.ends.get)
+        return ccd, self.ends[ccd] - self.scheduled
+
+
+def quantile(values: List[float], q: float) -> float:
+    """Quantile of sorted values with linear interpolation."""
+    if not values:
+        return math.nan
+    pos = q * (len(values) - 1)
+    lo = math.floor(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def scheme_of(dest: str) -> str:
+    """Return the scheme of a destination URI."""
+    return dest.split("://", 1)[0] if "://" in dest else dest
+
+
+def open_text(path: Path) -> TextIO:
+    """Open a possibly compressed input for reading text."""
+    if str(path) == "-":
+        return sys.stdin
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", errors="replace")
+    return path.open(errors="replace")
+
+
+def parse_log(
+    f: TextIO,
+    scheme: Optional[str],
+) -> Iterator[Tuple[str, int, Optional[float], Optional[str], float]]:
+    """Extract exposure events from a harness log.
+
+    Parameters
+    ----------
+    f: `typing.TextIO`
+        Log to read.
+    scheme: `str` or `None`
+        Scheme to use until the log names its destination.
+
+    Yields
+    ------
+    event: `tuple`
+        ``(scheme, seqnum, scheduled, ccd, end)``.  Either ``scheduled``
+        (a POSIX time) is given with ``ccd`` `None`, or ``ccd`` is given with
+        the POSIX time its transfer ended.
+    """
+    # Scheduled times are logged by exposure number; transfer ends carry
+    # both the number and the sequence number.
+    scheduled: Dict[int, float] = {}
+    for line in f:
+        match = LOG_LINE.search(line)
+        if not match:
+            continue
+        msg = match["msg"]
+        end = TRANSFER_END.match(msg)
+        if end:
+            num = int(end["num"])
+            if num not in scheduled:
+                continue
+            ts = datetime.fromisoformat(match["ts"].replace(",", "."))
+            seqnum = int(end["seqnum"])
+            yield scheme, seqnum, scheduled[num], None, 0.0
+            yield scheme, seqnum, None, match["ccd"], ts.timestamp()
+            continue
+        sched = SCHEDULE.match(msg)
+        if sched:
+            when = datetime.fromisoformat(sched["when"].strip())
+            scheduled[int(sched["num"])] = when.timestamp()
+            continue
+        uploader = UPLOADER.match(msg)
+        if uploader:
+            scheme = scheme_of(uploader["dest"])
+
+
+def parse_metrics(
+    f: TextIO,
+    scheme: Optional[str],
+) -> Iterator[Tuple[str, int, Optional[float], Optional[str], float]]:
+    """Extract exposure events from a ``--metrics`` CSV file.
+
+    The scheduled time is the time of a lateness sample minus its value.
+
+    Parameters
+    ----------
+    f: `typing.TextIO`
+        CSV file to read.
+    scheme: `str` or `None`
+        Destination scheme of the run.
+
+    Yields
+    ------
+    event: `tuple`
+        As for `parse_log`.
+    """
+    for row in csv.DictReader(f):
+        if not row["seqnum"]:
+            continue
+        seqnum = int(row["seqnum"])
+        if row["stage"] == "lateness":
+            yield (scheme, seqnum,
+                   float(row["time"]) - float(row["seconds"]), None, 0.0)
+        elif row["stage"] == "transfer":
+            yield scheme, seqnum, None, row["ccd"], float(row["time"])
+
+
+def analyze(inputs: List[Path],
+            scheme: Optional[str] = None) -> Dict[Tuple[str, int], Exposure]:
+    """Reconstruct the completion of every exposure.
+
+    Parameters
+    ----------
+    inputs: `list` [`pathlib.Path`]
+        Harness logs or ``--metrics`` CSV files.
+    scheme: `str`, optional
+        Destination scheme for inputs that do not record one.
+
+    Returns
+    -------
+    exposures: `dict`
+        `Exposure` keyed by destination scheme and sequence number.
+    """
+    exposures: Dict[Tuple[str, int], Exposure] = {}
+    for path in inputs:
+        file_scheme = scheme
+        if path.suffix == ".csv":
+            summary = path.with_suffix(".json")
+            if file_scheme is None and summary.exists():
+                with summary.open() as f:
+                    file_scheme = scheme_of(json.load(f).get("destination",
+                                                             ""))
+            parser = parse_metrics
+        else:
+            parser = parse_log
+        with open_text(path) as f:
+            for ev_scheme, seqnum, scheduled, ccd, end in parser(
+                f, file_scheme
+            ):
+                key = (ev_scheme or "unknown", seqnum)
+                if scheduled is not None:
+                    # All CCDs share a schedule; keep the earliest estimate.
+                    if key in exposures:
+                        exposure = exposures[key]
+                        exposure.scheduled = min(exposure.scheduled,
+                                                 scheduled)
+                    else:
+                        exposures[key] = Exposure(scheduled)
+                elif key in exposures:
+                    exposures[key].land(ccd, end)
+    return exposures
+
+
+def write_exposures(exposures: Dict[Tuple[str, int], Exposure], path: Path):
+    """Write one row per exposure with its CCD latency distribution."""
+    with path.open("w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["scheme", "seqnum", "scheduled", "ccds", "p50",
+                         "p95", "latency", "slowest_ccd"])
+        for (scheme, seqnum), exposure in sorted(exposures.items()):
+            if not exposure.ends:
+                continue
+            latencies = exposure.latencies
+            ccd, latency = exposure.slowest
+            writer.writerow([
+                scheme, seqnum,
+                datetime.fromtimestamp(exposure.scheduled).isoformat(),
+                len(latencies), quantile(latencies, 0.5),
+                quantile(latencies, 0.95), latency, ccd,
+            ])
+
+
+def main():
+    """Main program."""
+
+    parser = build_parser()
+    args = parser.parse_args()
+
+    exposures = analyze(args.inputs, args.scheme)
+    if args.exposures is not None:
+        write_exposures(exposures, args.exposures)
+
+    by_scheme: Dict[str, List[float]] = {}
+    for (scheme, _), exposure in exposures.items():
+        if exposure.ends:
+            by_scheme.setdefault(scheme, []).append(exposure.slowest[1])
+    for scheme, latencies in sorted(by_scheme.items()):
+        latencies.sort()
+        stats = ", ".join(f"p{round(q * 100)} = {quantile(latencies, q)}"
+                          for q in QUANTILES)
+        print(f"{scheme}: {len(latencies)} exposures"
+              f", mean = {sum(latencies) / len(latencies)}, {stats}"
+              f", max = {latencies[-1]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+"""Exposure bundles: the CCD images of one exposure packed into one object.
+
+A bundle is laid out as::
+
+    MAGIC | index length | JSON index | CCD images
+
+where the header is `HEADER` (8-byte magic, little-endian 64-bit index
+length) and the index maps each CCD name to the ``offset`` and ``size`` of
+its image within the object and the ``name`` of the file it came from.
+Images start on `ALIGN`-byte boundaries so that ranged reads of one CCD
+line up with storage blocks.
+
+Run as a program, this extracts CCDs from a bundle by ranged reads, without
+downloading the whole object.
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+from pathlib import Path
+import struct
+import sys
+from typing import Callable, Mapping, Tuple
+
+
+MAGIC = b"APXFRBDL"
+HEADER = struct.Struct("<8sQ")
+ALIGN = 4096
+
+# Bytes to fetch on the first read, enough for the index of a full node.
+FIRST_READ = 64 * 1024
+
+# Fetch bytes [start, end) of an object.
+Fetcher = Callable[[int, int], bytes]
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGN) * ALIGN
+
+
+def pack(
+    images: Mapping[str, Tuple[str, memoryview]],
+) -> Tuple[bytearray, dict]:
+    """Pack images into a bundle.
+
+    Parameters
+    ----------
+    images: `dict` [`str`, `tuple`]
+        Original file name and bytes of each image, keyed by CCD name.
+
+    Returns
+    -------
+    bundle: `bytearray`
+        The packed object.
+    index: `dict`
+        Location of each image within ``bundle``.
+    """
+    # The offsets depend on the length of the index, which contains them;
+    # lay out with a provisional length until it stops changing.
+    index_len = 0
+    while True:
+        offset = _aligned(HEADER.size + index_len)
+        ccds = {}
+        for ccd, (name, data) in images.items():
+            ccds[ccd] = {"name": name, "offset": offset,
+                         "size": data.nbytes}
+            offset = _aligned(offset + data.nbytes)
+        index = json.dumps({"ccds": ccds}).encode()
+        if len(index) == index_len:
+            break
+        index_len = len(index)
+    bundle = bytearray(offset)
+    HEADER.pack_into(bundle, 0, MAGIC, len(index))
+    bundle[HEADER.size:HEADER.size + len(index)] = index
+    for ccd, (_, data) in images.items():
+        start = ccds[ccd]["offset"]
+        bundle[start:start + data.nbytes] = data
+    return bundle, {"ccds": ccds}
+
+
+def read_index(fetch: Fetcher) -> dict:
+    """Read the index of a bundle.
+
+    Parameters
+    ----------
+    fetch: callable
+        Returns bytes ``[start, end)`` of the bundle; may return fewer if
+        the bundle is shorter.
+
+    Returns
+    -------
+    index: `dict`
+        The bundle index.
+    """
+    data = fetch(0, FIRST_READ)
+    magic, length = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not an exposure bundle")
+    end = HEADER.size + length
+    if len(data) < end:
+        data += fetch(len(data), end)
+    return json.loads(data[HEADER.size:end])
+
+
+def read_ccd(fetch: Fetcher, ccd: str, index: dict) -> bytes:
+    """Read the image of one CCD from a bundle.
+
+    Parameters
+    ----------
+    fetch: callable
+        As for `read_index`.
+    ccd: `str`
+        Name of the CCD.
+    index: `dict`
+        Index returned by `read_index`.
+
+    Returns
+    -------
+    image: `bytes`
+        The image of the CCD.
+    """
+    entry = index["ccds"][ccd]
+    return fetch(entry["offset"], entry["offset"] + entry["size"])
+
+
+def fetcher(url: str) -> Fetcher:
+    """Make a ranged reader for a bundle.
+
+    Parameters
+    ----------
+    url: `str`
+        Local path, http or https URL, or gsapi://bucket/key,
+        boto://host/bucket/key, or minio://host/bucket/key.  As for
+        uploads, minio connections use TLS unless ``MINIO_SECURE`` is set
+        to 0.
+
+    Returns
+    -------
+    fetch: callable
+        Returns bytes ``[start, end)`` of the bundle.
+    """
+    if url.startswith("http://") or url.startswith("https://"):
+        import requests
+        session = requests.Session()
+
+        def fetch(start: int, end: int) -> bytes:
+            r = session.get(url, headers={"Range": f"bytes={start}-{end - 1}"})
+            r.raise_for_status()
+            # A server that ignores ranges returns the whole object.
+            return r.content if r.status_code == 206 else r.content[start:end]
+
+        return fetch
+    if url.startswith("gsapi://"):
+        from google.cloud import storage
+        bucket, key = url[len("gsapi://"):].split("/", 1)
+        blob = storage.Client().bucket(bucket).blob(key)
+        return lambda start, end: blob.download_as_bytes(start=start,
+                                                         end=end - 1)
+    if url.startswith("boto://"):
+        import boto3
+        _, bucket, key = url[len("boto://"):].split("/", 2)
+        client = boto3.client("s3")
+        return lambda start, end: client.get_object(
+            Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}"
+        )["Body"].read()
+    if url.startswith("minio://"):
+        from minio import Minio
+        host, bucket, key = url[len("minio://"):].split("/", 2)
+        secure = os.environ.get("MINIO_SECURE", "1") != "0"
+        conn = Minio(host, secure=secure)
+
+        def fetch(start: int, end: int) -> bytes:
+            r = conn.get_object(bucket, key, offset=start, length=end - start)
+            try:
+                return r.read()
+            finally:
+                r.close()
+                r.release_conn()
+
+        return fetch
+    path = Path(url)
+
+    def fetch(start: int, end: int) -> bytes:
+        with path.open("rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    return fetch
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build an argument parser for command-line options."""
+
+    parser = argparse.ArgumentParser(
+        description="List or extract CCDs from an exposure bundle."
+    )
+    parser.add_argument('url', metavar='URL',
+                        help=("bundle path or http, https, gsapi, boto, or"
+                              " minio URL"))
+    parser.add_argument('ccds', metavar='CCD', nargs='*',
+                        help="CCDs to extract; list the index if none")
+    parser.add_argument('-o', '--output', type=Path, default=Path("."),
+                        help="directory in which to write extracted images")
+    return parser
+
+
+def main():
+    """Main program."""
+
+    args = build_parser().parse_args()
+    fetch = fetcher(args.url)
+    index = read_index(fetch)
+    if not args.ccds:
+        for ccd, entry in index["ccds"].items():
+            print(f"{ccd} {entry['name']} offset = {entry['offset']}"
+                  f", size = {entry['size']}")
+        return
+    args.output.mkdir(parents=True, exist_ok=True)
+    for ccd in args.ccds:
+        if ccd not in index["ccds"]:
+            sys.exit(f"No CCD {ccd} in bundle")
+        dest = args.output / index["ccds"][ccd]["name"]
+        dest.write_bytes(read_ccd(fetch, ccd, index))
+        print(f"Wrote {dest}")
+
+
+if __name__ == "__main__":
+    main()
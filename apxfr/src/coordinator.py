@@ -0,0 +1,173 @@
+"""Admission of the transfers of the CCD worker processes of a node.
+
+The harness's fork engine runs a `BandwidthCoordinator` in the main
+process, and its workers ask it over a Unix socket before each transfer,
+so that they share the node's uplink rather than compete for it.
+"""
+
+from __future__ import annotations
+import itertools
+import logging
+from pathlib import Path
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class BandwidthCoordinator:
+    """Admit the transfers of all CCD worker processes on a node.
+
+    Forked workers are released by the same `Waiter` tick and would
+    otherwise compete blindly for the uplink, so that a few CCDs finish
+    early while the rest straggle.  The coordinator runs in the main
+    process and serves a Unix socket.  For each transfer, a worker
+    connects and sends the deadline of the exposure, the size of the
+    transfer, and its CCD.  It starts the transfer when the coordinator
+    replies, and releases the admission by closing the connection, which
+    also happens if it dies.
+
+    At most ``slots`` transfers run at once, and admissions are paced by a
+    token bucket so that their bytes average at most ``bandwidth`` per
+    second.  Waiting transfers are admitted in order of:
+
+    * "edf": earliest exposure deadline, then fair share.
+    * "fair": fair share, the CCD that has sent the fewest bytes first.
+
+    Parameters
+    ----------
+    path: `pathlib.Path`
+        Path of the socket to create.
+    slots: `int`, optional
+        Maximum number of concurrent transfers; 0 for no limit.
+    bandwidth: `float`, optional
+        Rate limit in bytes per second; 0 for no limit.
+    schedule: `str`, optional
+        Order of admission, one of `SCHEDULES`.
+    """
+
+    SCHEDULES = ("edf", "fair")
+    # Seconds of bandwidth that may be admitted at once after an idle gap.
+    BURST = 1.0
+
+    def __init__(self, path: Path, slots: int = 0, bandwidth: float = 0.0,
+                 schedule: str = "edf"):
+        if schedule not in self.SCHEDULES:
+            raise ValueError(f"Unknown schedule {schedule}")
+        logging.info(f"Coordinating transfers on {path}: slots = {slots}"
+                     f", bandwidth = {bandwidth}, schedule = {schedule}")
+        self.path = path
+        self.slots = slots
+        self.bandwidth = bandwidth
+        self.schedule = schedule
+        # Listen before the workers are forked so that they can connect
+        # as soon as they start; connections wait in the backlog until
+        # `start` is called.
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(str(path))
+        self.sock.listen(128)
+        self.cond = threading.Condition()
+        self.waiting: List[Tuple[float, int, str, int]] = []
+        self.order = itertools.count()
+        self.active = 0
+        self.sent: Dict[str, int] = {}
+        self.tokens = bandwidth * self.BURST
+        self.refilled = time.monotonic()
+        self.admitted = 0
+        self.peak = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def start(self):
+        """Start admitting transfers on a background thread.
+
+        Call after forking the workers, so that they do not inherit the
+        thread.
+        """
+        threading.Thread(target=self._serve, name="coordinator",
+                         daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                # Closed.
+                return
+            threading.Thread(target=self._handle, args=(conn,),
+                             daemon=True).start()
+
+    def _key(self, request: Tuple[float, int, str, int]) -> tuple:
+        deadline, _, ccd, order = request
+        if self.schedule == "edf":
+            return (deadline, self.sent.get(ccd, 0), order)
+        return (self.sent.get(ccd, 0), order)
+
+    def _wait_time(self, request: Tuple[float, int, str, int],
+                   ) -> Optional[float]:
+        """Return 0 if the request may start, else how long to wait.
+
+        `None` means wait until another admission changes.
+        """
+        if min(self.waiting, key=self._key) is not request:
+            return None
+        if self.slots > 0 and self.active >= self.slots:
+            return None
+        if self.bandwidth > 0:
+            now = time.monotonic()
+            self.tokens = min(
+                self.tokens + (now - self.refilled) * self.bandwidth,
+                self.bandwidth * self.BURST
+            )
+            self.refilled = now
+            # The bucket may go into debt for a large transfer; later ones
+            # wait until it is paid off.
+            if self.tokens < 0:
+                return -self.tokens / self.bandwidth
+        return 0.0
+
+    def _handle(self, conn: socket.socket):
+        with conn:
+            line = conn.makefile("rb").readline()
+            if not line:
+                return
+            deadline, nbytes, ccd = line.decode().split()
+            request = (float(deadline), int(nbytes), ccd, next(self.order))
+            start = time.monotonic()
+            with self.cond:
+                self.waiting.append(request)
+                while True:
+                    wait = self._wait_time(request)
+                    if wait == 0.0:
+                        break
+                    self.cond.wait(wait)
+                self.waiting.remove(request)
+                self.active += 1
+                self.tokens -= request[1]
+                self.sent[ccd] = self.sent.get(ccd, 0) + request[1]
+                waited = time.monotonic() - start
+                self.admitted += 1
+                self.peak = max(self.peak, self.active)
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+                self.cond.notify_all()
+            try:
+                conn.sendall(b"go\n")
+                # Block until the worker closes the connection.
+                while conn.recv(1024):
+                    pass
+            except OSError:
+                pass
+            finally:
+                with self.cond:
+                    self.active -= 1
+                    self.cond.notify_all()
+
+    def close(self):
+        """Stop accepting transfers and log a summary."""
+        self.sock.close()
+        self.path.unlink(missing_ok=True)
+        mean = self.total_wait / self.admitted if self.admitted else 0.0
+        logging.info(f"Coordinator: {self.admitted} transfers admitted"
+                     f", peak concurrency = {self.peak}"
+                     f", mean wait = {mean}, max wait = {self.max_wait}")
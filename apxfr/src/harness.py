@@ -3,17 +3,42 @@
 from __future__ import annotations
 import abc
 import argparse
+import asyncio
+import base64
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
+import contextlib
+import contextvars
+import csv
 from datetime import datetime, timedelta
 import functools
+import hashlib
+import http.client
+import io
+import json
 import logging
+import math
+import mmap
 import os
 from pathlib import Path
+import queue
+import random
 import re
+import signal
 import socket
+import ssl
 import subprocess
 import tempfile
+import threading
 import time
-from urllib3.connection import HTTPConnection
+from typing import (AsyncIterator, BinaryIO, Dict, Iterator, List, Optional,
+                    Tuple)
+from urllib.parse import quote, urlsplit
+from urllib3.connection import HTTPConnection, HTTPSConnection
+
+from coordinator import BandwidthCoordinator
+from supervisor import Supervisor, affinity_plan
 
 
 def build_parser() -> argparse.ArgumentParser:
@@ -35,306 +60,3109 @@ def build_parser() -> argparse.ArgumentParser:
     parser.add_argument('-i', '--interval', type=int, default=17,
                         help="interval between exposures in sec")
     parser.add_argument('-I', '--inputfile', type=Path,
-                        default="./data/S00.fits", help="input directory")
+                        default="./data/S00.fits",
+                        help=("input file, or synthetic:[KEY=VALUE,...] to"
+                              " generate images per CCD and exposure"))
+    parser.add_argument('--synthetic-ring', metavar='IMAGES', type=int,
+                        default=2,
+                        help=("synthetic images per CCD generated before"
+                              " the start time and reused in turn; 0"
+                              " generates each when due"))
     parser.add_argument('-t', '--tempdir', type=Path, default="/tmp",
                         help="temporary directory")
+    parser.add_argument('-m', '--source', choices=("staged", "memory", "mmap"),
+                        help=("copy the input to the temporary directory for"
+                              " each exposure, or load or map it once"
+                              " (default: memory for synthetic images,"
+                              " otherwise staged)"))
     parser.add_argument('-z', '--compress', action='store_true',
                         help="compress before transfer")
+    parser.add_argument('--compressor',
+                        choices=("fpack", "RICE_1", "GZIP_1", "GZIP_2"),
+                        default="fpack",
+                        help=("compress with the fpack binary or in-process"
+                              " with the given algorithm; HCOMPRESS needs"
+                              " fpack"))
+    parser.add_argument('--compress-threads', metavar='THREADS', type=int,
+                        default=4,
+                        help="threads for in-process compression")
+    parser.add_argument('-q', '--queue-depth', metavar='EXPOSURES', type=int,
+                        default=0,
+                        help=("exposures prepared ahead of upload;"
+                              " 0 uploads each exposure before preparing"
+                              " the next"))
+    parser.add_argument('-w', '--upload-workers', metavar='WORKERS',
+                        type=int, default=1,
+                        help="concurrent uploads per CCD when pipelining")
+    parser.add_argument('--http-transport',
+                        choices=("session", "sendfile", "h2"),
+                        default="session",
+                        help=("HTTP client: requests session, connection pool"
+                              " with sendfile bodies, or HTTP/2 streams"))
+    parser.add_argument('-A', '--aggregate', action='store_true',
+                        help=("transfer all CCDs of an exposure as one object"
+                              " (asyncio engine only)"))
     parser.add_argument('-P', '--private', action='store_true',
                         help="use private Google Cloud interconnect")
     parser.add_argument('-K', '--keepalive', action='store_true',
                         help="use TCP keepalive options")
+    parser.add_argument('-S', '--slices', type=int, default=1,
+                        help="number of parallel slices for gsapi uploads")
+    parser.add_argument('--slice-threshold', metavar='BYTES', type=int,
+                        default=8*1024*1024,
+                        help="minimum file size for sliced gsapi uploads")
+    parser.add_argument('-e', '--engine', choices=("fork", "asyncio"),
+                        default="fork",
+                        help=("fork a process per CCD or drive all CCDs"
+                              " from one asyncio process"))
+    parser.add_argument('-C', '--concurrency', type=int, default=16,
+                        help="maximum simultaneous transfers per node"
+                             " (asyncio engine)")
+    parser.add_argument('-M', '--metrics', metavar='PREFIX', type=Path,
+                        help=("write per-stage timing summary to PREFIX.json"
+                              " and samples to PREFIX.csv"))
+    parser.add_argument('-W', '--warm-connections', metavar='CONNECTIONS',
+                        type=int, default=1,
+                        help=("connections to keep warm between exposures;"
+                              " 0 disables warming"))
+    parser.add_argument('--warm-lead', metavar='SECONDS', type=float,
+                        default=2.0,
+                        help="seconds before each exposure to warm them")
+    parser.add_argument('-L', '--late-policy', choices=Waiter.POLICIES,
+                        default="catchup",
+                        help=("handling of late exposures: process all in"
+                              " order, skip to the newest, or newest first"))
+    parser.add_argument('-R', '--retries', type=int, default=2,
+                        help="times to retry a failed transfer")
+    parser.add_argument('--retry-backoff', metavar='SECONDS', type=float,
+                        default=1.0,
+                        help="wait before the first retry, doubling after")
+    parser.add_argument('-H', '--hedge-percentile', metavar='PERCENTILE',
+                        type=float, default=0.0,
+                        help=("start a duplicate of a transfer slower than"
+                              " this percentile of recent ones; 0 disables"))
+    parser.add_argument('--checksum',
+                        choices=("none",) + Checksum.ALGORITHMS,
+                        default="none",
+                        help=("checksum computed while transferring and"
+                              " verified against the destination; boto://"
+                              " needs crc32c"))
+    parser.add_argument('--node-slots', metavar='TRANSFERS', type=int,
+                        default=0,
+                        help=("maximum simultaneous transfers across all CCDs"
+                              " of the node (fork engine); 0 for no limit"))
+    parser.add_argument('--node-bandwidth', metavar='BYTES', type=float,
+                        default=0.0,
+                        help=("bytes per second admitted across all CCDs of"
+                              " the node (fork engine); 0 for no limit"))
+    parser.add_argument('--node-schedule',
+                        choices=BandwidthCoordinator.SCHEDULES,
+                        default="edf",
+                        help=("admit earliest exposure deadline first, or"
+                              " the CCD that has sent least"))
+    parser.add_argument('--supervise', action='store_true',
+                        help=("restart failed CCD workers, report their"
+                              " progress, and exit with a summary when all"
+                              " are done (fork engine)"))
+    parser.add_argument('--max-restarts', metavar='RESTARTS', type=int,
+                        default=3,
+                        help="times to restart the worker of each CCD")
+    parser.add_argument('--stats-port', metavar='PORT', type=int, default=0,
+                        help=("serve live per-CCD statistics as JSON on this"
+                              " localhost port (with --supervise);"
+                              " 0 disables"))
+    parser.add_argument('--pin', choices=("none", "cpu", "numa"),
+                        default="none",
+                        help=("pin each CCD worker to a CPU or to the CPUs"
+                              " of a NUMA node (fork engine)"))
     return parser
 
 
-class Waiter:
-    """Wait until the appropriate time for a given exposure.
+# Name of the CCD being processed by the current process, task, or thread.
+current_ccd: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_ccd"
+)
+
+
+class CcdFilter(logging.Filter):
+    """Add the name of the current CCD to each log record.
+
+    Parameters
+    ----------
+    default: `str`
+        Name to use when no CCD has been set in the current context.
+    """
+
+    def __init__(self, default: str):
+        super().__init__()
+        self.default = default
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.ccd = current_ccd.get(self.default)
+        return True
+
+
+def setup_logging(default: str):
+    """Configure logging so that every message names its CCD.
+
+    Parameters
+    ----------
+    default: `str`
+        Name to log when no CCD has been set in the current context.
+    """
+    logging.basicConfig(
+        format="{ccd} {asctime} {message}",
+        style="{",
+        level="INFO"
+    )
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(CcdFilter(default))
+
+
+def run_in_thread(executor, func, *args):
+    """Run a blocking function in an executor from a coroutine.
+
+    The caller's context, including `current_ccd`, is propagated to the
+    worker thread.
+
+    Parameters
+    ----------
+    executor: `concurrent.futures.Executor` or `None`
+        Executor to use; `None` selects the event loop's default.
+    func: callable
+        Function to run.
+    *args
+        Arguments for ``func``.
+
+    Returns
+    -------
+    future: `asyncio.Future`
+        Future for the result of ``func``.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return loop.run_in_executor(executor, ctx.run, func, *args)
+
+
+# Number and sequence number of the exposure being processed.
+current_exposure: contextvars.ContextVar[Tuple[int, int]] = (
+    contextvars.ContextVar("current_exposure")
+)
+
+
+class Histogram:
+    """Log-scaled histogram of durations that can be merged across processes.
+
+    Buckets are ``1 / BINS_PER_DECADE`` of a decade wide, so quantiles are
+    accurate to about 12% while the histogram stays small.
+    """
+
+    BINS_PER_DECADE = 20
+    MIN_SECONDS = 1e-4
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, seconds: float):
+        """Add one sample.
+
+        Parameters
+        ----------
+        seconds: `float`
+            Duration to add.
+        """
+        index = math.floor(self.BINS_PER_DECADE * math.log10(
+            max(seconds, self.MIN_SECONDS) / self.MIN_SECONDS
+        ))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: Histogram):
+        """Add all samples of another histogram to this one."""
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile.
+
+        Parameters
+        ----------
+        q: `float`
+            Quantile between 0 and 1.
+
+        Returns
+        -------
+        value: `float`
+            Geometric center of the bucket holding the quantile, clipped to
+            the observed range; NaN if there are no samples.
+        """
+        if self.count == 0:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                break
+        value = self.MIN_SECONDS * 10 ** ((index + 0.5) / self.BINS_PER_DECADE)
+        return min(max(value, self.min), self.max)
+
+    def summary(self) -> Dict[str, float]:
+        """Return count, mean, extremes, and p50/p95/p99 as a `dict`."""
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else math.nan,
+            "min": self.min if self.count else math.nan,
+            "max": self.max if self.count else math.nan,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+    def to_dict(self) -> dict:
+        return {"counts": self.counts, "count": self.count,
+                "total": self.total, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> Histogram:
+        hist = cls()
+        hist.counts = {int(k): v for k, v in data["counts"].items()}
+        hist.count = data["count"]
+        hist.total = data["total"]
+        hist.min = data["min"]
+        hist.max = data["max"]
+        return hist
+
+
+class Metrics:
+    """Per-stage timing samples for one process.
+
+    Every sample is tagged with the CCD and exposure from the current
+    context and added to a histogram for its stage.  Each process writes its
+    samples to a part file with `dump`; the parent combines the parts with
+    `aggregate`.
+    """
+
+    FIELDS = ("stage", "ccd", "exposure", "seqnum", "time", "seconds")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples: List[tuple] = []
+        self.histograms: Dict[str, Histogram] = {}
+
+    def record(self, stage: str, seconds: float):
+        """Record a timing sample.
+
+        Parameters
+        ----------
+        stage: `str`
+            Name of the stage, such as "copy" or "transfer".
+        seconds: `float`
+            Duration of the stage.
+        """
+        num, seqnum = current_exposure.get((None, None))
+        sample = (stage, current_ccd.get(""), num, seqnum, time.time(),
+                  seconds)
+        with self.lock:
+            self.samples.append(sample)
+            self.histograms.setdefault(stage, Histogram()).add(seconds)
+
+    def dump(self, prefix: Path):
+        """Write this process's samples and histograms to a part file.
+
+        Parameters
+        ----------
+        prefix: `pathlib.Path`
+            Output prefix given to `aggregate`.
+        """
+        path = prefix.with_name(f"{prefix.name}.{os.getpid()}.part.json")
+        with self.lock:
+            data = {
+                "samples": self.samples,
+                "histograms": {stage: hist.to_dict()
+                               for stage, hist in self.histograms.items()},
+            }
+        with path.open("w") as f:
+            json.dump(data, f)
+
+    @classmethod
+    def aggregate(cls, prefix: Path,
+                  destination: str = "") -> Dict[str, Dict[str, float]]:
+        """Combine the part files of all processes into a summary.
+
+        Writes ``<prefix>.json`` with per-stage statistics and
+        ``<prefix>.csv`` with every sample, then removes the part files.
+
+        Parameters
+        ----------
+        prefix: `pathlib.Path`
+            Output prefix given to `dump`.
+        destination: `str`, optional
+            Destination URI of the run, saved with the summary.
+
+        Returns
+        -------
+        summary: `dict`
+            Statistics for each stage.
+        """
+        histograms: Dict[str, Histogram] = {}
+        parts = sorted(prefix.parent.glob(f"{prefix.name}.*.part.json"))
+        with prefix.with_name(prefix.name + ".csv").open("w",
+                                                         newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(cls.FIELDS)
+            for part in parts:
+                with part.open() as p:
+                    data = json.load(p)
+                writer.writerows(data["samples"])
+                for stage, hist in data["histograms"].items():
+                    histograms.setdefault(stage, Histogram()).merge(
+                        Histogram.from_dict(hist)
+                    )
+                part.unlink()
+        summary = {stage: hist.summary()
+                   for stage, hist in sorted(histograms.items())}
+        with prefix.with_name(prefix.name + ".json").open("w") as f:
+            json.dump({"destination": destination, "processes": len(parts),
+                       "stages": summary}, f, indent=2)
+        return summary
+
+
+# Samples recorded by this process.
+metrics = Metrics()
+
+
+class ConnectionCount:
+    """New connections opened on behalf of one transfer or warm-up.
+
+    Shared by reference with any threads the operation fans out to.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.seconds = 0.0
+
+    def add(self, seconds: float):
+        with self.lock:
+            self.opened += 1
+            self.seconds += seconds
+
+
+# Connection count of the transfer being performed.
+current_connections: contextvars.ContextVar[ConnectionCount] = (
+    contextvars.ContextVar("current_connections")
+)
+
+
+class ConnectionStats:
+    """Connection reuse statistics for all transfers of a process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.transfers = 0
+        self.reused = 0
+        self.opened = 0
+        self.seconds = 0.0
+        self.warmups = 0
+        self.refreshed = 0
+        self.failures = 0
+
+    def record(self, count: ConnectionCount):
+        """Record the connections opened by one transfer."""
+        if count.opened:
+            logging.info(f"Transfer opened {count.opened} new connections"
+                         f" in {count.seconds} seconds")
+        else:
+            logging.info("Transfer reused warm connections")
+        with self.lock:
+            self.transfers += 1
+            self.reused += count.opened == 0
+            self.opened += count.opened
+            self.seconds += count.seconds
+
+    def record_warmup(self, count: ConnectionCount, failures: int):
+        """Record the connections replaced by one warm-up."""
+        with self.lock:
+            self.warmups += 1
+            self.refreshed += count.opened
+            self.failures += failures
+
+    def log_summary(self):
+        """Log the statistics for the whole run."""
+        logging.info(f"Connections: {self.reused} of {self.transfers}"
+                     f" transfers reused warm connections"
+                     f", {self.opened} handshakes during transfers"
+                     f" for {self.seconds} seconds"
+                     f"; {self.warmups} warm-ups refreshed {self.refreshed}"
+                     f" connections, {self.failures} unhealthy")
+
+
+# Connection statistics of this process.
+connection_stats = ConnectionStats()
+
+
+def note_connection(seconds: Optional[float] = None):
+    """Attribute a newly opened connection to the current operation.
+
+    Parameters
+    ----------
+    seconds: `float`, optional
+        Time taken by the handshake, if known.
+    """
+    if seconds is not None:
+        metrics.record("handshake", seconds)
+    count = current_connections.get(None)
+    if count is not None:
+        count.add(seconds or 0.0)
+
+
+def _timed_connect(connect):
+    @functools.wraps(connect)
+    def wrapper(self, *args, **kwargs):
+        # HTTPSConnection.connect may call up to HTTPConnection.connect.
+        if getattr(self, "_timing_connect", False):
+            return connect(self, *args, **kwargs)
+        self._timing_connect = True
+        start = time.time()
+        try:
+            return connect(self, *args, **kwargs)
+        finally:
+            self._timing_connect = False
+            note_connection(time.time() - start)
+
+    wrapper.timed = True
+    return wrapper
+
+
+def track_connections():
+    """Time every connection opened through urllib3.
+
+    All HTTP-based uploaders (google-cloud-storage, boto3, minio, requests)
+    connect through urllib3, so this observes their handshakes without
+    reaching into each client library.
+    """
+    for cls in (HTTPConnection, HTTPSConnection):
+        connect = vars(cls).get("connect")
+        if connect is not None and not getattr(connect, "timed", False):
+            cls.connect = _timed_connect(connect)
+
+
+class TransferStats:
+    """Throughput and CPU cost of all transfers of a process.
+
+    CPU time is that of the thread performing each transfer, so work that
+    the transport hands to other threads or processes (boto multipart
+    parts, gsapi slices, scp, bbcp) is not included.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.transfers = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.cpu = 0.0
+
+    def record(self, nbytes: int, seconds: float, cpu: Optional[float]):
+        """Record one transfer.
+
+        Parameters
+        ----------
+        nbytes: `int`
+            Size of the payload.
+        seconds: `float`
+            Elapsed time of the transfer.
+        cpu: `float` or `None`
+            CPU seconds used by the transferring thread, if known.
+        """
+        if cpu is not None:
+            metrics.record("transfer_cpu", cpu)
+        worker_status.send("transfer", bytes=nbytes, seconds=seconds)
+        with self.lock:
+            self.transfers += 1
+            self.bytes += nbytes
+            self.seconds += seconds
+            self.cpu += cpu or 0.0
+
+    def log_summary(self):
+        """Log the statistics for the whole run."""
+        gb = self.bytes / 1e9
+        rate = self.bytes / self.seconds / 1e6 if self.seconds else 0.0
+        per_gb = self.cpu / gb if gb else 0.0
+        logging.info(f"Throughput: {self.transfers} transfers of"
+                     f" {self.bytes} bytes in {self.seconds} seconds"
+                     f" = {rate} MB/s per transfer"
+                     f", CPU = {self.cpu} seconds = {per_gb} seconds/GB")
+
+
+# Transfer statistics of this process.
+transfer_stats = TransferStats()
+
+
+class ChecksumMismatch(RuntimeError):
+    """Raised when the server reports different bytes than were sent."""
+
+
+class Checksum:
+    """Checksum of a transfer's bytes, computed as the transport reads them.
+
+    Bytes are hashed in order as they pass through a `ChecksumReader` or are
+    sent by the transport, so no separate pass over the data is needed.  A
+    transport that rereads from the start, as on a retry, hashes nothing new.
+
+    Parameters
+    ----------
+    algorithm: `str`
+        One of `ALGORITHMS`.
+    start: `int`, optional
+        Offset of the first byte covered, for a slice of a payload.
+    """
+
+    ALGORITHMS = ("md5", "crc32c")
+
+    def __init__(self, algorithm: str, start: int = 0):
+        if algorithm == "crc32c":
+            import google_crc32c
+            self.hash = google_crc32c.Checksum()
+        elif algorithm == "md5":
+            self.hash = hashlib.md5()
+        else:
+            raise ValueError(f"Unknown checksum algorithm {algorithm}")
+        self.algorithm = algorithm
+        self.lock = threading.Lock()
+        self.start = start
+        self.pos = start
+        self.seconds = 0.0
+        # "verified", "mismatch", "transport" if the transport checked the
+        # bytes itself, "sidecar" if written alongside, or "unverified".
+        self.outcome = "unverified"
+
+    @property
+    def hashed(self) -> int:
+        """Number of bytes hashed (`int`)."""
+        return self.pos - self.start
+
+    def update(self, pos: int, data) -> None:
+        """Hash bytes read at offset ``pos``, if they continue the hash."""
+        data = memoryview(data).cast("B")
+        with self.lock:
+            end = pos + len(data)
+            if pos <= self.pos < end:
+                start = time.perf_counter()
+                new = data[self.pos - pos:]
+                if self.algorithm == "crc32c":
+                    # The CRC32C extension only takes bytes.
+                    new = new.tobytes()
+                self.hash.update(new)
+                self.seconds += time.perf_counter() - start
+                self.pos = end
+
+    def absorb(self, parts: List[Checksum]):
+        """Account for the checksums of the slices of this transfer.
+
+        The transfer is verified if every slice was; the digests themselves
+        are not combined.
+        """
+        self.pos = self.start + sum(part.hashed for part in parts)
+        self.seconds = sum(part.seconds for part in parts)
+        if parts and all(part.outcome == "verified" for part in parts):
+            self.outcome = "verified"
+
+    def hexdigest(self) -> str:
+        return self.hash.digest().hex()
+
+    def matches(self, reported: str) -> bool:
+        """Compare with a hex or base64 digest reported by a server."""
+        digest = self.hash.digest()
+        return reported.strip('"').lower() == digest.hex() or (
+            reported == base64.b64encode(digest).decode("ascii")
+        )
+
+    def verify(self, name: Path, size: int,
+               reported: Dict[str, Optional[str]]):
+        """Check the bytes sent against digests reported by the server.
+
+        The transfer is left unverified if the server reports no digest
+        with this algorithm or not all ``size`` bytes were hashed.
+
+        Parameters
+        ----------
+        name: `pathlib.Path`
+            Name of the object, for messages.
+        size: `int`
+            Number of bytes sent.
+        reported: `dict` [`str`, `str`]
+            Digests reported by the server, keyed by algorithm.
+
+        Raises
+        ------
+        ChecksumMismatch
+            Raised if the digests differ.
+        """
+        digest = reported.get(self.algorithm)
+        if digest is None or self.hashed != size:
+            return
+        if self.matches(digest):
+            self.outcome = "verified"
+            return
+        self.outcome = "mismatch"
+        raise ChecksumMismatch(f"{self.algorithm} of {name} is"
+                               f" {self.hexdigest()} but the server has"
+                               f" {digest}")
+
+
+# Checksum of the transfer being performed.
+current_checksum: contextvars.ContextVar[Optional[Checksum]] = (
+    contextvars.ContextVar("current_checksum")
+)
+
+
+class ChecksumStats:
+    """Integrity checks of all transfers of a process.
+
+    Attributes
+    ----------
+    algorithm: `str` or `None`
+        Checksum algorithm of transfers, or `None` to skip checksums.
+    """
+
+    OUTCOMES = ("verified", "transport", "sidecar", "unverified",
+                "mismatch")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.algorithm: Optional[str] = None
+        self.counts = dict.fromkeys(self.OUTCOMES, 0)
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def start(self, offset: int = 0) -> Optional[Checksum]:
+        """Return a new checksum if checksums are enabled."""
+        if self.algorithm is None:
+            return None
+        return Checksum(self.algorithm, offset)
+
+    def record(self, checksum: Optional[Checksum]):
+        """Record the outcome and hashing time of one transfer."""
+        if checksum is None:
+            return
+        metrics.record("checksum", checksum.seconds)
+        with self.lock:
+            self.counts[checksum.outcome] += 1
+            self.bytes += checksum.hashed
+            self.seconds += checksum.seconds
+
+    def log_summary(self):
+        """Log the statistics for the whole run."""
+        if self.algorithm is None:
+            return
+        gb = self.bytes / 1e9
+        per_gb = self.seconds / gb if gb else 0.0
+        counts = ", ".join(f"{count} {outcome}"
+                           for outcome, count in self.counts.items())
+        logging.info(f"Checksums ({self.algorithm}): {counts}"
+                     f"; hashing = {self.seconds} seconds"
+                     f" = {per_gb} seconds/GB")
+
+
+# Integrity checks of this process.
+checksum_stats = ChecksumStats()
+
+
+def track_transfer(func):
+    """Decorator recording the costs and checksums of transfers.
+
+    Connections opened while ``func`` runs, including by threads started
+    with a copy of its context, are attributed to the transfer and recorded
+    in `connection_stats`; the size, duration, and CPU time of successful
+    transfers are recorded in `transfer_stats`.  If checksums are enabled,
+    a `Checksum` is made current for the transport to fill and verify, and
+    recorded in `checksum_stats` unless the attempt is cancelled.  The
+    decorated method takes a `Payload` as its first argument.
+    """
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(self, payload, *args, **kwargs):
+            count = ConnectionCount()
+            token = current_connections.set(count)
+            checksum = checksum_stats.start()
+            checksum_token = current_checksum.set(checksum)
+            start = time.time()
+            try:
+                res = await func(self, payload, *args, **kwargs)
+            except (TransferCancelled, asyncio.CancelledError):
+                checksum = None
+                raise
+            finally:
+                current_connections.reset(token)
+                current_checksum.reset(checksum_token)
+                connection_stats.record(count)
+                checksum_stats.record(checksum)
+            # Other tasks share the thread, so its CPU time would not be
+            # this transfer's.
+            transfer_stats.record(payload.size, time.time() - start, None)
+            return res
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, payload, *args, **kwargs):
+        count = ConnectionCount()
+        token = current_connections.set(count)
+        checksum = checksum_stats.start()
+        checksum_token = current_checksum.set(checksum)
+        start = time.time()
+        cpu_start = time.thread_time()
+        try:
+            res = func(self, payload, *args, **kwargs)
+        except TransferCancelled:
+            checksum = None
+            raise
+        finally:
+            current_connections.reset(token)
+            current_checksum.reset(checksum_token)
+            connection_stats.record(count)
+            checksum_stats.record(checksum)
+        transfer_stats.record(payload.size, time.time() - start,
+                              time.thread_time() - cpu_start)
+        return res
+
+    return wrapper
+
+
+class ContextExecutor(ThreadPoolExecutor):
+    """Thread pool that runs each task in a copy of the submitter's context.
+
+    Lets library-managed threads, such as those of boto3 transfers, log and
+    record metrics against the right CCD and exposure.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args,
+                              **kwargs)
+
+
+class Waiter:
+    """Release exposures for processing as they fall due.
+
+    Each exposure is due at a given start time plus a time interval between
+    exposures.  The start time is a wall-clock time, to ensure consistency
+    across multiple processes and computers, but it is converted once to the
+    monotonic clock so that waits are precise and immune to clock
+    adjustments.
+
+    The policy decides what happens to exposures whose deadline has passed,
+    as when transfers fall behind:
+
+    * "catchup": process every exposure in order as fast as possible.
+    * "skip": drop an exposure as soon as a newer one is due, as a camera
+      without buffer space would.
+    * "newest": process the newest due exposure first, and the backlog,
+      oldest first, only when no new exposure is due.
+
+    Parameters
+    ----------
+    hour, minute: `int`
+        The time to start the first exposure.
+    interval: `int`
+        Interval between exposures in seconds.
+    warmer: `ConnectionWarmer`, optional
+        Refreshes the uploader's connections shortly before each exposure.
+    policy: `str`, optional
+        Policy for late exposures.
+    """
+
+    POLICIES = ("catchup", "skip", "newest")
+
+    def __init__(self, hour: int, minute: int, interval: int,
+                 warmer: Optional[ConnectionWarmer] = None,
+                 policy: str = "catchup"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown late-exposure policy {policy}")
+        self.base_time = datetime.now().replace(hour=hour, minute=minute,
+                                                second=0, microsecond=0)
+        self.base = time.monotonic() + (
+            self.base_time - datetime.now()
+        ).total_seconds()
+        self.interval = interval
+        self.warmer = warmer
+        self.policy = policy
+        self.started = 0
+        self.late = 0
+        self.skipped = 0
+        self.max_slip = 0.0
+
+    def deadline(self, num: int) -> float:
+        """Monotonic time at which the given exposure is due."""
+        return self.base + num * self.interval
+
+    def _step(self, pending: deque,
+              state: dict) -> Optional[Tuple[int, float]]:
+        """Choose the next exposure to process.
+
+        Parameters
+        ----------
+        pending: `collections.deque` [`int`]
+            Backlog of due exposures not yet processed, oldest first.
+        state: `dict`
+            ``numexp``, ``seqnum_start``, and ``next``, the first exposure
+            not yet due.
+
+        Returns
+        -------
+        step: `tuple` or `None`
+            Exposure number and seconds until it is due, or `None` when all
+            exposures have been processed or skipped.
+        """
+        now = time.monotonic()
+        due = []
+        while (state["next"] < state["numexp"]
+               and self.deadline(state["next"]) <= now):
+            due.append(state["next"])
+            state["next"] += 1
+        if self.policy == "catchup":
+            pending.extend(due)
+        elif due:
+            if self.policy == "skip":
+                for num in due[:-1]:
+                    self._skip(num, state["seqnum_start"], now)
+            else:
+                pending.extend(due[:-1])
+            return due[-1], self.deadline(due[-1]) - now
+        if pending:
+            num = pending.popleft()
+            return num, self.deadline(num) - now
+        if state["next"] < state["numexp"]:
+            num = state["next"]
+            state["next"] += 1
+            return num, self.deadline(num) - now
+        return None
+
+    def _log(self, num: int, delay: float):
+        when = self.base_time + timedelta(seconds=num * self.interval)
+        delay_str = f"{abs(delay)} seconds for exposure {num} at {when}"
+        if delay < 0:
+            logging.info("Late " + delay_str)
+            self.late += 1
+        else:
+            logging.info("Sleeping " + delay_str)
+
+    def _skip(self, num: int, seqnum_start: int, now: float):
+        slip = now - self.deadline(num)
+        token = current_exposure.set((num, seqnum_start + num))
+        logging.info(f"Skipping exposure {num}, {slip} seconds late")
+        metrics.record("skipped", slip)
+        worker_status.send("skipped")
+        current_exposure.reset(token)
+        self.skipped += 1
+
+    def _record(self, num: int):
+        """Record how far the exposure's start slipped past its deadline.
+
+        The sample's time minus its value is the scheduled time.
+        """
+        slip = time.monotonic() - self.deadline(num)
+        metrics.record("lateness", slip)
+        worker_status.send("started", lateness=slip)
+        self.started += 1
+        self.max_slip = max(self.max_slip, slip)
+
+    @staticmethod
+    def _sleep_until(deadline: float):
+        # Sleeping may end early, e.g. on a signal; check the clock again.
+        while (remaining := deadline - time.monotonic()) > 0:
+            time.sleep(remaining)
+
+    @staticmethod
+    async def _sleep_until_async(deadline: float):
+        while (remaining := deadline - time.monotonic()) > 0:
+            await asyncio.sleep(remaining)
+
+    def exposures(self, numexp: int, seqnum_start: int,
+                  first: int = 0) -> Iterator[int]:
+        """Wait for and yield exposure numbers in the order to process them.
+
+        `current_exposure` is set for each exposure before it is waited for.
+
+        Parameters
+        ----------
+        numexp: `int`
+            Number of exposures in the run.
+        seqnum_start: `int`
+            Sequence number of the first exposure.
+        first: `int`, optional
+            Number of the first exposure to process, as when resuming the
+            run of a failed process.
+
+        Yields
+        ------
+        num: `int`
+            Number of an exposure that is due.
+        """
+        pending: deque = deque()
+        state = {"numexp": numexp, "seqnum_start": seqnum_start,
+                 "next": first}
+        while (step := self._step(pending, state)) is not None:
+            num, delay = step
+            current_exposure.set((num, seqnum_start + num))
+            self._log(num, delay)
+            deadline = self.deadline(num)
+            if self.warmer is not None and delay > self.warmer.lead:
+                self._sleep_until(deadline - self.warmer.lead)
+                self.warmer.warm_for(num)
+            self._sleep_until(deadline)
+            self._record(num)
+            yield num
+
+    async def exposures_async(self, numexp: int,
+                              seqnum_start: int) -> AsyncIterator[int]:
+        """Equivalent of `exposures` that does not block the event loop.
+
+        Each CCD task iterates separately; the statistics are shared.
+        """
+        pending: deque = deque()
+        state = {"numexp": numexp, "seqnum_start": seqnum_start, "next": 0}
+        while (step := self._step(pending, state)) is not None:
+            num, delay = step
+            current_exposure.set((num, seqnum_start + num))
+            self._log(num, delay)
+            deadline = self.deadline(num)
+            if self.warmer is not None and delay > self.warmer.lead:
+                await self._sleep_until_async(deadline - self.warmer.lead)
+                await run_in_thread(None, self.warmer.warm_for, num)
+            await self._sleep_until_async(deadline)
+            self._record(num)
+            yield num
+
+    def log_summary(self):
+        """Log the schedule statistics for the whole run."""
+        logging.info(f"Schedule ({self.policy}): {self.started} exposures"
+                     f" started, {self.late} late, {self.skipped} skipped"
+                     f", max slip = {self.max_slip} seconds")
+
+
+def log_timing(func):
+    """Decorator to log timing information for a function or coroutine.
+
+    The duration is also recorded in `metrics` under the function's name,
+    without any leading underscore or ``_async`` suffix.  When an exposure
+    is being processed, the end message names it so that logs can be
+    analyzed per exposure.  Cancelled and failed attempts did not complete,
+    so they are logged as such and not recorded.
+    """
+
+    stage = func.__name__.lstrip("_").removesuffix("_async")
+
+    def end_message(delta: float) -> str:
+        message = f"End {func.__name__} = {delta}"
+        exposure = current_exposure.get(None)
+        if exposure is not None:
+            message += f" for exposure {exposure[0]} seqnum {exposure[1]}"
+        return message
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(self, *args, **kwargs):
+            logging.info(f"Start {func.__name__}")
+            start = time.time()
+            try:
+                res = await func(self, *args, **kwargs)
+            except (TransferCancelled, asyncio.CancelledError):
+                logging.info(f"Cancelled {func.__name__}"
+                             f" = {time.time() - start}")
+                raise
+            except Exception:
+                logging.info(f"Failed {func.__name__}"
+                             f" = {time.time() - start}")
+                raise
+            delta = time.time() - start
+            logging.info(end_message(delta))
+            metrics.record(stage, delta)
+            return res
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        logging.info(f"Start {func.__name__}")
+        start = time.time()
+        try:
+            res = func(self, *args, **kwargs)
+        except TransferCancelled:
+            logging.info(f"Cancelled {func.__name__} = {time.time() - start}")
+            raise
+        except Exception:
+            logging.info(f"Failed {func.__name__} = {time.time() - start}")
+            raise
+        delta = time.time() - start
+        logging.info(end_message(delta))
+        metrics.record(stage, delta)
+        return res
+
+    return wrapper
+
+
+@log_timing
+def copy(source: Path, temp: Path, dest: Path, compress: bool = False) -> Path:
+    """Copy a file to a temporary location, optionally with compression.
+
+    Parameters
+    ----------
+    source: `pathlib.Path`
+        Source file location.
+    temp: `pathlib.Path`
+        Temporary directory to which to copy the file.
+        Intended to ensure that transfers come from RAM rather than disk.
+    dest: `pathlib.Path`
+        Destination location within temporary directory.
+    compress: `bool`, optional
+        Compress the file with fpack if true.
+
+    Returns
+    -------
+    finaldest: `pathlib.Path`
+        Destination location updated with compression suffix if appropriate.
+    """
+    (temp / dest).parent.mkdir(parents=True, exist_ok=True)
+    logging.info(f"Copying {source} to {temp / dest}")
+    subprocess.run(["cp", f"{source}", f"{temp / dest}"])
+    if compress:
+        logging.info(f"Compressing {temp / dest}")
+        subprocess.run(["fpack", f"{temp / dest}"])
+        dest = dest.with_suffix(".fits.fz")
+    return dest
+
+
+@log_timing
+def load_source(source: Path, mode: str) -> memoryview:
+    """Load an input image once for transfers straight from memory.
+
+    Parameters
+    ----------
+    source: `pathlib.Path`
+        Source file location.
+    mode: `str`
+        "memory" to read the file into memory or "mmap" to map it.
+
+    Returns
+    -------
+    buffer: `memoryview`
+        Read-only view of the file contents.
+    """
+    logging.info(f"Loading {source} with mode {mode}")
+    if mode == "memory":
+        return memoryview(source.read_bytes())
+    if mode == "mmap":
+        with source.open("rb") as f:
+            return memoryview(mmap.mmap(f.fileno(), 0,
+                                        access=mmap.ACCESS_READ))
+    raise RuntimeError(f"Unrecognized source mode {mode}")
+
+
+class SyntheticImages:
+    """Input images generated by `synthetic`, distinct per CCD and exposure.
+
+    Generation takes a good fraction of a second for a full-size CCD, so by
+    default a ring of images per CCD is generated before the start time and
+    reused in turn, keeping generation off the exposure schedule.
+
+    Parameters
+    ----------
+    spec: `str`
+        Image parameters, as accepted by `synthetic.parse_spec`.
+    ring: `int`
+        Number of images per CCD to generate in advance; 0 generates each
+        exposure's image when it is prepared.
+    """
+
+    PREFIX = "synthetic:"
+
+    def __init__(self, spec: str, ring: int):
+        import synthetic
+        self.synthetic = synthetic
+        self.spec = synthetic.parse_spec(spec)
+        logging.info(f"Generating synthetic images with {self.spec}")
+        self.ring = ring
+        self.images: Dict[str, List[memoryview]] = {}
+
+    @classmethod
+    def selected(cls, inputfile: Path) -> bool:
+        """Return whether an input file names synthetic images."""
+        return str(inputfile).startswith(cls.PREFIX)
+
+    @log_timing
+    def generate(self, ccd: str, num: int) -> memoryview:
+        """Generate the image of a CCD for an exposure."""
+        return memoryview(self.synthetic.generate(self.spec, ccd, num))
+
+    def prefill(self, ccd: str):
+        """Generate the ring of images for a CCD."""
+        self.images[ccd] = [self.generate(ccd, num)
+                            for num in range(self.ring)]
+
+    def image(self, ccd: str, num: int) -> memoryview:
+        """Return the image of a CCD for an exposure."""
+        if self.ring > 0:
+            return self.images[ccd][num % self.ring]
+        return self.generate(ccd, num)
+
+
+class BufferReader(io.RawIOBase):
+    """Read-only, seekable file object over a shared buffer.
+
+    Each reader keeps its own position, so many transfers can stream from
+    the same buffer at once without copying it.
+
+    Parameters
+    ----------
+    buffer: `memoryview`
+        Bytes to read.
+    """
+
+    def __init__(self, buffer: memoryview):
+        super().__init__()
+        self.buffer = buffer.cast("B")
+        self.pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        chunk = self.buffer[self.pos:self.pos + len(b)]
+        n = len(chunk)
+        memoryview(b).cast("B")[:n] = chunk
+        self.pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        elif whence == io.SEEK_END:
+            self.pos = len(self.buffer) + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def __len__(self) -> int:
+        return len(self.buffer) - self.pos
+
+
+class TransferCancelled(Exception):
+    """Raised within a transfer attempt that has been cancelled."""
+
+
+# Set when the transfer attempt being performed should give up, as when a
+# hedged duplicate has finished first.
+current_cancel: contextvars.ContextVar[threading.Event] = (
+    contextvars.ContextVar("current_cancel")
+)
+
+
+def check_cancelled():
+    """Raise `TransferCancelled` if the current attempt has been cancelled."""
+    cancel = current_cancel.get(None)
+    if cancel is not None and cancel.is_set():
+        raise TransferCancelled()
+
+
+class CancellableReader(io.RawIOBase):
+    """Stream that stops a cancelled transfer attempt at its next read.
+
+    Uploaders that stream a payload need no knowledge of cancellation: the
+    library reading the body sees `TransferCancelled` and abandons the
+    request.
+
+    Parameters
+    ----------
+    stream: `typing.BinaryIO`
+        Stream to read.
+    cancel: `threading.Event`
+        Set to cancel the attempt.
+    """
+
+    def __init__(self, stream: BinaryIO, cancel: threading.Event):
+        super().__init__()
+        self.stream = stream
+        self.cancel = cancel
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if self.cancel.is_set():
+            raise TransferCancelled()
+        return self.stream.readinto(b)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self.stream.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.stream.tell()
+
+    def fileno(self) -> int:
+        return self.stream.fileno()
+
+    def close(self):
+        self.stream.close()
+        super().close()
+
+
+class ChecksumReader(io.RawIOBase):
+    """Stream that hashes the bytes a transport reads from it.
+
+    It has no file descriptor, so that every byte passes through it;
+    transports that would hand a descriptor to another process pump the
+    stream instead.
+
+    Parameters
+    ----------
+    stream: `typing.BinaryIO`
+        Seekable stream to read.
+    checksum: `Checksum`
+        Checksum to update.
+    """
+
+    def __init__(self, stream: BinaryIO, checksum: Checksum):
+        super().__init__()
+        self.stream = stream
+        self.checksum = checksum
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        pos = self.stream.tell()
+        n = self.stream.readinto(b)
+        if n:
+            self.checksum.update(pos, memoryview(b)[:n])
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self.stream.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.stream.tell()
+
+    def close(self):
+        self.stream.close()
+        super().close()
+
+
+class Compressor:
+    """In-process tile compression of images before transfer.
+
+    Produces ``.fits.fz`` output in memory using `fitscompress`, so no
+    external process or temporary file is involved.
+
+    Parameters
+    ----------
+    algorithm: `str`
+        Compression algorithm, one of `fitscompress.ALGORITHMS`.
+    threads: `int`
+        Number of threads compressing tiles in parallel.
+    """
+
+    def __init__(self, algorithm: str, threads: int):
+        import fitscompress
+        logging.info(f"Compressing with {algorithm} on {threads} threads")
+        self.fitscompress = fitscompress
+        self.algorithm = algorithm
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    @log_timing
+    def compress(self, payload: Payload) -> Payload:
+        """Compress an image.
+
+        Parameters
+        ----------
+        payload: `Payload`
+            Uncompressed image.
+
+        Returns
+        -------
+        compressed: `Payload`
+            Compressed image, named with a ``.fits.fz`` suffix.
+        """
+        if payload.buffer is not None:
+            data = payload.buffer
+        else:
+            data = payload.path.read_bytes()
+        start = time.time()
+        out = self.fitscompress.compress(data, self.algorithm,
+                                         executor=self.executor)
+        delta = time.time() - start
+        logging.info(f"Compressed {payload.name} from {len(data)} to"
+                     f" {len(out)} bytes: ratio = {len(data) / len(out)}"
+                     f", time = {delta}")
+        return Payload(payload.name.with_suffix(".fits.fz"),
+                       buffer=memoryview(out))
+
+
+class Payload:
+    """An image to transfer under its per-exposure destination name.
+
+    The bytes come either from a file staged by `copy` or from a buffer
+    returned by `load_source` and shared by all exposures.
+
+    Parameters
+    ----------
+    name: `pathlib.Path`
+        Destination location relative to the uploader's root.
+    path: `pathlib.Path`, optional
+        Local file holding the bytes.
+    buffer: `memoryview`, optional
+        Bytes to transfer, if ``path`` is not given.
+    """
+
+    def __init__(self, name: Path, path: Optional[Path] = None,
+                 buffer: Optional[memoryview] = None):
+        if (path is None) == (buffer is None):
+            raise ValueError("Exactly one of path and buffer is required")
+        self.name = name
+        self.path = path
+        self.buffer = buffer
+
+    @property
+    def size(self) -> int:
+        """Number of bytes to transfer (`int`)."""
+        if self.path is not None:
+            return self.path.stat().st_size
+        return self.buffer.nbytes
+
+    def open(self) -> BinaryIO:
+        """Open the bytes for reading.
+
+        Within a transfer attempt that may be cancelled, reads raise
+        `TransferCancelled` once it is; within a checksummed transfer, bytes
+        read update its `Checksum`.
+
+        Returns
+        -------
+        stream: `typing.BinaryIO`
+            A new seekable binary stream positioned at the start.
+        """
+        if self.path is not None:
+            stream = self.path.open("rb")
+        else:
+            stream = BufferReader(self.buffer)
+        checksum = current_checksum.get(None)
+        if checksum is not None:
+            stream = ChecksumReader(stream, checksum)
+        cancel = current_cancel.get(None)
+        if cancel is not None:
+            return CancellableReader(stream, cancel)
+        return stream
+
+
+def make_payload(
+    source: Path,
+    temp: Path,
+    dest: Path,
+    compress: bool,
+    buffer: Optional[memoryview],
+    compressor: Optional[Compressor] = None,
+) -> Payload:
+    """Prepare one exposure's image for transfer.
+
+    Parameters
+    ----------
+    source: `pathlib.Path`
+        Source file location.
+    temp: `pathlib.Path`
+        Temporary directory for staged copies.
+    dest: `pathlib.Path`
+        Destination location relative to the uploader's root.
+    compress: `bool`
+        Compress the image if true.
+    buffer: `memoryview` or `None`
+        Preloaded source contents; if `None`, stage a copy with `copy`.
+    compressor: `Compressor`, optional
+        In-process compressor; if `None`, compress the staged copy with
+        fpack.
+
+    Returns
+    -------
+    payload: `Payload`
+        Image ready for `Uploader.transfer`.
+    """
+    if buffer is not None:
+        payload = Payload(dest, buffer=buffer)
+    else:
+        logging.info(f"Copying from {source} to {temp / dest}"
+                     f" with compress = {compress}")
+        dest = copy(source, temp, dest, compress and compressor is None)
+        payload = Payload(dest, path=temp / dest)
+    if compress and compressor is not None:
+        payload = compressor.compress(payload)
+    return payload
+
+
+@log_timing
+def make_bundle(payloads: Dict[str, Payload], dest: Path) -> Payload:
+    """Pack the prepared images of an exposure's CCDs into one payload.
+
+    The layout, with an index of each CCD's byte range, is defined by
+    `bundle`.
+
+    Parameters
+    ----------
+    payloads: `dict` [`str`, `Payload`]
+        Prepared image of each CCD, keyed by CCD name.
+    dest: `pathlib.Path`
+        Destination location of the bundle.
+
+    Returns
+    -------
+    payload: `Payload`
+        The bundle, in memory.
+    """
+    import bundle
+    images = {}
+    for ccd, payload in payloads.items():
+        if payload.buffer is not None:
+            data = payload.buffer
+        else:
+            data = memoryview(payload.path.read_bytes())
+        images[ccd] = (payload.name.name, data)
+    packed, _ = bundle.pack(images)
+    logging.info(f"Bundled {len(images)} CCDs into {len(packed)} bytes")
+    return Payload(dest, buffer=memoryview(packed))
+
+
+def verify_etag(payload: Payload, etag: Optional[str]) -> bool:
+    """Verify a transfer against the ETag returned for it.
+
+    Object stores and many web servers return the MD5 of a single-request
+    upload as its ETag; multipart and other ETags are not digests.
+
+    Returns
+    -------
+    verified: `bool`
+        Whether the current transfer's checksum was verified.
+    """
+    checksum = current_checksum.get(None)
+    if checksum is None or etag is None:
+        return False
+    if re.fullmatch(r'"?[0-9a-fA-F]{32}"?', etag):
+        checksum.verify(payload.name, payload.size, {"md5": etag})
+    return checksum.outcome == "verified"
+
+
+def write_sidecar(payload: Payload, put):
+    """Write the current transfer's checksum next to it.
+
+    The sidecar is named after the payload with the algorithm as a further
+    suffix and holds one line in the format of ``md5sum``, so the receiving
+    side can check the file.
+
+    Parameters
+    ----------
+    payload: `Payload`
+        Image transferred.
+    put: callable
+        Stores bytes under a name relative to the uploader's root.
+    """
+    checksum = current_checksum.get(None)
+    if checksum is None or checksum.hashed != payload.size:
+        return
+    name = f"{payload.name}.{checksum.algorithm}"
+    # The sidecar's own bytes are not part of the checksum.
+    token = current_checksum.set(None)
+    try:
+        put(name, f"{checksum.hexdigest()}  {payload.name.name}\n".encode())
+    finally:
+        current_checksum.reset(token)
+    checksum.outcome = "sidecar"
+
+
+class Uploader(abc.ABC):
+    """Abstract base class for classes that upload files from the camera."""
+
+    @classmethod
+    def create(
+        cls,
+        dest: str,
+        slices: int = 1,
+        slice_threshold: int = 0,
+        pool_size: int = 10,
+        http_transport: str = "session",
+    ) -> Uploader:
+        """Create an Uploader based on the scheme of its destination URI.
+
+        Parameters
+        ----------
+        dest: `str`
+            Destination URI.
+        slices: `int`, optional
+            Number of slices to upload in parallel (gsapi only).
+        slice_threshold: `int`, optional
+            Minimum file size in bytes for a sliced upload (gsapi only).
+        pool_size: `int`, optional
+            Number of connections to keep for concurrent transfers
+            (boto and http only).
+        http_transport: `str`, optional
+            "session" for a requests session, "sendfile" for a connection
+            pool with zero-copy bodies, or "h2" for multiplexed HTTP/2
+            streams (http and https only).
+
+        Returns
+        -------
+        uploader: `Uploader`
+            Instance of the Uploader class configured for transfers.
+        """
+        logging.info(f"Creating uploader for {dest}")
+        track_connections()
+        if dest.startswith("gsapi://"):
+            return GsapiUploader(dest[len("gsapi://"):],
+                                 slices, slice_threshold)
+        if dest.startswith("boto://"):
+            return BotoUploader(dest[len("boto://"):], pool_size)
+        if dest.startswith("minio://"):
+            return MinioUploader(dest[len("minio://"):])
+        if dest.startswith("https://") or dest.startswith("http://"):
+            if http_transport == "sendfile":
+                return SendfileHttpUploader(dest, pool_size)
+            if http_transport == "h2":
+                return Http2Uploader(dest)
+            return HttpUploader(dest, pool_size)
+        if dest.startswith("bbcp://"):
+            return BbcpUploader(dest[len("bbcp://"):])
+        if dest.startswith("scp://"):
+            return ScpUploader(dest[len("scp://"):])
+        raise RuntimeError(f"Unrecognized URL {dest}")
+
+    def transfer(self, payload: Payload):
+        """Main method for transferring files.
+
+        Implemented by subclasses.
+
+        Destination is set by URI plus the name of the payload.
+
+        Parameters
+        ----------
+        payload: `Payload`
+            Image to transfer.
+        """
+        raise NotImplementedError("transfer not implemented")
+
+    def ping(self, n: int):
+        """Make a cheap request to open or refresh a connection.
+
+        Used by `ConnectionWarmer`; errors returned by the server still
+        show that the connection is healthy, so only failures to reach it
+        should raise.  Uploaders without persistent connections need not
+        implement it.
+
+        Parameters
+        ----------
+        n: `int`
+            Index of the connection being warmed, for uploaders that spread
+            transfers across several clients.
+        """
+        pass
+
+    async def transfer_async(self, payload: Payload):
+        """Transfer a file without blocking the event loop.
+
+        The default implementation runs the blocking `transfer` in the event
+        loop's default executor, so concurrency is bounded by that executor
+        and by the uploader's connection pool.  Subclasses with a natively
+        asynchronous transport may override it.
+
+        Parameters
+        ----------
+        payload: `Payload`
+            Image to transfer.
+        """
+        await run_in_thread(None, self.transfer, payload)
+
+
+class GsapiUploader(Uploader):
+    """Uploader using the Google Cloud Storage API.
+
+    Files at least ``slice_threshold`` bytes long can be split into
+    ``slices`` parts that are uploaded concurrently, each over its own
+    connection, and then composed server-side into the final object.
+
+    Parameters
+    ----------
+    dest: `str`
+        Bucket name, optionally followed by a slash and an object prefix.
+    slices: `int`, optional
+        Number of parallel slices; 1 disables sliced uploads.
+    slice_threshold: `int`, optional
+        Minimum file size in bytes for a sliced upload.
+    """
+
+    # Set a large chunk size to ensure that the API doesn't try to break
+    # up the file into multiple transfers.
+    CHUNK_SIZE = 100*1024*1024
+
+    # Maximum number of source objects in a single compose request.
+    MAX_COMPOSE = 32
+
+    def __init__(self, dest: str, slices: int = 1, slice_threshold: int = 0):
+        from google.cloud import storage
+        if "/" in dest:
+            bucket, self.prefix = dest.split("/", 1)
+        else:
+            bucket = dest
+            self.prefix = ""
+        if not 1 <= slices <= self.MAX_COMPOSE:
+            raise ValueError(f"Slice count {slices} not in"
+                             f" [1, {self.MAX_COMPOSE}]")
+        logging.info(f"gsapi: opening bucket {bucket}"
+                     f", saving prefix '{self.prefix}'")
+        self.bucket = storage.Client().bucket(bucket)
+        self.slices = slices
+        self.slice_threshold = slice_threshold
+        if slices > 1:
+            # Give each slice its own client so that slices do not contend
+            # for a single connection.
+            logging.info(f"gsapi: using {slices} slices for files of at"
+                         f" least {slice_threshold} bytes")
+            self.slice_buckets = [storage.Client().bucket(bucket)
+                                  for _ in range(slices)]
+            self.executor = ThreadPoolExecutor(max_workers=slices)
+
+    def ping(self, n: int):
+        from google.api_core.exceptions import ClientError
+        buckets = [self.bucket]
+        if self.slices > 1:
+            buckets += self.slice_buckets
+        try:
+            buckets[n % len(buckets)].blob(".null").exists()
+        except ClientError as exc:
+            logging.info(f"Ignored: {exc}")
+
+    @log_timing
+    @track_transfer
+    def transfer(self, payload: Payload):
+        logging.info(f"gsapi: uploading to {self.prefix}/{payload.name}")
+        if self.prefix == "":
+            name = f"{payload.name}"
+        else:
+            name = f"{self.prefix}/{payload.name}"
+        size = payload.size
+        if self.slices > 1 and size >= self.slice_threshold:
+            self._sliced_upload(payload, name, size)
+            return
+        blob = self.bucket.blob(name, chunk_size=self.CHUNK_SIZE)
+        with payload.open() as s:
+            blob.upload_from_file(s, size=size)
+        checksum = current_checksum.get(None)
+        if checksum is not None:
+            # GCS computes both digests of every object it stores.
+            checksum.verify(payload.name, size, {"md5": blob.md5_hash,
+                                                 "crc32c": blob.crc32c})
+
+    def _sliced_upload(self, payload: Payload, name: str, size: int):
+        """Upload a file as concurrent slices composed into one object.
+
+        Parameters
+        ----------
+        payload: `Payload`
+            Image to upload.
+        name: `str`
+            Name of the final object within the bucket.
+        size: `int`
+            Size of the image in bytes.
+        """
+        step = -(-size // self.slices)
+        ctx = contextvars.copy_context()
+        futures = [
+            self.executor.submit(
+                ctx.copy().run, self._upload_slice, self.slice_buckets[i],
+                payload, f"{name}.slice{i:02d}",
+                offset, min(step, size - offset)
+            )
+            for i, offset in enumerate(range(0, size, step))
+        ]
+        parts, checksums = zip(*(future.result() for future in futures))
+        # Each slice was verified on its own.
+        checksum = current_checksum.get(None)
+        if checksum is not None:
+            checksum.absorb(checksums)
+        self._compose(name, list(parts))
+        # The composed object is complete; remove the slices off the
+        # critical path.
+        for part in parts:
+            self.executor.submit(ctx.copy().run, self._delete_slice, part)
+
+    @log_timing
+    def _upload_slice(self, bucket, payload: Payload, name: str,
+                      offset: int, length: int):
+        """Upload one byte range of an image as its own object.
+
+        Returns
+        -------
+        blob: `google.cloud.storage.Blob`
+            The uploaded slice.
+        checksum: `Checksum` or `None`
+            Checksum of the slice, verified against the stored object.
+        """
+        logging.info(f"gsapi: uploading slice {name}"
+                     f" bytes {offset}-{offset + length - 1}")
+        blob = bucket.blob(name, chunk_size=self.CHUNK_SIZE)
+        # Runs in its own context, so the slice can have its own checksum.
+        checksum = checksum_stats.start(offset)
+        current_checksum.set(checksum)
+        with payload.open() as s:
+            s.seek(offset)
+            blob.upload_from_file(s, size=length)
+        if checksum is not None:
+            checksum.verify(Path(name), length, {"md5": blob.md5_hash,
+                                                 "crc32c": blob.crc32c})
+        return blob, checksum
+
+    @log_timing
+    def _compose(self, name: str, parts: list):
+        logging.info(f"gsapi: composing {len(parts)} slices into {name}")
+        self.bucket.blob(name).compose(parts)
+
+    @staticmethod
+    def _delete_slice(part):
+        try:
+            part.delete()
+        except Exception as exc:
+            logging.info(f"Ignored: {exc}")
+
+
+class BotoUploader(Uploader):
+    """Uploader using the Boto object store API.
+
+    Should work for AWS S3 or Google Cloud Storage or MinIO."""
+
+    def __init__(self, dest: str, pool_size: int = 10):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+        from s3transfer.manager import TransferManager
+        host, self.bucket, self.prefix = dest.split("/", 2)
+        logging.info(f"boto: opening host {host}, saving bucket {self.bucket}"
+                     f", prefix '{self.prefix}'")
+        self.client = boto3.client(
+            's3', config=Config(max_pool_connections=pool_size)
+        )
+        # A long-lived transfer manager, as used by upload_fileobj, whose
+        # threads see the context of the transfer that started them.
+        self.manager = TransferManager(self.client, TransferConfig(),
+                                       executor_cls=ContextExecutor)
+
+    def ping(self, n: int):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_bucket(Bucket=self.bucket)
+        except ClientError as exc:
+            logging.info(f"Ignored: {exc}")
+
+    @log_timing
+    @track_transfer
+    def transfer(self, payload: Payload):
+        logging.info(f"boto: uploading to {self.prefix}/{payload.name}")
+        # S3 checks a CRC32C that botocore streams after the body.  It has
+        # no equivalent for MD5, and the transfer manager does not return
+        # the ETag, so main() rejects MD5 for boto:// destinations.
+        checksum = current_checksum.get(None)
+        extra_args = {}
+        if checksum is not None and checksum.algorithm == "crc32c":
+            extra_args["ChecksumAlgorithm"] = "CRC32C"
+        with payload.open() as s:
+            self.manager.upload(s, self.bucket,
+                                f"{self.prefix}/{payload.name}",
+                                extra_args).result()
+        if extra_args:
+            checksum.outcome = "transport"
+
+
+class MinioUploader(Uploader):
+    """Uploader using the MinIO object store API.
+
+    Connections use TLS unless ``MINIO_SECURE`` is set to 0, as for a local
+    test endpoint.
+    """
+
+    def __init__(self, dest: str):
+        from minio import Minio
+        host, self.bucket, self.prefix = dest.split("/", 2)
+        secure = os.environ.get("MINIO_SECURE", "1") != "0"
+        logging.info(f"minio: opening host {host}, saving bucket {self.bucket}"
+                     f", prefix '{self.prefix}', secure = {secure}")
+        self.conn = Minio(host, secure=secure)
+
+    def ping(self, n: int):
+        from minio.error import S3Error
+        try:
+            self.conn.bucket_exists(self.bucket)
+        except S3Error as exc:
+            logging.info(f"Ignored: {exc}")
+
+    @log_timing
+    @track_transfer
+    def transfer(self, payload: Payload):
+        logging.info(f"minio: uploading to {self.prefix}/{payload.name}")
+        with payload.open() as s:
+            result = self.conn.put_object(
+                self.bucket,
+                f"{self.prefix}/{payload.name}",
+                s,
+                payload.size
+            )
+        verify_etag(payload, result.etag)
+
+
+class HttpUploader(Uploader):
+    """Uploader using HTTP PUT to an ordinary web server."""
+
+    def __init__(self, dest: str, pool_size: int = 10):
+        import requests
+        from requests.adapters import HTTPAdapter
+        logging.info(f"http: opening session to {dest}")
+        self.url = dest
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def ping(self, n: int):
+        # Any response, even an error status, means the connection works.
+        self.session.head(self.url)
+
+    @log_timing
+    @track_transfer
+    def transfer(self, payload: Payload):
+        logging.info(f"http: putting to {self.url}/{payload.name}")
+        with payload.open() as s:
+            r = self.session.put(f"{self.url}/{payload.name}", data=s)
+        r.raise_for_status()
+        if not verify_etag(payload, r.headers.get("ETag")):
+            write_sidecar(payload, self._put)
+
+    def _put(self, name: str, data: bytes):
+        self.session.put(f"{self.url}/{name}", data=data).raise_for_status()
+
+
+class SendfileHttpUploader(Uploader):
+    """Uploader using HTTP/1.1 PUT with zero-copy request bodies.
+
+    Keeps its own pool of persistent connections, each carrying one request
+    at a time.  Staged payloads are sent with `socket.socket.sendfile`, so
+    on Linux the file data goes from the page cache to the socket without
+    passing through user space; buffered payloads are written straight from
+    their memoryview.  Over TLS the kernel cannot encrypt the data, so
+    bodies are sent with ordinary writes.
+
+    Parameters
+    ----------
+    dest: `str`
+        http or https URL of the destination directory.
+    pool_size: `int`, optional
+        Maximum number of idle connections to keep.
+    """
+
+    # Bytes per sendfile or write call.
+    SEND_CHUNK = 8 * 1024 * 1024
+
+    def __init__(self, dest: str, pool_size: int = 10):
+        url = urlsplit(dest)
+        logging.info(f"http-sendfile: opening pool to {dest}")
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == "https" else 80)
+        self.netloc = url.netloc
+        self.prefix = url.path.rstrip("/")
+        self.ssl_context = None
+        if url.scheme == "https":
+            self.ssl_context = ssl.create_default_context()
+        self.pool: queue.LifoQueue = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self) -> socket.socket:
+        start = time.time()
+        sock = socket.create_connection((self.host, self.port))
+        # Honor the same options, such as keepalive, as urllib3.
+        for option in HTTPConnection.default_socket_options:
+            sock.setsockopt(*option)
+        if self.ssl_context is not None:
+            sock = self.ssl_context.wrap_socket(sock,
+                                                server_hostname=self.host)
+        note_connection(time.time() - start)
+        return sock
+
+    def _send(self, sock: socket.socket, method: str, path: str,
+              payload: Optional[Payload]):
+        size = payload.size if payload is not None else 0
+        head = (f"{method} {quote(path)} HTTP/1.1\r\n"
+                f"Host: {self.netloc}\r\n"
+                f"Content-Length: {size}\r\n\r\n").encode("ascii")
+        # Hold back the header until the body follows so that they share
+        # packets.
+        cork = self.ssl_context is None and hasattr(socket, "TCP_CORK")
+        if cork:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+        try:
+            sock.sendall(head)
+            # Send in chunks so that a cancelled attempt stops promptly.
+            # Checksums hash each chunk as it goes, from the page cache
+            # through a mapping for staged files.
+            checksum = current_checksum.get(None)
+            if payload is None or size == 0:
+                pass
+            elif payload.path is not None:
+                with payload.path.open("rb") as f:
+                    view = None
+                    if checksum is not None:
+                        mapped = mmap.mmap(f.fileno(), size,
+                                           access=mmap.ACCESS_READ)
+                        view = memoryview(mapped)
+                    try:
+                        for offset in range(0, size, self.SEND_CHUNK):
+                            check_cancelled()
+                            sock.sendfile(f, offset, self.SEND_CHUNK)
+                            if view is not None:
+                                with view[offset:
+                                          offset + self.SEND_CHUNK] as chunk:
+                                    checksum.update(offset, chunk)
+                    finally:
+                        if view is not None:
+                            view.release()
+                            mapped.close()
+            else:
+                data = payload.buffer.cast("B")
+                for offset in range(0, size, self.SEND_CHUNK):
+                    check_cancelled()
+                    chunk = data[offset:offset + self.SEND_CHUNK]
+                    sock.sendall(chunk)
+                    if checksum is not None:
+                        checksum.update(offset, chunk)
+        finally:
+            if cork:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+
+    def _request(self, method: str, path: str,
+                 payload: Optional[Payload] = None
+                 ) -> http.client.HTTPResponse:
+        """Send a request over a pooled connection.
+
+        A request on a reused connection that the server has closed in the
+        meantime is retried once on a new connection; PUT and HEAD are
+        idempotent.
+
+        Returns
+        -------
+        response: `http.client.HTTPResponse`
+            The response, with its body read.
+        """
+        try:
+            sock, reused = self.pool.get_nowait(), True
+        except queue.Empty:
+            sock, reused = self._connect(), False
+        try:
+            self._send(sock, method, path, payload)
+            response = http.client.HTTPResponse(sock, method=method)
+            response.begin()
+            response.read()
+            response.close()
+        except (ConnectionError, http.client.BadStatusLine):
+            sock.close()
+            if not reused:
+                raise
+            return self._request(method, path, payload)
+        except BaseException:
+            sock.close()
+            raise
+        if response.will_close:
+            sock.close()
+        else:
+            try:
+                self.pool.put_nowait(sock)
+            except queue.Full:
+                sock.close()
+        return response
+
+    def ping(self, n: int):
+        # Any response, even an error status, means the connection works.
+        self._request("HEAD", self.prefix + "/")
+
+    @log_timing
+    @track_transfer
+    def transfer(self, payload: Payload):
+        path = f"{self.prefix}/{payload.name}"
+        logging.info(f"http-sendfile: putting to {path}")
+        response = self._request("PUT", path, payload)
+        if response.status >= 400:
+            raise RuntimeError(
+                f"PUT {path} failed with status {response.status}"
+            )
+        if not verify_etag(payload, response.getheader("ETag")):
+            write_sidecar(payload, self._put)
+
+    def _put(self, name: str, data: bytes):
+        path = f"{self.prefix}/{name}"
+        response = self._request("PUT", path,
+                                 Payload(Path(name), buffer=memoryview(data)))
+        if response.status >= 400:
+            raise RuntimeError(
+                f"PUT {path} failed with status {response.status}"
+            )
+
+
+class Http2Uploader(Uploader):
+    """Uploader multiplexing concurrent PUTs as HTTP/2 streams.
+
+    All transfers of the uploader share one connection per origin, so with
+    the asyncio engine every CCD of a node is carried by a single TCP
+    connection.  Plain http destinations use HTTP/2 with prior knowledge
+    (h2c).  HTTP/2 frames the body, so it cannot be sent with sendfile.
+
+    Parameters
+    ----------
+    dest: `str`
+        http or https URL of the destination directory.
+    """
+
+    # Bytes read from the payload per body chunk.
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, dest: str):
+        import httpx
+        logging.info(f"http2: opening client to {dest}")
+        self.url = dest
+        self.client = httpx.Client(http1=False, http2=True,
+                                   timeout=httpx.Timeout(None))
+
+    @staticmethod
+    def _extensions() -> dict:
+        """Request extensions that time any new connection.
+
+        httpx does not use urllib3, so handshakes are observed through
+        httpcore's trace events instead.
+        """
+        start = None
+
+        def trace(event: str, info: dict):
+            nonlocal start
+            if event == "connection.connect_tcp.started":
+                start = time.time()
+            elif (event == "http2.send_connection_init.complete"
+                    and start is not None):
+                note_connection(time.time() - start)
+
+        return {"trace": trace}
+
+    def ping(self, n: int):
+        self.client.head(self.url, extensions=self._extensions())
+
+    @log_timing
+    @track_transfer
+    def transfer(self, payload: Payload):
+        logging.info(f"http2: putting to {self.url}/{payload.name}")
+        with payload.open() as s:
+            r = self.client.put(
+                f"{self.url}/{payload.name}",
+                content=iter(lambda: s.read(self.CHUNK_SIZE), b""),
+                headers={"Content-Length": str(payload.size)},
+                extensions=self._extensions()
+            )
+        r.raise_for_status()
+        if not verify_etag(payload, r.headers.get("ETag")):
+            write_sidecar(payload, self._put)
+
+    def _put(self, name: str, data: bytes):
+        self.client.put(f"{self.url}/{name}", content=data,
+                        extensions=self._extensions()).raise_for_status()
+
+
+# Bytes per write when pumping a stream into a command.
+PUMP_CHUNK = 1024 * 1024
+
+
+def _has_fileno(stream: Optional[BinaryIO]) -> bool:
+    if stream is None:
+        return True
+    try:
+        stream.fileno()
+    except (OSError, io.UnsupportedOperation):
+        return False
+    return True
+
+
+def _pump(stream: BinaryIO, pipe: BinaryIO, errors: list):
+    """Copy a stream into a command's input until the end or an error."""
+    try:
+        while chunk := stream.read(PUMP_CHUNK):
+            pipe.write(chunk)
+    except BrokenPipeError:
+        # The command exited early; its status tells why.
+        pass
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            pass
+
+
+def run_command(command: List[str], stdin: Optional[BinaryIO] = None,
+                capture: bool = False) -> Optional[bytes]:
+    """Run a transfer command, killing it if the attempt is cancelled.
+
+    Parameters
+    ----------
+    command: `list` [`str`]
+        Command and arguments.
+    stdin: `typing.BinaryIO`, optional
+        Standard input of the command.  A stream without a file descriptor,
+        such as a buffer or a checksummed file, is pumped through a pipe.
+    capture: `bool`, optional
+        Whether to capture standard output.
+
+    Returns
+    -------
+    stdout: `bytes` or `None`
+        Standard output, if captured.
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        Raised if the command fails.
+    """
+    cancel = current_cancel.get(None)
+    source = None
+    if not _has_fileno(stdin):
+        source, stdin = stdin, subprocess.PIPE
+    stdout = subprocess.PIPE if capture else None
+    errors: list = []
+    with subprocess.Popen(command, stdin=stdin, stdout=stdout) as proc:
+        pump = None
+        if source is not None:
+            # Keep communicate from closing the pipe under the pump.
+            pipe, proc.stdin = proc.stdin, None
+            pump = threading.Thread(target=_pump,
+                                    args=(source, pipe, errors))
+            pump.start()
+        try:
+            while True:
+                try:
+                    out, _ = proc.communicate(timeout=0.1)
+                    break
+                except subprocess.TimeoutExpired:
+                    if cancel is not None and cancel.is_set():
+                        proc.kill()
+                        raise TransferCancelled()
+        finally:
+            if pump is not None:
+                pump.join()
+    if errors:
+        raise errors[0]
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, command)
+    return out
+
+
+async def run_command_async(command: List[str],
+                            stdin: Optional[BinaryIO] = None,
+                            capture: bool = False) -> Optional[bytes]:
+    """Run a transfer command, killing it if the task is cancelled.
+
+    Parameters, return value, and exceptions are as for `run_command`.
+    """
+    source = None
+    if not _has_fileno(stdin):
+        source, stdin = stdin, asyncio.subprocess.PIPE
+    proc = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=stdin,
+        stdout=asyncio.subprocess.PIPE if capture else None
+    )
+
+    async def pump():
+        try:
+            while chunk := source.read(PUMP_CHUNK):
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            proc.stdin.close()
+
+    try:
+        if source is None:
+            out, _ = await proc.communicate()
+        else:
+            _, (out, _) = await asyncio.gather(pump(), proc.communicate())
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, command)
+    return out
+
+
+class BbcpUploader(Uploader):
+    """Uploader using bbcp to a remote filesystem.
+
+    bbcp reads from a local file, so the payload must be staged.
+    """
+
+    def __init__(self, dest: str):
+        self.host, path = dest.split("/", 1)
+        logging.info(f"bbcp: saving host {self.host} and path {path}")
+        self.path = Path(path)
+
+    def _command(self, payload: Payload) -> list:
+        if payload.path is None:
+            raise RuntimeError("bbcp requires a staged source file")
+        logging.info(f"bbcp: dir {self.path / payload.name.parent};"
+                     f" file {payload.name}")
+        # -A is supposed to create the remote directory, but it appears to be
+        # buggy.
+        options = ["-A"]
+        if current_checksum.get(None) is not None:
+            # bbcp reads the file itself, so let it check the data end to
+            # end; it has no CRC32C, so MD5 is used whatever the algorithm.
+            options += ["-e", "-E", "md5"]
+        return ["bbcp", *options, payload.path,
+                f"{self.host}:{self.path / payload.name}"]
+
+    @log_timing
+    @track_transfer
+    def transfer(self, payload: Payload):
+        # Every bbcp invocation sets up its own connections.
+        note_connection()
+        run_command(self._command(payload))
+        self._checked()
+
+    @log_timing
+    @track_transfer
+    async def transfer_async(self, payload: Payload):
+        note_connection()
+        await run_command_async(self._command(payload))
+        self._checked()
+
+    def _checked(self):
+        checksum = current_checksum.get(None)
+        if checksum is not None:
+            checksum.outcome = "transport"
+
+
+class ScpUploader(Uploader):
+    """Uploader using scp to a remote filesystem.
+
+    Once warmed, transfers are multiplexed over a persistent ssh master
+    connection shared by all processes on the node.
+    """
+
+    # Seconds an idle master connection stays up.
+    CONTROL_PERSIST = 600
+
+    def __init__(self, dest: str):
+        self.host, path = dest.split("/", 1)
+        logging.info(f"scp: saving host {self.host} and path {path}")
+        self.path = Path(path)
+        self.control_path: Optional[Path] = None
+
+    def ping(self, n: int):
+        if n > 0:
+            # A single master multiplexes all sessions.
+            return
+        self.control_path = Path(tempfile.gettempdir(),
+                                 f"apxfr-ssh-{self.host}")
+        if not self.control_path.exists():
+            note_connection()
+        subprocess.run(["ssh", "-o", f"ControlPath={self.control_path}",
+                        "-o", "ControlMaster=auto",
+                        "-o", f"ControlPersist={self.CONTROL_PERSIST}",
+                        self.host, "true"], check=True)
+
+    def _ssh(self) -> list:
+        options = []
+        if self.control_path is not None:
+            options = ["-o", f"ControlPath={self.control_path}"]
+        if self.control_path is None or not self.control_path.exists():
+            note_connection()
+        return ["ssh", *options, self.host]
+
+    def _command(self, payload: Payload) -> list:
+        logging.info(f"scp: dir {self.path / payload.name.parent};"
+                     f" file {payload.name}")
+        # We may have to create the remote directory; try to do it all in
+        # one ssh connection for efficiency.  Write under a name unique to
+        # the remote shell and rename only once complete: a killed client
+        # just closes the remote input, so a cancelled or failed attempt
+        # must be caught by its size.
+        dest = self.path / payload.name
+        partial = f"{dest}.part-$$"
+        write = f"cat > {partial}"
+        if self._remote_md5():
+            # Digest the bytes as written; a mismatch fails the attempt
+            # and the retry replaces the file.
+            write = f"tee {partial} | md5sum"
+        return [*self._ssh(),
+                f"mkdir -p {dest.parent};"
+                f"{write}"
+                f" && [ $(wc -c < {partial}) -eq {payload.size} ]"
+                f" && mv {partial} {dest}"
+                f" || {{ rm -f {partial}; exit 1; }}"]
+
+    def _remote_md5(self) -> bool:
+        checksum = current_checksum.get(None)
+        return checksum is not None and checksum.algorithm == "md5"
+
+    def _verify(self, payload: Payload, out: Optional[bytes]):
+        if self._remote_md5():
+            current_checksum.get().verify(
+                payload.name, payload.size,
+                {"md5": out.split()[0].decode("ascii")}
+            )
+        else:
+            write_sidecar(payload, self._put)
+
+    def _put(self, name: str, data: bytes):
+        run_command([*self._ssh(), f"cat > {self.path / name}"],
+                    stdin=io.BytesIO(data))
+
+    @log_timing
+    @track_transfer
+    def transfer(self, payload: Payload):
+        command = self._command(payload)
+        with payload.open() as s:
+            out = run_command(command, stdin=s, capture=self._remote_md5())
+        self._verify(payload, out)
+
+    @log_timing
+    @track_transfer
+    async def transfer_async(self, payload: Payload):
+        command = self._command(payload)
+        with payload.open() as s:
+            out = await run_command_async(command, stdin=s,
+                                          capture=self._remote_md5())
+        await asyncio.to_thread(self._verify, payload, out)
+
+
+class TransferPolicy(Uploader):
+    """Retry and hedge the transfers of another uploader.
 
-    Each exposure is triggered at a given start time plus a time interval
-    between exposures.  These times are computed as wall-clock times rather
-    than relative times to ensure consistency across multiple processes and
-    computers.
+    A failed transfer is retried up to ``retries`` times, after a backoff
+    that doubles with each attempt and is jittered so that CCDs failing
+    together do not retry together.
+
+    When ``hedge_percentile`` is set, a transfer still running after that
+    percentile of recent transfer times gets a hedged duplicate; the first
+    attempt to finish wins and the other is cancelled.  Cancellation is
+    cooperative: streamed bodies stop at their next read, and transfer
+    commands are killed.  Both attempts write the same destination name,
+    which object stores replace atomically.
 
     Parameters
     ----------
-    hour, minute: `int`
-        The time to start the first exposure.
-    interval: `int`
-        Interval between exposures in seconds.
+    uploader: `Uploader`
+        Uploader performing the transfers.
+    retries: `int`, optional
+        Number of times to retry a failed transfer.
+    backoff: `float`, optional
+        Seconds to wait before the first retry.
+    hedge_percentile: `float`, optional
+        Percentile of recent transfer times after which to hedge; 0
+        disables hedging.
     """
 
-    def __init__(self, hour: int, minute: int, interval: int):
-        self.base_time = datetime.now().replace(hour=hour, minute=minute,
-                                                second=0, microsecond=0)
-        self.interval = interval
-
-    def wait_exposure(self, num: int):
-        """Wait for the given exposure number.
-
-        Parameters
-        ----------
-        num: `int`
-            Number of the exposure to wait for.
+    # Number of recent transfer times kept, and needed before hedging.
+    WINDOW = 100
+    MIN_SAMPLES = 10
+    # Longest wait between retries in seconds.
+    MAX_BACKOFF = 30.0
+
+    def __init__(self, uploader: Uploader, retries: int = 2,
+                 backoff: float = 1.0, hedge_percentile: float = 0.0):
+        self.uploader = uploader
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_percentile = hedge_percentile
+        self.lock = threading.Lock()
+        self.recent: deque = deque(maxlen=self.WINDOW)
+        self.executor = ThreadPoolExecutor(thread_name_prefix="hedge")
+        self.transfers = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failures = 0
+
+    def ping(self, n: int):
+        self.uploader.ping(n)
+
+    def _threshold(self) -> Optional[float]:
+        """Return the time after which to hedge, if hedging."""
+        if self.hedge_percentile <= 0:
+            return None
+        with self.lock:
+            samples = sorted(self.recent)
+        if len(samples) < self.MIN_SAMPLES:
+            return None
+        rank = math.ceil(len(samples) * self.hedge_percentile / 100) - 1
+        return samples[min(max(rank, 0), len(samples) - 1)]
+
+    def _succeeded(self, seconds: float, hedge_won: bool):
+        with self.lock:
+            self.transfers += 1
+            self.recent.append(seconds)
+            if hedge_won:
+                self.hedge_wins += 1
+
+    def _retry_delay(self, payload: Payload, attempt: int,
+                     exc: Exception) -> float:
+        """Count a failure and return how long to wait before retrying.
+
+        Raises the failure again if no retries are left.
         """
-        when = self.base_time + timedelta(seconds=num * self.interval)
-        delay = (when - datetime.now()).total_seconds()
-        delay_str = f"{abs(delay)} seconds for exposure {num} at {when}"
-        if delay < 0:
-            logging.info("Late " + delay_str)
+        if attempt >= self.retries:
+            with self.lock:
+                self.failures += 1
+            logging.error(f"Giving up on {payload.name} after"
+                          f" {attempt + 1} attempts")
+            raise exc
+        delay = min(self.backoff * 2 ** attempt, self.MAX_BACKOFF)
+        delay *= random.uniform(0.5, 1.0)
+        with self.lock:
+            self.retried += 1
+        logging.warning(f"Retrying {payload.name} in {delay} seconds"
+                        f" after {exc!r}")
+        metrics.record("retry", delay)
+        return delay
+
+    def _hedging(self, payload: Payload, threshold: float):
+        with self.lock:
+            self.hedged += 1
+        logging.info(f"Hedging {payload.name} after {threshold} seconds")
+        metrics.record("hedge", threshold)
+
+    @staticmethod
+    def _attempt_context() -> Tuple[contextvars.Context, threading.Event]:
+        """Make a context for one attempt, with its own cancellation."""
+        cancel = threading.Event()
+        ctx = contextvars.copy_context()
+        ctx.run(current_cancel.set, cancel)
+        return ctx, cancel
+
+    def transfer(self, payload: Payload):
+        for attempt in range(self.retries + 1):
+            start = time.time()
+            try:
+                hedge_won = self._hedged_transfer(payload)
+            except Exception as exc:
+                time.sleep(self._retry_delay(payload, attempt, exc))
+                continue
+            self._succeeded(time.time() - start, hedge_won)
             return
-        logging.info("Sleeping " + delay_str)
-        time.sleep(delay)
 
+    def _hedged_transfer(self, payload: Payload) -> bool:
+        """Transfer, hedging if slow; return whether the hedge won."""
+        threshold = self._threshold()
+        if threshold is None:
+            self.uploader.transfer(payload)
+            return False
+
+        def start() -> Future:
+            ctx, cancel = self._attempt_context()
+            future = self.executor.submit(ctx.run, self.uploader.transfer,
+                                          payload)
+            attempts[future] = cancel
+            return future
+
+        attempts: Dict[Future, threading.Event] = {}
+        primary = start()
+        if not wait([primary], timeout=threshold).done:
+            self._hedging(payload, threshold)
+            start()
+        pending = set(attempts)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        attempts[loser].set()
+                    return future is not primary
+        raise primary.exception()
+
+    async def transfer_async(self, payload: Payload):
+        for attempt in range(self.retries + 1):
+            start = time.time()
+            try:
+                hedge_won = await self._hedged_transfer_async(payload)
+            except Exception as exc:
+                await asyncio.sleep(self._retry_delay(payload, attempt, exc))
+                continue
+            self._succeeded(time.time() - start, hedge_won)
+            return
 
-def log_timing(func):
-    """Decorator to log timing information for a function."""
+    async def _hedged_transfer_async(self, payload: Payload) -> bool:
+        threshold = self._threshold()
+        if threshold is None:
+            await self.uploader.transfer_async(payload)
+            return False
+
+        def start() -> asyncio.Task:
+            ctx, cancel = self._attempt_context()
+            task = ctx.run(asyncio.create_task,
+                           self.uploader.transfer_async(payload))
+            attempts[task] = cancel
+            return task
+
+        attempts: Dict[asyncio.Task, threading.Event] = {}
+        primary = start()
+        done, _ = await asyncio.wait([primary], timeout=threshold)
+        if not done:
+            self._hedging(payload, threshold)
+            start()
+        pending = set(attempts)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    # Attempts running in threads stop at their next read.
+                    for loser in pending:
+                        attempts[loser].set()
+                        loser.cancel()
+                    return task is not primary
+        raise primary.exception()
+
+    def log_summary(self):
+        """Log the retry and hedge counts of all transfers."""
+        logging.info(f"Transfer policy: {self.transfers} transfers"
+                     f", {self.retried} retries, {self.hedged} hedges"
+                     f" ({self.hedge_wins} won by the hedge)"
+                     f", {self.failures} failures")
+
+
+class CoordinatedUploader(Uploader):
+    """Transfer only when admitted by a node's `BandwidthCoordinator`.
 
-    @functools.wraps(func)
-    def wrapper(self, *args, **kwargs):
-        logging.info(f"Start {func.__name__}")
+    Parameters
+    ----------
+    uploader: `Uploader`
+        Uploader performing the transfers.
+    path: `pathlib.Path`
+        Socket of the coordinator.
+    waiter: `Waiter`
+        Schedule giving the deadline of each exposure.
+    """
+
+    def __init__(self, uploader: Uploader, path: Path, waiter: Waiter):
+        self.uploader = uploader
+        self.path = path
+        self.waiter = waiter
+
+    def ping(self, n: int):
+        self.uploader.ping(n)
+
+    @contextlib.contextmanager
+    def _admitted(self, payload: Payload) -> Iterator[None]:
+        num = current_exposure.get((0, 0))[0]
         start = time.time()
-        try:
-            res = func(self, *args, **kwargs)
-        finally:
-            delta = time.time() - start
-            logging.info(f"End {func.__name__} = {delta}")
-        return res
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(self.path))
+            sock.sendall(f"{self.waiter.deadline(num)} {payload.size}"
+                         f" {current_ccd.get()}\n".encode())
+            if sock.makefile("rb").readline() != b"go\n":
+                raise RuntimeError("Bandwidth coordinator went away")
+            metrics.record("admission", time.time() - start)
+            yield
 
-    return wrapper
+    def transfer(self, payload: Payload):
+        with self._admitted(payload):
+            self.uploader.transfer(payload)
 
+    def log_summary(self):
+        self.uploader.log_summary()
 
-@log_timing
-def copy(source: Path, temp: Path, dest: Path, compress: bool = False) -> Path:
-    """Copy a file to a temporary location, optionally with compression.
 
-    Parameters
-    ----------
-    source: `pathlib.Path`
-        Source file location.
-    temp: `pathlib.Path`
-        Temporary directory to which to copy the file.
-        Intended to ensure that transfers come from RAM rather than disk.
-    dest: `pathlib.Path`
-        Destination location within temporary directory.
-    compress: `bool`, optional
-        Compress the file with fpack if true.
+class WorkerStatus:
+    """Live progress of a CCD worker, reported to its `Supervisor`.
 
-    Returns
-    -------
-    finaldest: `pathlib.Path`
-        Destination location updated with compression suffix if appropriate.
+    Events are sent as JSON lines over one connection to the supervisor's
+    Unix socket.  Reporting is best effort: if the supervisor goes away,
+    the worker carries on and stops reporting.
     """
-    (temp / dest).parent.mkdir(parents=True, exist_ok=True)
-    logging.info(f"Copying {source} to {temp / dest}")
-    subprocess.run(["cp", f"{source}", f"{temp / dest}"])
-    if compress:
-        logging.info(f"Compressing {temp / dest}")
-        subprocess.run(["fpack", f"{temp / dest}"])
-        dest = dest.with_suffix(".fits.fz")
-    return dest
 
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sock: Optional[socket.socket] = None
 
-class Uploader(abc.ABC):
-    """Abstract base class for classes that upload files from the camera."""
+    def connect(self, path: Path):
+        """Start reporting to the supervisor listening on ``path``."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(str(path))
+        self.sock = sock
+        self.send("hello", pid=os.getpid())
 
-    @classmethod
-    def create(cls, dest: str) -> Uploader:
-        """Create an Uploader based on the scheme of its destination URI.
+    def send(self, event: str, **fields):
+        """Report an event of the current CCD and exposure.
 
         Parameters
         ----------
-        dest: `str`
-            Destination URI.
-
-        Returns
-        -------
-        uploader: `Uploader`
-            Instance of the Uploader class configured for transfers.
+        event: `str`
+            Kind of event, such as "started" or "transfer".
+        **fields
+            Values describing the event.
         """
-        logging.info(f"Creating uploader for {dest}")
-        if dest.startswith("gsapi://"):
-            return GsapiUploader(dest[len("gsapi://"):])
-        if dest.startswith("boto://"):
-            return GsapiUploader(dest[len("boto://"):])
-        if dest.startswith("minio://"):
-            return GsapiUploader(dest[len("minio://"):])
-        if dest.startswith("https://") or dest.startswith("http://"):
-            return HttpUploader(dest)
-        if dest.startswith("bbcp://"):
-            return HttpUploader(dest[len("bbcp://"):])
-        if dest.startswith("scp://"):
-            return ScpUploader(dest[len("scp://"):])
-        raise RuntimeError(f"Unrecognized URL {dest}")
+        if self.sock is None:
+            return
+        num, _ = current_exposure.get((None, None))
+        fields.update(event=event, ccd=current_ccd.get(""), exposure=num)
+        line = json.dumps(fields).encode() + b"\n"
+        with self.lock:
+            try:
+                self.sock.sendall(line)
+            except OSError as exc:
+                logging.warning(f"Supervisor went away: {exc}")
+                self.sock.close()
+                self.sock = None
 
-    def transfer(self, temp_dir: Path, source: Path):
-        """Main method for transferring files.
 
-        Implemented by subclasses.
+# Reporter of this process's progress, connected in supervised workers.
+worker_status = WorkerStatus()
+
+
+class ConnectionWarmer:
+    """Keep an uploader's connections open across the gaps between exposures.
+
+    Idle connections may be closed by the server or a middlebox during the
+    interval between exposures, so the first transfer of each exposure
+    would pay for a new handshake.  Shortly before each exposure is due,
+    `Waiter` calls `warm_for`, which pings the destination over
+    ``connections`` connections at once; stale connections are detected by
+    the connection pool and replaced before the deadline instead of during
+    the transfer.
+
+    Parameters
+    ----------
+    uploader: `Uploader`
+        Uploader whose connections to warm.
+    connections: `int`
+        Number of connections to keep warm; at most the uploader's pool size
+        are retained.
+    lead: `float`
+        Seconds before each exposure to refresh the connections.
+    """
+
+    def __init__(self, uploader: Uploader, connections: int, lead: float):
+        self.uploader = uploader
+        self.connections = connections
+        self.lead = lead
+        self.executor = ThreadPoolExecutor(max_workers=connections)
+        self.lock = threading.Lock()
+        self.warmed = -1
 
-        Destination is set by URI plus the result of the `copy` function.
+    def warm_for(self, num: int):
+        """Warm the connections once per exposure.
+
+        With the asyncio engine every CCD waits for the same exposure, but
+        only the first needs to warm the shared uploader.
 
         Parameters
         ----------
-        temp_dir: `pathlib.Path`
-            Temporary directory to use during transfer.
-        source: `pathlib.Path`
-            Source file to transfer.
+        num: `int`
+            Number of the exposure about to start.
         """
-        raise NotImplementedError("transfer not implemented")
-
+        with self.lock:
+            if num <= self.warmed:
+                return
+            self.warmed = num
+        self.warm()
 
-class GsapiUploader(Uploader):
-    """Uploader using the Google Cloud Storage API."""
+    @log_timing
+    def warm(self):
+        """Open or refresh the connections and check their health."""
+        count = ConnectionCount()
+        token = current_connections.set(count)
+        try:
+            ctx = contextvars.copy_context()
+            futures = [self.executor.submit(ctx.copy().run, self._ping, n)
+                       for n in range(self.connections)]
+            failures = sum(not future.result() for future in futures)
+        finally:
+            current_connections.reset(token)
+        logging.info(f"Warmed {self.connections - failures} connections"
+                     f" with {count.opened} new handshakes")
+        connection_stats.record_warmup(count, failures)
 
-    def __init__(self, dest: str):
-        from google.cloud import storage
-        if "/" in dest:
-            bucket, self.prefix = dest.split("/", 1)
-        else:
-            bucket = dest
-            self.prefix = ""
-        logging.info(f"gsapi: opening bucket {bucket}"
-                     f", saving prefix '{self.prefix}'")
-        self.bucket = storage.Client().bucket(bucket)
+    def _ping(self, n: int) -> bool:
         try:
-            # Download something to "prime" the connection.
-            # Might be better to upload something instead.
-            _ = self.bucket.blob(".null").download_as_string()
+            self.uploader.ping(n)
+            return True
         except Exception as exc:
-            logging.info(f"Ignored: {exc}")
+            logging.warning(f"Connection {n} unhealthy: {exc}")
+            return False
 
-    @log_timing
-    def transfer(self, temp_dir: Path, source: Path):
-        logging.info(f"gsapi: uploading to {self.prefix}/{source}")
-        # Set a large chunk size to ensure that the API doesn't try to break
-        # up the file into multiple transfers.
-        size = 100*1024*1024
-        if self.prefix == "":
-            blob = self.bucket.blob(f"{source}", chunk_size=size)
-        else:
-            blob = self.bucket.blob(f"{self.prefix}/{source}", chunk_size=size)
-        blob.upload_from_filename(temp_dir / source)
 
+class QueueStats:
+    """Queue-depth and backpressure statistics for an upload pipeline.
 
-class BotoUploader(Uploader):
-    """Uploader using the Boto object store API.
+    Each exposure handed to the upload stage records how many exposures were
+    already waiting ahead of it and how long the producer was blocked
+    because the queue was full.
+    """
 
-    Should work for AWS S3 or Google Cloud Storage or MinIO."""
+    def __init__(self):
+        self.count = 0
+        self.depth_total = 0
+        self.max_depth = 0
+        self.blocked_count = 0
+        self.blocked_time = 0.0
 
-    def __init__(self, dest: str):
-        import boto3
-        host, self.bucket, self.prefix = dest.split("/", 2)
-        logging.info(f"boto: opening host {host}, saving bucket {self.bucket}"
-                     f", prefix '{self.prefix}'")
-        self.client = boto3.client('s3')
-        self.client.put_object(Bucket=self.bucket, Key=".null",
-                               Body=b"", ContentLength=0)
+    def record(self, num: int, depth: int, blocked: float):
+        """Record the hand-off of one exposure.
 
-    @log_timing
-    def transfer(self, temp_dir: Path, source: Path):
-        logging.info(f"boto: uploading to {self.prefix}/{source}")
-        self.client.upload_file(temp_dir / source,
-                              self.bucket, f"{self.prefix}/{source}")
+        Parameters
+        ----------
+        num: `int`
+            Exposure number.
+        depth: `int`
+            Number of exposures queued ahead of this one.
+        blocked: `float`
+            Seconds the producer waited for space in the queue.
+        """
+        logging.info(f"Queued exposure {num}: depth = {depth}"
+                     f", blocked = {blocked}")
+        worker_status.send("queued", depth=depth)
+        self.count += 1
+        self.depth_total += depth
+        self.max_depth = max(self.max_depth, depth)
+        if blocked > 0.001:
+            self.blocked_count += 1
+            self.blocked_time += blocked
+
+    def log_summary(self):
+        """Log the statistics for the whole run."""
+        mean = self.depth_total / self.count if self.count else 0.0
+        logging.info(f"Pipeline: {self.count} exposures"
+                     f", mean depth = {mean}, max depth = {self.max_depth}"
+                     f", blocked {self.blocked_count} times"
+                     f" for {self.blocked_time} seconds")
+
+
+class Pipeline:
+    """Upload stage running on worker threads behind a bounded queue.
+
+    The caller prepares exposures and hands them over with `put`, so the
+    next exposure can be staged while earlier ones are still uploading.  A
+    full queue blocks the caller, which is recorded as backpressure.
 
+    Parameters
+    ----------
+    uploader: `Uploader`
+        Uploader used by all workers.
+    depth: `int`
+        Maximum number of prepared exposures waiting for upload.
+    workers: `int`
+        Number of concurrent uploads.
+    """
 
-class MinioUploader(Uploader):
-    """Uploader using the MinIO object store API."""
+    def __init__(self, uploader: Uploader, depth: int, workers: int):
+        self.uploader = uploader
+        self.queue = queue.Queue(maxsize=depth)
+        self.stats = QueueStats()
+        ctx = contextvars.copy_context()
+        self.threads = [
+            threading.Thread(target=ctx.copy().run, args=(self._upload,))
+            for _ in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
 
-    def __init__(self, dest: str):
-        from minio import Minio
-        host, self.bucket, self.prefix = dest.split("/", 2)
-        logging.info(f"minio: opening host {host}, saving bucket {self.bucket}"
-                     f", prefix '{self.prefix}'")
-        self.conn = Minio(host)
-        self.conn.put_object(self.bucket, ".null", BytesIO(b""), 0)
+    def put(self, num: int, payload: Payload):
+        """Queue an exposure for upload, waiting if the queue is full.
 
-    @log_timing
-    def transfer(self, temp_dir: Path, source: Path):
-        logging.info(f"minio: uploading to {self.prefix}/{source}")
-        self.conn.fput_object(
-            self.bucket,
-            f"{self.prefix}/{source}",
-            temp_dir / source
-        )
+        Parameters
+        ----------
+        num: `int`
+            Exposure number.
+        payload: `Payload`
+            Image to transfer.
+        """
+        depth = self.queue.qsize()
+        start = time.time()
+        self.queue.put((contextvars.copy_context(), payload))
+        self.stats.record(num, depth, time.time() - start)
+
+    def close(self):
+        """Wait for queued uploads to finish and log the statistics."""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.stats.log_summary()
+
+    def _upload(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            # Run in the producer's context so the transfer is attributed
+            # to the right exposure.
+            ctx, payload = item
+            try:
+                ctx.run(self.uploader.transfer, payload)
+            except Exception:
+                logging.exception(f"Failed to transfer {payload.name}")
+
+
+class AsyncPipeline:
+    """Upload stage running as tasks behind a bounded `asyncio.Queue`.
+
+    Equivalent of `Pipeline` for the asyncio engine.
 
+    Parameters
+    ----------
+    uploader: `Uploader`
+        Uploader used by all workers.
+    depth: `int`
+        Maximum number of prepared exposures waiting for upload.
+    workers: `int`
+        Number of concurrent uploads.
+    semaphore: `asyncio.Semaphore`
+        Node-wide bound on simultaneous transfers.
+    """
 
-class HttpUploader(Uploader):
-    """Uploader using HTTP PUT to an ordinary web server."""
+    def __init__(self, uploader: Uploader, depth: int, workers: int,
+                 semaphore: asyncio.Semaphore):
+        self.uploader = uploader
+        self.queue = asyncio.Queue(maxsize=depth)
+        self.stats = QueueStats()
+        self.semaphore = semaphore
+        self.tasks = [asyncio.create_task(self._upload())
+                      for _ in range(workers)]
 
-    def __init__(self, dest: str):
-        import requests
-        logging.info(f"http: opening session to {dest}")
-        self.url = dest
-        self.session = requests.Session()
+    async def put(self, num: int, payload: Payload):
+        """Queue an exposure for upload, waiting if the queue is full.
 
-    @log_timing
-    def transfer(self, temp_dir: Path, source: Path):
-        logging.info(f"http: putting to {self.url}/{source}")
-        with (temp_dir / source).open("rb") as s:
-            r = self.session.put(f"{self.url}/{source}", data=s)
-        r.raise_for_status()
+        Parameters
+        ----------
+        num: `int`
+            Exposure number.
+        payload: `Payload`
+            Image to transfer.
+        """
+        depth = self.queue.qsize()
+        start = time.time()
+        await self.queue.put((contextvars.copy_context(), payload))
+        self.stats.record(num, depth, time.time() - start)
+
+    async def close(self):
+        """Wait for queued uploads to finish and log the statistics."""
+        for _ in self.tasks:
+            await self.queue.put(None)
+        await asyncio.gather(*self.tasks)
+        self.stats.log_summary()
+
+    async def _upload(self):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            # Run in the producer's context so the transfer is attributed
+            # to the right exposure.
+            ctx, payload = item
+            try:
+                async with self.semaphore:
+                    await asyncio.create_task(
+                        self.uploader.transfer_async(payload), context=ctx
+                    )
+            except Exception:
+                logging.exception(f"Failed to transfer {payload.name}")
+
+
+def exposure_path(obs_date: datetime, seqnum: int, ccd_name: str) -> Path:
+    """Build the relative path for one CCD image of an exposure.
 
+    Parameters
+    ----------
+    obs_date: `datetime.datetime`
+        Observing day of the exposure.
+    seqnum: `int`
+        Sequence number of the exposure.
+    ccd_name: `str`
+        Name of the CCD.
 
-class BbcpUploader(Uploader):
-    """Uploader using bbcp to a remote filesystem."""
+    Returns
+    -------
+    path: `pathlib.Path`
+        Path of the image relative to the destination root.
+    """
+    obs_day = obs_date.strftime("%Y%m%d")
+    return Path(obs_date.strftime("%Y-%m-%d")).joinpath(
+        f"{obs_day}{seqnum:05d}",
+        f"MC_O_{obs_day}_{seqnum:05d}_{ccd_name}.fits"
+    )
 
-    def __init__(self, dest: str):
-        self.host, path = dest.split("/", 1)
-        logging.info(f"bbcp: saving host {self.host} and path {path}")
-        self.path = Path(path)
 
-    @log_timing
-    def transfer(self, temp_dir: Path, source: Path):
-        logging.info(f"bbcp: dir {self.path / source.parent}; file {source}")
-        # -A is supposed to create the remote directory, but it appears to be
-        # buggy.
-        subprocess.run(["bbcp", "-A", self.path / source,
-                        f"{self.host}:{self.path / source}"])
+def simulate(
+    args: argparse.Namespace,
+    ccd_name: str,
+    *,
+    coordinator: Optional[Path] = None,
+    supervisor: Optional[Path] = None,
+    first_exposure: int = 0,
+) -> None:
+    """Simulate a series of CCD image transfers.
 
+    Parameters
+    ----------
+    args: `argparse.Namespace`
+        Settings of the run, as parsed by the parser from `build_parser`.
+    ccd_name: `str`
+        Name of the CCD to simulate transferring.
+    coordinator: `pathlib.Path`, optional
+        Socket of the node's `BandwidthCoordinator`, if transfers are to be
+        admitted by it.
+    supervisor: `pathlib.Path`, optional
+        Socket of the node's `Supervisor`, if progress is to be reported to
+        it.
+    first_exposure: `int`, optional
+        Number of the first exposure to process.
+    """
+    # Make sure the CCD name is in the log messages to distinguish between
+    # processes.
+    setup_logging(ccd_name)
+    current_ccd.set(ccd_name)
+    if supervisor is not None:
+        worker_status.connect(supervisor)
 
-class ScpUploader(Uploader):
-    """Uploader using scp to a remote filesystem."""
+    # Check socket options.
+    print(f"Socket opts = {HTTPConnection.default_socket_options}")
 
-    def __init__(self, dest: str):
-        self.host, path = dest.split("/", 1)
-        logging.info(f"scp: saving host {self.host} and path {path}")
-        self.path = Path(path)
+    hour, minute = args.starttime.split(":")
+    # Pick a sequence number that will not overlap with other runs.
+    seqnum_start = int(hour + minute) * 10
 
-    @log_timing
-    def transfer(self, temp_dir: Path, source: Path):
-        logging.info(f"scp: dir {self.path / source.parent}; file {source}")
-        with (temp_dir / source).open("rb") as s:
-            # We may have to create the remote directory; try to do it all in
-            # one ssh connection for efficiency.
-            subprocess.run(["ssh", self.host,
-                            f"mkdir -p {self.path / source.parent};"
-                            f"cat > {self.path / source}"],
-                           stdin=s)
+    uploader = Uploader.create(args.destination, args.slices,
+                               args.slice_threshold,
+                               http_transport=args.http_transport)
+    checksum_stats.algorithm = (None if args.checksum == "none"
+                                else args.checksum)
+    uploader = TransferPolicy(uploader, args.retries, args.retry_backoff,
+                              args.hedge_percentile)
+
+    warmer = None
+    if args.warm_connections > 0:
+        warmer = ConnectionWarmer(uploader, args.warm_connections,
+                                  args.warm_lead)
+        warmer.warm()
+    waiter = Waiter(int(hour), int(minute), args.interval, warmer,
+                    args.late_policy)
+    if coordinator is not None:
+        uploader = CoordinatedUploader(uploader, coordinator, waiter)
+
+    images = None
+    buffer = None
+    if SyntheticImages.selected(args.inputfile):
+        images = SyntheticImages(str(args.inputfile), args.synthetic_ring)
+        images.prefill(ccd_name)
+    elif args.source != "staged":
+        buffer = load_source(args.inputfile, args.source)
+    if args.compress and args.compressor != "fpack":
+        image_compressor = Compressor(args.compressor, args.compress_threads)
+    else:
+        image_compressor = None
 
+    now = datetime.now()
 
-def simulate(
+    with tempfile.TemporaryDirectory(dir=args.tempdir) as temp_dir:
+        logging.info(f"Using temp directory {temp_dir}")
+        temp_path = Path(temp_dir)
+        if args.queue_depth > 0:
+            pipeline = Pipeline(uploader, args.queue_depth,
+                                args.upload_workers)
+        for i in waiter.exposures(args.numexp, seqnum_start, first_exposure):
+            seqnum = seqnum_start + i
+            source_path = args.inputfile
+
+            dest_path = exposure_path(now, seqnum, ccd_name)
+            if images is not None:
+                buffer = images.image(ccd_name, i)
+            payload = make_payload(source_path, temp_path, dest_path,
+                                   args.compress, buffer, image_compressor)
+            if args.queue_depth > 0:
+                pipeline.put(i, payload)
+            else:
+                # Give up on this exposure only, as the pipeline workers and
+                # the asyncio engine do, so that the next ones are attempted.
+                try:
+                    uploader.transfer(payload)
+                except Exception:
+                    logging.exception(f"Failed to transfer {payload.name}"
+                                      f" of exposure {i}")
+        if args.queue_depth > 0:
+            pipeline.close()
+
+    waiter.log_summary()
+    uploader.log_summary()
+    connection_stats.log_summary()
+    transfer_stats.log_summary()
+    checksum_stats.log_summary()
+    if args.metrics is not None:
+        metrics.dump(args.metrics)
+
+
+async def simulate_ccd_async(
     ccd_name: str,
-    starttime: str,
-    destination: str,
-    interval: int,
-    tempdir: Path,
+    uploader: Uploader,
+    waiter: Waiter,
+    semaphore: asyncio.Semaphore,
+    temp_path: Path,
     numexp: int,
     inputfile: Path,
     compress: bool,
+    buffer: Optional[memoryview],
+    compressor: Optional[Compressor],
+    seqnum_start: int,
+    now: datetime,
+    queue_depth: int = 0,
+    upload_workers: int = 1,
+    images: Optional[SyntheticImages] = None,
 ) -> None:
-    """Simulate a series of CCD image transfers.
+    """Simulate the transfers for one CCD within a shared event loop.
 
     Parameters
     ----------
     ccd_name: `str`
         Name of the CCD to simulate transferring.
-    starttime: `str`
-        Time in HH:MM to start transferring.
-    destination: `str`
-        Destination URI.
-    interval: `int`
-        Interval between transfers in seconds.
-    tempdir: `pathlib.Path`
+    uploader: `Uploader`
+        Uploader shared by all CCDs of the node.
+    waiter: `Waiter`
+        Exposure timer shared by all CCDs of the node.
+    semaphore: `asyncio.Semaphore`
+        Bound on the number of simultaneous transfers.
+    temp_path: `pathlib.Path`
         Temporary directory to use.
     numexp: `int`
         Number of exposures to simulate.
@@ -342,47 +3170,214 @@ def simulate(
         Path to input image file (same one used for all transfers).
     compress: `bool`
         Compress the input if True.
+    buffer: `memoryview` or `None`
+        Preloaded input image, or `None` to stage a copy per exposure.
+    compressor: `Compressor` or `None`
+        In-process compressor shared by all CCDs, or `None` to use fpack.
+    seqnum_start: `int`
+        Sequence number of the first exposure.
+    now: `datetime.datetime`
+        Observing day for the exposures.
+    queue_depth: `int`, optional
+        Number of exposures that may be prepared ahead of their upload; 0
+        prepares and uploads each exposure in turn.
+    upload_workers: `int`, optional
+        Number of concurrent uploads when pipelining.
+    images: `SyntheticImages`, optional
+        Synthetic input images, used instead of ``inputfile``.
     """
-    # Make sure the CCD name is in the log messages to distinguish between
-    # processes.
-    logging.basicConfig(
-        format=f"{ccd_name}" + " {asctime} {message}",
-        style="{",
-        level="INFO"
-    )
+    current_ccd.set(ccd_name)
+    if queue_depth > 0:
+        pipeline = AsyncPipeline(uploader, queue_depth, upload_workers,
+                                 semaphore)
+    async for i in waiter.exposures_async(numexp, seqnum_start):
+        dest_path = exposure_path(now, seqnum_start + i, ccd_name)
+        if images is not None:
+            buffer = await run_in_thread(None, images.image, ccd_name, i)
+        payload = await run_in_thread(None, make_payload, inputfile,
+                                      temp_path, dest_path, compress, buffer,
+                                      compressor)
+        if queue_depth > 0:
+            await pipeline.put(i, payload)
+        else:
+            # Give up on this exposure only, as the pipeline workers do, so
+            # that the other CCDs and exposures carry on.
+            try:
+                async with semaphore:
+                    await uploader.transfer_async(payload)
+            except Exception:
+                logging.exception(f"Failed to transfer {payload.name}")
+    if queue_depth > 0:
+        await pipeline.close()
+
+
+async def simulate_node_async(
+    node: str,
+    ccd_names: list[str],
+    uploader: Uploader,
+    waiter: Waiter,
+    semaphore: asyncio.Semaphore,
+    temp_path: Path,
+    numexp: int,
+    inputfile: Path,
+    compress: bool,
+    buffer: Optional[memoryview],
+    compressor: Optional[Compressor],
+    seqnum_start: int,
+    now: datetime,
+    queue_depth: int = 0,
+    upload_workers: int = 1,
+    images: Optional[SyntheticImages] = None,
+) -> None:
+    """Simulate the transfers of a node with one object per exposure.
+
+    The CCD images of each exposure are prepared concurrently and packed
+    with `make_bundle` into a single object, so the number of requests
+    does not grow with the number of CCDs.
+
+    Parameters
+    ----------
+    node: `str`
+        Name of the node, used to name the bundles.
+    ccd_names: `list` [`str`]
+        Names of the CCDs to simulate transferring.
+
+    The other parameters are as for `simulate_ccd_async`.
+    """
+    current_ccd.set(node)
+
+    async def prepare(ccd_name: str, num: int, dest_path: Path) -> Payload:
+        # Each gathered coroutine runs in its own task and context.
+        current_ccd.set(ccd_name)
+        image = buffer
+        if images is not None:
+            image = await run_in_thread(None, images.image, ccd_name, num)
+        return await run_in_thread(None, make_payload, inputfile, temp_path,
+                                   dest_path, compress, image, compressor)
+
+    if queue_depth > 0:
+        pipeline = AsyncPipeline(uploader, queue_depth, upload_workers,
+                                 semaphore)
+    async for i in waiter.exposures_async(numexp, seqnum_start):
+        seqnum = seqnum_start + i
+        payloads = await asyncio.gather(*(
+            prepare(ccd_name, i, exposure_path(now, seqnum, ccd_name))
+            for ccd_name in ccd_names
+        ))
+        dest_path = exposure_path(now, seqnum, node).with_suffix(".bundle")
+        payload = await run_in_thread(None, make_bundle,
+                                      dict(zip(ccd_names, payloads)),
+                                      dest_path)
+        if queue_depth > 0:
+            await pipeline.put(i, payload)
+        else:
+            # Give up on this exposure only, as the pipeline workers do, so
+            # that the other CCDs and exposures carry on.
+            try:
+                async with semaphore:
+                    await uploader.transfer_async(payload)
+            except Exception:
+                logging.exception(f"Failed to transfer {payload.name}")
+    if queue_depth > 0:
+        await pipeline.close()
+
+
+async def simulate_async(
+    args: argparse.Namespace,
+    ccd_names: list[str],
+    *,
+    node: str = "node",
+) -> None:
+    """Simulate a series of image transfers for all CCDs of a node.
+
+    A single process and a single `Uploader`, with its connection pool,
+    serve every CCD; each CCD runs as its own task and transfers are
+    bounded by ``args.concurrency``.
+
+    Parameters
+    ----------
+    args: `argparse.Namespace`
+        Settings of the run, as parsed by the parser from `build_parser`.
+    ccd_names: `list` [`str`]
+        Names of the CCDs to simulate transferring.
+    node: `str`, optional
+        Name of the node, used to name aggregated objects.
+    """
+    setup_logging("node")
 
     # Check socket options.
     print(f"Socket opts = {HTTPConnection.default_socket_options}")
 
-    hour, minute = starttime.split(":")
+    hour, minute = args.starttime.split(":")
     # Pick a sequence number that will not overlap with other runs.
     seqnum_start = int(hour + minute) * 10
 
-    uploader = Uploader.create(destination)
+    # Size the default executor so that blocking transfers are not
+    # throttled below the requested concurrency.
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(
+        ThreadPoolExecutor(max_workers=args.concurrency)
+    )
 
-    waiter = Waiter(int(hour), int(minute), interval)
+    uploader = Uploader.create(args.destination, args.slices,
+                               args.slice_threshold, args.concurrency,
+                               args.http_transport)
+    checksum_stats.algorithm = (None if args.checksum == "none"
+                                else args.checksum)
+    uploader = TransferPolicy(uploader, args.retries, args.retry_backoff,
+                              args.hedge_percentile)
+
+    warmer = None
+    if args.warm_connections > 0:
+        warmer = ConnectionWarmer(uploader, args.warm_connections,
+                                  args.warm_lead)
+        await run_in_thread(None, warmer.warm)
+    waiter = Waiter(int(hour), int(minute), args.interval, warmer,
+                    args.late_policy)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    images = None
+    buffer = None
+    if SyntheticImages.selected(args.inputfile):
+        images = SyntheticImages(str(args.inputfile), args.synthetic_ring)
+        await asyncio.gather(*(run_in_thread(None, images.prefill, ccd_name)
+                               for ccd_name in ccd_names))
+    elif args.source != "staged":
+        buffer = load_source(args.inputfile, args.source)
+    if args.compress and args.compressor != "fpack":
+        image_compressor = Compressor(args.compressor, args.compress_threads)
+    else:
+        image_compressor = None
 
     now = datetime.now()
-    obs_day = now.strftime("%Y%m%d")
-    obs_day_str = now.strftime("%Y-%m-%d")
 
-    with tempfile.TemporaryDirectory(dir=tempdir) as temp_dir:
+    with tempfile.TemporaryDirectory(dir=args.tempdir) as temp_dir:
         logging.info(f"Using temp directory {temp_dir}")
-        temp_path = Path(temp_dir)
-        for i in range(numexp):
-            waiter.wait_exposure(i)
-            seqnum = seqnum_start + i
-            source_path = inputfile
-
-            dest_path = Path(obs_day_str).joinpath(
-                f"{obs_day}{seqnum:05d}",
-                f"MC_O_{obs_day}_{seqnum:05d}_{ccd_name}.fits"
+        if args.aggregate:
+            await simulate_node_async(
+                node, ccd_names, uploader, waiter, semaphore, Path(temp_dir),
+                args.numexp, args.inputfile, args.compress, buffer,
+                image_compressor, seqnum_start, now, args.queue_depth,
+                args.upload_workers, images
             )
-            logging.info(f"Copying from {source_path} to"
-                         f" {temp_path / dest_path}"
-                         f" with compress = {compress}")
-            dest_path = copy(source_path, temp_path, dest_path, compress)
-            uploader.transfer(temp_path, dest_path)
+        else:
+            await asyncio.gather(*(
+                simulate_ccd_async(ccd_name, uploader, waiter, semaphore,
+                                   Path(temp_dir), args.numexp,
+                                   args.inputfile, args.compress, buffer,
+                                   image_compressor, seqnum_start, now,
+                                   args.queue_depth, args.upload_workers,
+                                   images)
+                for ccd_name in ccd_names
+            ))
+
+    waiter.log_summary()
+    uploader.log_summary()
+    connection_stats.log_summary()
+    transfer_stats.log_summary()
+    checksum_stats.log_summary()
+    if args.metrics is not None:
+        metrics.dump(args.metrics)
 
 
 def main():
@@ -398,6 +3393,38 @@ def main():
     # Build and use the argument parser.
     parser = build_parser()
     args = parser.parse_args()
+    # Synthetic images only exist in memory.
+    synthetic = SyntheticImages.selected(args.inputfile)
+    if args.source is None:
+        args.source = "memory" if synthetic else "staged"
+    elif synthetic and args.source != "memory":
+        parser.error("synthetic --inputfile requires --source memory")
+    if (args.compress and args.source != "staged"
+            and args.compressor == "fpack"):
+        parser.error("--compressor fpack requires --source staged")
+    if args.destination.startswith("bbcp://"):
+        # bbcp reads the image from a file, so payloads must not be
+        # buffers.
+        if args.source != "staged":
+            parser.error("bbcp:// destinations require --source staged")
+        if args.compress and args.compressor != "fpack":
+            parser.error("bbcp:// destinations require --compressor fpack")
+        if args.aggregate:
+            parser.error("bbcp:// destinations do not support --aggregate")
+    if args.destination.startswith("boto://") and args.checksum == "md5":
+        # Multipart uploads have no MD5 of the whole object to check.
+        parser.error("--checksum md5 cannot be verified for boto://"
+                     " destinations; use --checksum crc32c")
+    if args.aggregate and args.engine != "asyncio":
+        parser.error("--aggregate requires --engine asyncio")
+    coordinated = args.node_slots > 0 or args.node_bandwidth > 0
+    if coordinated and args.engine != "fork":
+        parser.error("--node-slots and --node-bandwidth require"
+                     " --engine fork; use --concurrency")
+    if (args.supervise or args.pin != "none") and args.engine != "fork":
+        parser.error("--supervise and --pin require --engine fork")
+    if args.stats_port and not args.supervise:
+        parser.error("--stats-port requires --supervise")
 
     # Figure out a node number that we can use to create a unique CCD name.
     host_name = socket.gethostname()
@@ -434,28 +3461,80 @@ def main():
             (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 1)
         ]
 
-    # Fork a process for each CCD to be transferred.
-    jobs = []
-    for ccd in range(args.ccds):
-        pid = os.fork()
-        if pid == 0:
-            simulate(
-                f"{node_num}-{ccd}",
-                args.starttime,
-                args.destination,
-                args.interval,
-                args.tempdir,
-                args.numexp,
-                args.inputfile,
-                args.compress
+    if args.engine == "asyncio":
+        # Drive all CCDs from this process.
+        asyncio.run(simulate_async(
+            args, [f"{node_num}-{ccd}" for ccd in range(args.ccds)],
+            node=str(node_num)
+        ))
+        logging.info("Engine exiting")
+    else:
+        # Fork a process for each CCD to be transferred, sharing the uplink
+        # through a coordinator if asked.
+        if coordinated or args.supervise:
+            setup_logging("node")
+        if coordinated:
+            coordinator = BandwidthCoordinator(
+                args.tempdir / f"apxfr-coordinator-{os.getpid()}.sock",
+                args.node_slots, args.node_bandwidth, args.node_schedule
+            )
+
+        def run_ccd(ccd_name: str, first: int = 0,
+                    supervisor: Optional[Path] = None):
+            simulate(args, ccd_name,
+                     coordinator=coordinator.path if coordinated else None,
+                     supervisor=supervisor, first_exposure=first)
+
+        ccd_names = [f"{node_num}-{ccd}" for ccd in range(args.ccds)]
+        if args.supervise:
+            # The supervisor forks its spawner, so it comes before any
+            # thread is started.
+            supervisor = Supervisor(
+                args.tempdir / f"apxfr-supervisor-{os.getpid()}.sock",
+                ccd_names, args.numexp, run_ccd, args.pin,
+                args.max_restarts, args.stats_port
             )
-            logging.info("Child process exiting")
-            exit(0)
+            for ccd_name in ccd_names:
+                supervisor.spawn(ccd_name)
+            if coordinated:
+                coordinator.start()
+            supervisor.start()
+            signal.signal(signal.SIGTERM, supervisor.stop)
+            signal.signal(signal.SIGINT, supervisor.stop)
+            ok = supervisor.wait()
+            supervisor.close()
         else:
-            jobs.append(pid)
-    # Wait for all child processes.
-    for job in jobs:
-        os.waitpid(job, 0)
+            jobs = []
+            for ccd_name, cpus in zip(ccd_names,
+                                      affinity_plan(args.pin, args.ccds)):
+                pid = os.fork()
+                if pid == 0:
+                    if cpus is not None:
+                        os.sched_setaffinity(0, cpus)
+                    run_ccd(ccd_name)
+                    logging.info("Child process exiting")
+                    exit(0)
+                else:
+                    jobs.append(pid)
+            if coordinated:
+                coordinator.start()
+            # Wait for all child processes.
+            for job in jobs:
+                os.waitpid(job, 0)
+        if coordinated:
+            coordinator.close()
+
+    # Combine the timing samples of all processes.
+    if args.metrics is not None:
+        summary = Metrics.aggregate(args.metrics, args.destination)
+        for stage, stats in summary.items():
+            print(f"Metrics {stage}: " + ", ".join(
+                f"{key} = {value}" for key, value in stats.items()
+            ))
+
+    if args.supervise:
+        print("Supervisor exiting")
+        exit(0 if ok else 1)
 
     # Sleep so that container logs can be obtained more easily.
     print("Main process sleeping")
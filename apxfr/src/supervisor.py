@@ -0,0 +1,485 @@
+"""Supervision of the CCD worker processes of a node.
+
+The harness's fork engine can run its workers under a `Supervisor`, which
+pins them to CPUs, collects their progress, serves it as JSON, and
+replaces workers that fail.
+"""
+
+from __future__ import annotations
+from collections import deque
+import contextlib
+import http.server
+import itertools
+import json
+import logging
+from multiprocessing import Pipe
+from multiprocessing.connection import Connection
+import os
+from pathlib import Path
+import signal
+import socket
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class CcdProgress:
+    """Progress of one CCD across the worker processes that served it.
+
+    Parameters
+    ----------
+    name: `str`
+        Name of the CCD.
+    cpus: `set` [`int`] or `None`
+        CPUs the worker is pinned to, if any.
+    """
+
+    # Seconds of recent transfers over which throughput is reported.
+    WINDOW = 30.0
+
+    def __init__(self, name: str, cpus: Optional[set] = None):
+        self.name = name
+        self.cpus = cpus
+        self.state = "starting"
+        self.pid = 0
+        self.restarts = 0
+        self.started = 0
+        self.done: set = set()
+        self.transfers = 0
+        self.bytes = 0
+        self.transfer_seconds = 0.0
+        self.recent: deque = deque()
+        self.lateness = None
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+        self.depth = 0
+        self.max_depth = 0
+
+    def update(self, event: dict):
+        """Apply an event reported by `harness.WorkerStatus`."""
+        kind = event["event"]
+        if kind == "started":
+            self.started += 1
+            self.lateness = event["lateness"]
+            self.total_lateness += self.lateness
+            self.max_lateness = max(self.max_lateness, self.lateness)
+        elif kind == "skipped":
+            self.done.add(event["exposure"])
+        elif kind == "queued":
+            self.depth = event["depth"]
+            self.max_depth = max(self.max_depth, self.depth)
+        elif kind == "transfer":
+            self.transfers += 1
+            self.bytes += event["bytes"]
+            self.transfer_seconds += event["seconds"]
+            self.recent.append((time.monotonic(), event["bytes"]))
+            if event["exposure"] is not None:
+                self.done.add(event["exposure"])
+
+    def resume(self, numexp: int) -> int:
+        """Return the first exposure a replacement worker should process.
+
+        Exposures after it that were already done are repeated, which
+        overwrites them with the same images.
+        """
+        return next((num for num in range(numexp) if num not in self.done),
+                    numexp)
+
+    def throughput(self) -> float:
+        """Return the bytes per second transferred over `WINDOW`."""
+        cutoff = time.monotonic() - self.WINDOW
+        while self.recent and self.recent[0][0] < cutoff:
+            self.recent.popleft()
+        return sum(nbytes for _, nbytes in self.recent) / self.WINDOW
+
+    def to_dict(self) -> dict:
+        """Return the progress as a JSON-serializable dict."""
+        return {
+            "state": self.state,
+            "pid": self.pid,
+            "cpus": sorted(self.cpus) if self.cpus is not None else None,
+            "restarts": self.restarts,
+            "exposures_started": self.started,
+            "exposures_done": len(self.done),
+            "transfers": self.transfers,
+            "bytes": self.bytes,
+            "throughput_mbps": self.throughput() / 1e6,
+            "transfer_mbps": (self.bytes / self.transfer_seconds / 1e6
+                              if self.transfer_seconds else 0.0),
+            "lateness": self.lateness,
+            "max_lateness": self.max_lateness,
+            "mean_lateness": (self.total_lateness / self.started
+                              if self.started else 0.0),
+            "queue_depth": self.depth,
+            "max_queue_depth": self.max_depth,
+        }
+
+
+def _parse_cpulist(text: str) -> set:
+    """Parse a Linux CPU list such as ``0-3,8-11``."""
+    cpus = set()
+    for part in text.strip().split(","):
+        if part:
+            first, _, last = part.partition("-")
+            cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def numa_nodes() -> List[set]:
+    """Return the CPUs of each NUMA node that this process may run on.
+
+    Machines without NUMA information are treated as a single node.
+    """
+    allowed = os.sched_getaffinity(0)
+    nodes = []
+    for path in sorted(Path("/sys/devices/system/node").glob("node[0-9]*"),
+                       key=lambda p: int(p.name[4:])):
+        try:
+            cpus = _parse_cpulist((path / "cpulist").read_text()) & allowed
+        except (OSError, ValueError):
+            continue
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [allowed]
+
+
+def affinity_plan(mode: str, count: int) -> List[Optional[set]]:
+    """Choose the CPUs to pin each of ``count`` CCD workers to.
+
+    Parameters
+    ----------
+    mode: `str`
+        "none" to leave workers unpinned, "numa" to pin them round-robin
+        to the CPUs of one NUMA node each, or "cpu" to pin each to one CPU,
+        alternating between nodes so that their memory bandwidth is spread.
+        Memory is allocated on first touch, so it follows the CPUs.
+    count: `int`
+        Number of workers.
+
+    Returns
+    -------
+    plan: `list`
+        Set of CPUs for each worker, or `None` where it is not pinned.
+    """
+    if mode == "none":
+        return [None] * count
+    nodes = numa_nodes()
+    if mode == "numa":
+        return [nodes[i % len(nodes)] for i in range(count)]
+    columns = itertools.zip_longest(*(sorted(cpus) for cpus in nodes))
+    order = [cpu for column in columns for cpu in column if cpu is not None]
+    return [{order[i % len(order)]} for i in range(count)]
+
+
+class Supervisor:
+    """Run, watch, and restart the CCD worker processes of a node.
+
+    Each worker is forked, optionally pinned to CPUs, and reports its
+    progress through `harness.WorkerStatus` to a Unix socket served here.
+    A worker that dies or exits with an error is replaced, up to
+    ``max_restarts`` times per CCD, by one resuming at its first exposure
+    not yet done.
+    Live progress is served as JSON over HTTP on localhost if
+    ``stats_port`` is given.
+
+    Workers, replacements included, are forked by a spawner process that
+    is itself forked on construction, so construct the supervisor before
+    starting any threads.  A process forked while another thread holds a
+    lock, such as that of a logging handler or of the statistics, would
+    find the lock held forever; the spawner has no other threads, while
+    the supervisor serves reports and statistics on threads of its own.
+
+    Parameters
+    ----------
+    path: `pathlib.Path`
+        Path of the socket to create.
+    ccd_names: `list` [`str`]
+        Names of the CCDs, one worker each.
+    numexp: `int`
+        Number of exposures in the run.
+    run_worker: callable
+        Called in each forked worker with the CCD name, first exposure, and
+        socket path to process the CCD's exposures.
+    pin: `str`, optional
+        CPU pinning mode; see `affinity_plan`.
+    max_restarts: `int`, optional
+        Number of times to replace each CCD's worker.
+    stats_port: `int`, optional
+        Port on localhost to serve statistics on; 0 disables.
+    """
+
+    # Seconds to wait for the reports of a worker that exited.
+    DRAIN_TIMEOUT = 5.0
+    # Seconds between checks of the spawner for exited workers.
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, path: Path, ccd_names: List[str], numexp: int,
+                 run_worker, pin: str = "none", max_restarts: int = 3,
+                 stats_port: int = 0):
+        self.path = path
+        self.numexp = numexp
+        self.run_worker = run_worker
+        self.max_restarts = max_restarts
+        self.stats_port = stats_port
+        self.lock = threading.Lock()
+        self.ccds = {
+            name: CcdProgress(name, cpus)
+            for name, cpus in zip(ccd_names,
+                                  affinity_plan(pin, len(ccd_names)))
+        }
+        self.pids: Dict[int, str] = {}
+        self.handlers: Dict[int, threading.Thread] = {}
+        self.stopping = False
+        self.start_time = time.monotonic()
+        self.httpd = None
+        # Listen before the workers are forked, as
+        # `coordinator.BandwidthCoordinator` does.
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(str(path))
+        self.sock.listen(128)
+        # Workers requested but not yet reported started by the spawner.
+        self.pending = 0
+        self.spawner, conn = Pipe()
+        self.spawner_pid = os.fork()
+        if self.spawner_pid == 0:
+            self.spawner.close()
+            code = 0
+            try:
+                self._run_spawner(conn)
+            except BaseException:
+                logging.exception("Worker spawner failed")
+                code = 1
+            # Leave without unwinding into the supervisor's frames.
+            os._exit(code)
+        conn.close()
+
+    def _run_spawner(self, conn: Connection):
+        """Fork workers on request and report their starts and exits.
+
+        Runs in the spawner process until the supervisor closes ``conn``,
+        then waits for the workers left.
+        """
+        self.sock.close()
+        # Interrupts are for the supervisor and the workers.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        children = 0
+        while True:
+            if conn.poll(self.POLL_INTERVAL):
+                try:
+                    name, first = conn.recv()
+                except EOFError:
+                    break
+                pid = self._fork_worker(name, first, conn)
+                children += 1
+                conn.send(("started", name, first, pid))
+            while children:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+                if pid == 0:
+                    break
+                children -= 1
+                conn.send(("exited", pid, status))
+        for _ in range(children):
+            os.wait()
+
+    def _fork_worker(self, name: str, first: int, conn: Connection) -> int:
+        """Fork a worker for a CCD, starting at exposure ``first``."""
+        progress = self.ccds[name]
+        pid = os.fork()
+        if pid == 0:
+            conn.close()
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            code = 0
+            try:
+                if progress.cpus is not None:
+                    os.sched_setaffinity(0, progress.cpus)
+                self.run_worker(name, first, self.path)
+                logging.info("Child process exiting")
+            except BaseException:
+                logging.exception("Worker failed")
+                code = 1
+            os._exit(code)
+        return pid
+
+    def spawn(self, name: str, first: int = 0):
+        """Start a worker for a CCD, starting at exposure ``first``.
+
+        The worker is forked by the spawner and taken into account by
+        `wait` once the spawner reports it started.
+        """
+        self.spawner.send((name, first))
+        self.pending += 1
+
+    def _started(self, name: str, first: int, pid: int):
+        progress = self.ccds[name]
+        cpus = (f" on CPUs {sorted(progress.cpus)}"
+                if progress.cpus is not None else "")
+        logging.info(f"Started worker {pid} for {name} at exposure"
+                     f" {first}{cpus}")
+        with self.lock:
+            progress.pid = pid
+            progress.state = "running"
+            self.pids[pid] = name
+        if self.stopping:
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGTERM)
+
+    def start(self):
+        """Start collecting reports and serving statistics."""
+        threading.Thread(target=self._serve, name="supervisor",
+                         daemon=True).start()
+        if self.stats_port > 0:
+            self.httpd = http.server.ThreadingHTTPServer(
+                ("127.0.0.1", self.stats_port), self._handler()
+            )
+            threading.Thread(target=self.httpd.serve_forever,
+                             name="stats", daemon=True).start()
+            logging.info("Serving statistics on"
+                         f" http://127.0.0.1:{self.stats_port}/")
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                # Closed.
+                return
+            threading.Thread(target=self._handle, args=(conn,),
+                             daemon=True).start()
+
+    def _handle(self, conn: socket.socket):
+        with conn:
+            for line in conn.makefile("rb"):
+                try:
+                    event = json.loads(line)
+                    if event["event"] == "hello":
+                        self.handlers[event["pid"]] = (
+                            threading.current_thread()
+                        )
+                    with self.lock:
+                        self.ccds[event["ccd"]].update(event)
+                except (ValueError, KeyError) as exc:
+                    logging.warning(f"Bad worker report {line!r}: {exc}")
+
+    def _handler(self):
+        supervisor = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(supervisor.snapshot(), indent=2).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def snapshot(self) -> dict:
+        """Return the progress of the node and of each CCD."""
+        with self.lock:
+            ccds = {name: progress.to_dict()
+                    for name, progress in self.ccds.items()}
+        totals = {
+            key: sum(ccd[key] for ccd in ccds.values())
+            for key in ("restarts", "exposures_done", "transfers", "bytes",
+                        "throughput_mbps")
+        }
+        totals["max_lateness"] = max(
+            (ccd["max_lateness"] for ccd in ccds.values()), default=0.0
+        )
+        totals["queue_depth"] = sum(ccd["queue_depth"]
+                                    for ccd in ccds.values())
+        return {"elapsed": time.monotonic() - self.start_time,
+                "exposures": self.numexp, "node": totals, "ccds": ccds}
+
+    def stop(self, *args):
+        """Stop restarting workers and terminate those running.
+
+        Usable as a signal handler.
+        """
+        self.stopping = True
+        for pid in list(self.pids):
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGTERM)
+
+    def wait(self) -> bool:
+        """Wait for every CCD to finish, replacing failed workers.
+
+        Returns
+        -------
+        ok: `bool`
+            Whether every CCD's worker finished successfully.
+        """
+        while self.pids or self.pending:
+            try:
+                message = self.spawner.recv()
+            except EOFError:
+                logging.error("Worker spawner went away")
+                return False
+            if message[0] == "started":
+                self.pending -= 1
+                self._started(*message[1:])
+                continue
+            _, pid, status = message
+            name = self.pids.pop(pid, None)
+            if name is None:
+                continue
+            # Take in the worker's last reports before judging its progress.
+            handler = self.handlers.pop(pid, None)
+            if handler is not None:
+                handler.join(self.DRAIN_TIMEOUT)
+            code = os.waitstatus_to_exitcode(status)
+            progress = self.ccds[name]
+            if code == 0:
+                progress.state = "done"
+                continue
+            with self.lock:
+                first = progress.resume(self.numexp)
+            reason = (f"killed by signal {-code}" if code < 0
+                      else f"exit status {code}")
+            if self.stopping:
+                logging.info(f"Worker {pid} for {name} stopped ({reason})")
+                progress.state = "stopped"
+            elif progress.restarts >= self.max_restarts:
+                logging.error(f"Worker {pid} for {name} failed ({reason});"
+                              " giving up")
+                progress.state = "failed"
+            elif first >= self.numexp:
+                logging.warning(f"Worker {pid} for {name} failed ({reason})"
+                                " after all exposures were done")
+                progress.state = "done"
+            else:
+                logging.warning(f"Worker {pid} for {name} failed ({reason});"
+                                f" restarting at exposure {first}")
+                progress.restarts += 1
+                self.spawn(name, first)
+        return all(progress.state == "done"
+                   for progress in self.ccds.values())
+
+    def close(self):
+        """Stop serving and log a summary of each CCD and the node."""
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        self.spawner.close()
+        os.waitpid(self.spawner_pid, 0)
+        self.sock.close()
+        self.path.unlink(missing_ok=True)
+        snapshot = self.snapshot()
+        for name, ccd in snapshot["ccds"].items():
+            logging.info(f"Supervisor {name}: {ccd['state']}"
+                         f", {ccd['exposures_done']}/{self.numexp} exposures"
+                         f", {ccd['restarts']} restarts"
+                         f", {ccd['bytes']} bytes"
+                         f" at {ccd['transfer_mbps']} MB/s per transfer"
+                         f", max lateness = {ccd['max_lateness']}"
+                         f", max queue depth = {ccd['max_queue_depth']}")
+        node = snapshot["node"]
+        logging.info(f"Supervisor: {node['exposures_done']} CCD exposures"
+                     f" done of {self.numexp * len(self.ccds)}"
+                     f", {node['restarts']} restarts, {node['bytes']} bytes"
+                     f" in {snapshot['elapsed']} seconds"
+                     f", max lateness = {node['max_lateness']}")
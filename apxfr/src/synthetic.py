@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+"""Synthetic CCD images with realistic size and compressibility.
+
+Images are laid out like raw LSSTCam CCDs: an empty primary HDU followed by
+one 32-bit integer image extension per amplifier, each ending in a serial
+overscan region.  Pixels hold a per-amplifier bias level plus read noise
+and, outside the overscan, sky background and a field of stars with
+Gaussian profiles, all with photon noise.  Compression ratios are thus
+close to those of real data rather than of one file sent repeatedly.
+
+Each image is generated with vectorized NumPy from a seed derived from the
+CCD name and exposure number, so runs are reproducible and no two CCDs or
+exposures carry the same bytes.
+
+Run as a program, this writes an image to a file.
+"""
+
+from __future__ import annotations
+import argparse
+from dataclasses import dataclass, fields
+from pathlib import Path
+import time
+from typing import List, Tuple
+import zlib
+
+import numpy as np
+
+__all__ = ["PREFIX", "Spec", "parse_spec", "generate"]
+
+# Prefix of an --inputfile value selecting synthetic images.
+PREFIX = "synthetic:"
+
+BLOCK = 2880
+CARD = 80
+
+# Electrons at which pixels saturate.
+FULL_WELL = 150000.0
+
+
+@dataclass
+class Spec:
+    """Parameters of synthetic images.
+
+    The defaults approximate a raw LSSTCam science CCD, about 75 MB.
+    """
+
+    # Number of amplifier extensions.
+    amps: int = 16
+    # Columns per amplifier, including overscan.
+    width: int = 576
+    # Rows per amplifier.
+    height: int = 2048
+    # Serial overscan columns per amplifier.
+    overscan: int = 64
+    # Mean bias level in counts.
+    bias: float = 20000.0
+    # Read noise in electrons.
+    noise: float = 6.0
+    # Sky background in electrons per pixel.
+    sky: float = 1000.0
+    # Number of stars per CCD.
+    stars: int = 2000
+    # Gaussian PSF width (sigma) in pixels.
+    seeing: float = 2.0
+    # Base seed, combined with the CCD name and exposure number.
+    seed: int = 0
+
+
+def parse_spec(text: str) -> Spec:
+    """Parse image parameters.
+
+    Parameters
+    ----------
+    text: `str`
+        Comma-separated ``key=value`` pairs naming fields of `Spec`,
+        optionally preceded by `PREFIX`, for example
+        ``synthetic:amps=2,height=512``.
+
+    Returns
+    -------
+    spec: `Spec`
+        Parameters, with defaults for those not given.
+    """
+    text = text.removeprefix(PREFIX)
+    defaults = {f.name: f.default for f in fields(Spec)}
+    values = {}
+    for item in filter(None, text.split(",")):
+        key, _, value = item.partition("=")
+        if key not in defaults:
+            raise ValueError(f"Unknown synthetic image parameter {key}")
+        values[key] = type(defaults[key])(value)
+    spec = Spec(**values)
+    if not 0 <= spec.overscan < spec.width:
+        raise ValueError("Overscan must be narrower than the amplifier")
+    return spec
+
+
+def _header(cards: List[Tuple[str, object]]) -> bytes:
+    text = ""
+    for key, value in cards:
+        if isinstance(value, bool):
+            value = "T" if value else "F"
+        elif isinstance(value, str):
+            value = f"'{value:<8}'".ljust(20)
+        text += f"{key:<8}= {value:>20}".ljust(CARD)
+    text += "END".ljust(CARD)
+    return text.ljust(-(-len(text) // BLOCK) * BLOCK).encode("ascii")
+
+
+def _add_stars(image: np.ndarray, spec: Spec, rng: np.random.Generator):
+    """Add Gaussian stars with a power-law flux distribution in place."""
+    if spec.stars <= 0:
+        return
+    radius = max(1, int(np.ceil(4 * spec.seeing)))
+    offsets = np.arange(-radius, radius + 1)
+    ny, nx = image.shape
+    y = rng.uniform(0, ny, spec.stars)
+    x = rng.uniform(0, nx, spec.stars)
+    flux = 5000.0 * (rng.pareto(1.5, spec.stars) + 1)
+    # Pixel indices and distances of every stamp pixel of every star.
+    iy = np.floor(y).astype(np.intp)[:, None, None] + offsets[None, :, None]
+    ix = np.floor(x).astype(np.intp)[:, None, None] + offsets[None, None, :]
+    r2 = ((iy + 0.5 - y[:, None, None]) ** 2
+          + (ix + 0.5 - x[:, None, None]) ** 2)
+    weight = (flux / (2 * np.pi * spec.seeing ** 2))[:, None, None] * np.exp(
+        -r2 / (2 * spec.seeing ** 2)
+    )
+    iy, ix = np.broadcast_arrays(iy, ix)
+    inside = (iy >= 0) & (iy < ny) & (ix >= 0) & (ix < nx)
+    np.add.at(image, (iy[inside], ix[inside]),
+              weight[inside].astype(image.dtype))
+
+
+def generate(spec: Spec, ccd: str = "0", num: int = 0) -> bytearray:
+    """Generate a synthetic raw CCD image.
+
+    Parameters
+    ----------
+    spec: `Spec`
+        Image parameters.
+    ccd: `str`, optional
+        Name of the CCD, used to seed the image.
+    num: `int`, optional
+        Exposure number, used to seed the image.
+
+    Returns
+    -------
+    image: `bytearray`
+        The image as a multi-extension FITS file.
+    """
+    rng = np.random.default_rng(
+        [spec.seed, zlib.crc32(ccd.encode()), num]
+    )
+    data_width = spec.width - spec.overscan
+    ny = spec.height
+
+    # Electrons falling on the whole CCD, then photon and read noise.
+    signal = np.full((ny, spec.amps * data_width), spec.sky,
+                     dtype=np.float32)
+    _add_stars(signal, spec, rng)
+    np.minimum(signal, FULL_WELL, out=signal)
+    sigma = np.sqrt(signal + spec.noise ** 2)
+    signal += rng.standard_normal(signal.shape, dtype=np.float32) * sigma
+    del sigma
+
+    primary = _header([("SIMPLE", True), ("BITPIX", 8), ("NAXIS", 0),
+                       ("EXTEND", True), ("CCDNAME", ccd),
+                       ("EXPNUM", num)])
+    data_size = ny * spec.width * 4
+    padded = -(-data_size // BLOCK) * BLOCK
+    headers = [
+        _header([("XTENSION", "IMAGE"), ("BITPIX", 32), ("NAXIS", 2),
+                 ("NAXIS1", spec.width), ("NAXIS2", ny), ("PCOUNT", 0),
+                 ("GCOUNT", 1), ("EXTNAME", f"Segment{amp:02d}")])
+        for amp in range(spec.amps)
+    ]
+    out = bytearray(len(primary) + sum(len(h) + padded for h in headers))
+    out[:len(primary)] = primary
+    offset = len(primary)
+    biases = spec.bias * (1 + 0.05 * rng.uniform(-1, 1, spec.amps))
+    for amp, header in enumerate(headers):
+        out[offset:offset + len(header)] = header
+        offset += len(header)
+        pixels = np.frombuffer(out, dtype=">i4", count=ny * spec.width,
+                               offset=offset).reshape(ny, spec.width)
+        pixels[:, :data_width] = np.rint(
+            signal[:, amp * data_width:(amp + 1) * data_width] + biases[amp]
+        )
+        pixels[:, data_width:] = np.rint(
+            biases[amp] + spec.noise * rng.standard_normal(
+                (ny, spec.overscan), dtype=np.float32
+            )
+        )
+        offset += padded
+    return out
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build an argument parser for command-line options."""
+
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic raw CCD image."
+    )
+    parser.add_argument('spec', nargs='?', default="",
+                        help=("comma-separated KEY=VALUE image parameters: "
+                              + ", ".join(f.name for f in fields(Spec))))
+    parser.add_argument('-c', '--ccd', default="0",
+                        help="CCD name seeding the image")
+    parser.add_argument('-n', '--exposure', type=int, default=0,
+                        help="exposure number seeding the image")
+    parser.add_argument('-o', '--output', type=Path, required=True,
+                        help="file to write")
+    return parser
+
+
+def main():
+    """Main program."""
+
+    args = build_parser().parse_args()
+    spec = parse_spec(args.spec)
+    start = time.time()
+    image = generate(spec, args.ccd, args.exposure)
+    delta = time.time() - start
+    args.output.write_bytes(image)
+    print(f"Wrote {args.output}: {len(image)} bytes in {delta} seconds")
+
+
+if __name__ == "__main__":
+    main()
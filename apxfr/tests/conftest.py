@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The harness modules are scripts in src/, not an installed package.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
@@ -0,0 +1,120 @@
+"""Check the admission order and pacing of the bandwidth coordinator."""
+
+import socket
+import threading
+import time
+
+import pytest
+
+from coordinator import BandwidthCoordinator
+
+
+@pytest.fixture
+def make_coordinator(tmp_path):
+    coordinators = []
+
+    def make(**kwargs):
+        coordinator = BandwidthCoordinator(tmp_path / "coordinator.sock",
+                                           **kwargs)
+        coordinator.start()
+        coordinators.append(coordinator)
+        return coordinator
+
+    yield make
+    for coordinator in coordinators:
+        coordinator.close()
+
+
+def admit(coordinator, deadline, nbytes, ccd):
+    """Wait for admission as a worker does; close to release it."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(str(coordinator.path))
+    sock.sendall(f"{deadline} {nbytes} {ccd}\n".encode())
+    assert sock.makefile("rb").readline() == b"go\n"
+    return sock
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.01)
+
+
+def admission_order(coordinator, requests):
+    """Queue requests behind a held slot and return the order admitted.
+
+    The slot is held by CCD "a" with 1000 bytes, so that it has sent more
+    than the others.
+    """
+    holder = admit(coordinator, 0, 1000, "a")
+    order = []
+    lock = threading.Lock()
+
+    def worker(deadline, ccd):
+        sock = admit(coordinator, deadline, 10, ccd)
+        with lock:
+            order.append(ccd)
+        sock.close()
+
+    threads = [threading.Thread(target=worker, args=request)
+               for request in requests]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: len(coordinator.waiting) == len(requests))
+    holder.close()
+    for thread in threads:
+        thread.join(5)
+    return order
+
+
+def test_edf(make_coordinator):
+    coordinator = make_coordinator(slots=1, schedule="edf")
+    order = admission_order(coordinator, [(3.0, "c"), (1.0, "a"),
+                                          (2.0, "b")])
+    assert order == ["a", "b", "c"]
+    assert coordinator.admitted == 4
+    assert coordinator.peak == 1
+
+
+def test_fair(make_coordinator):
+    coordinator = make_coordinator(slots=1, schedule="fair")
+    # "a" has the earliest deadline but has already sent the most; "b" and
+    # "c" have sent nothing, so they go first in order of arrival.
+    order = admission_order(coordinator, [(3.0, "c"), (1.0, "a"),
+                                          (2.0, "b")])
+    assert sorted(order[:2]) == ["b", "c"]
+    assert order[2] == "a"
+
+
+def test_slots(make_coordinator):
+    coordinator = make_coordinator(slots=2)
+    held = [admit(coordinator, 0, 1, ccd) for ccd in "ab"]
+    blocked = threading.Thread(target=lambda: admit(coordinator, 0, 1,
+                                                    "c").close())
+    blocked.start()
+    wait_for(lambda: len(coordinator.waiting) == 1)
+    assert coordinator.active == 2
+    held.pop().close()
+    blocked.join(5)
+    assert not blocked.is_alive()
+    for sock in held:
+        sock.close()
+    wait_for(lambda: coordinator.active == 0)
+    assert coordinator.peak == 2
+
+
+def test_bandwidth(make_coordinator):
+    # The first second's worth passes at once; a transfer beyond it puts
+    # the bucket in debt, which the next one waits out.
+    coordinator = make_coordinator(bandwidth=10000)
+    start = time.monotonic()
+    admit(coordinator, 0, 15000, "a").close()
+    assert time.monotonic() - start < 0.2
+    admit(coordinator, 0, 1, "b").close()
+    assert time.monotonic() - start == pytest.approx(0.5, abs=0.2)
+
+
+def test_unknown_schedule(tmp_path):
+    with pytest.raises(ValueError):
+        BandwidthCoordinator(tmp_path / "coordinator.sock", schedule="lifo")
@@ -0,0 +1,89 @@
+"""Check that fitscompress output reads back as the input in astropy."""
+
+from concurrent.futures import ThreadPoolExecutor
+import io
+
+import numpy as np
+import pytest
+
+fits = pytest.importorskip("astropy.io.fits")
+
+import fitscompress
+
+
+def make_image(dtype, shape=(37, 53), seed=0):
+    """Return a noisy sky-like image with some extreme pixels."""
+    rng = np.random.default_rng(seed)
+    info = np.iinfo(dtype)
+    center = (int(info.min) + int(info.max)) // 2
+    image = rng.normal(center, 20, shape).round()
+    image = image.clip(info.min, info.max).astype(dtype)
+    image.flat[::97] = info.max
+    image.flat[1::89] = info.min
+    return image
+
+
+def to_bytes(hdus):
+    out = io.BytesIO()
+    fits.HDUList(hdus).writeto(out)
+    return out.getvalue()
+
+
+def read_back(data):
+    """Return the decompressed images of a compressed file, by HDU."""
+    with fits.open(io.BytesIO(data)) as hdul:
+        return [(type(hdu).__name__, None if hdu.data is None
+                 else np.array(hdu.data))
+                for hdu in hdul]
+
+
+@pytest.mark.parametrize("algorithm", fitscompress.ALGORITHMS)
+@pytest.mark.parametrize("dtype", [np.uint8, np.int16, np.int32])
+@pytest.mark.parametrize("tile_rows", [1, 3])
+def test_round_trip(algorithm, dtype, tile_rows):
+    image = make_image(dtype)
+    data = to_bytes([fits.PrimaryHDU(image)])
+    compressed = fitscompress.compress(data, algorithm, tile_rows)
+    hdus = read_back(compressed)
+    assert [kind for kind, _ in hdus] == ["PrimaryHDU", "CompImageHDU"]
+    np.testing.assert_array_equal(hdus[1][1], image)
+    assert hdus[1][1].dtype == image.dtype
+
+
+@pytest.mark.parametrize("algorithm", fitscompress.ALGORITHMS)
+def test_extensions(algorithm):
+    # Integer extensions are compressed; floating-point images and tables
+    # are copied unchanged.
+    ints = make_image(np.int16, (64, 40), seed=1)
+    floats = make_image(np.int32, (10, 12), seed=2).astype(np.float32)
+    table = fits.BinTableHDU.from_columns(
+        [fits.Column(name="x", format="J", array=np.arange(5))]
+    )
+    data = to_bytes([fits.PrimaryHDU(), fits.ImageHDU(ints, name="CCD"),
+                     fits.ImageHDU(floats), table])
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        compressed = fitscompress.compress(data, algorithm,
+                                           executor=executor)
+    hdus = read_back(compressed)
+    assert [kind for kind, _ in hdus] == [
+        "PrimaryHDU", "CompImageHDU", "ImageHDU", "BinTableHDU"
+    ]
+    np.testing.assert_array_equal(hdus[1][1], ints)
+    np.testing.assert_array_equal(hdus[2][1], floats)
+    np.testing.assert_array_equal(hdus[3][1]["x"], np.arange(5))
+    with fits.open(io.BytesIO(compressed)) as hdul:
+        assert hdul[1].header["EXTNAME"] == "CCD"
+
+
+def test_constant_image():
+    # A constant tile takes the Rice coder's all-zero block path.
+    image = np.full((16, 70), 1234, dtype=np.int32)
+    data = to_bytes([fits.PrimaryHDU(image)])
+    hdus = read_back(fitscompress.compress(data, "RICE_1", 2))
+    np.testing.assert_array_equal(hdus[1][1], image)
+
+
+def test_unsupported_algorithm():
+    data = to_bytes([fits.PrimaryHDU(make_image(np.int16))])
+    with pytest.raises(ValueError):
+        fitscompress.compress(data, "HCOMPRESS_1")
@@ -0,0 +1,250 @@
+"""Check the scheduling, retry, and statistics logic of the harness."""
+
+import asyncio
+from collections import deque
+from datetime import datetime
+import json
+import math
+from pathlib import Path
+import random
+import threading
+import time
+
+import pytest
+
+import harness
+from harness import Histogram, Payload, TransferPolicy, Waiter
+
+
+def make_payload(name="image.fits"):
+    return Payload(Path(name), buffer=memoryview(b"x" * 100))
+
+
+# Histogram
+
+
+def test_histogram_merge():
+    rng = random.Random(0)
+    samples = [rng.lognormvariate(-2, 1) for _ in range(1000)]
+    whole, first, second = Histogram(), Histogram(), Histogram()
+    for sample in samples:
+        whole.add(sample)
+    for sample in samples[:300]:
+        first.add(sample)
+    for sample in samples[300:]:
+        second.add(sample)
+    # As across processes, through the JSON written by each.
+    merged = Histogram()
+    for part in (first, second):
+        merged.merge(Histogram.from_dict(json.loads(json.dumps(
+            part.to_dict()
+        ))))
+    assert merged.counts == whole.counts
+    assert merged.summary() == pytest.approx(whole.summary())
+
+
+def test_histogram_quantiles():
+    hist = Histogram()
+    samples = sorted(0.001 * 1.01 ** i for i in range(1000))
+    for sample in samples:
+        hist.add(sample)
+    for q in (0.5, 0.95, 0.99):
+        exact = samples[math.ceil(q * len(samples)) - 1]
+        assert hist.quantile(q) == pytest.approx(exact, rel=0.13)
+    assert hist.quantile(0) >= samples[0]
+    assert hist.quantile(1) <= samples[-1]
+
+
+def test_histogram_empty():
+    hist = Histogram()
+    hist.merge(Histogram())
+    assert hist.count == 0
+    assert math.isnan(hist.quantile(0.5))
+    other = Histogram()
+    other.add(2.0)
+    hist.merge(other)
+    assert (hist.min, hist.max) == (2.0, 2.0)
+
+
+# Waiter
+
+
+def make_waiter(policy, due, interval=10.0):
+    """Return a waiter whose first ``due`` exposures are already due."""
+    now = datetime.now()
+    waiter = Waiter(now.hour, now.minute, 0, policy=policy)
+    waiter.interval = interval
+    waiter.base = time.monotonic() - (due - 0.5) * interval
+    return waiter
+
+
+def steps(waiter, numexp, count):
+    """Return the first ``count`` exposures chosen, each with lateness."""
+    pending = deque()
+    state = {"numexp": numexp, "seqnum_start": 0, "next": 0}
+    chosen = []
+    for _ in range(count):
+        num, delay = waiter._step(pending, state)
+        chosen.append((num, delay < 0))
+    return chosen
+
+
+@pytest.mark.parametrize("policy, expected, skipped", [
+    ("catchup", [0, 1, 2, 3], 0),
+    ("skip", [2, 3], 2),
+    ("newest", [2, 0, 1, 3], 0),
+])
+def test_waiter_policies(policy, expected, skipped):
+    # Exposures 0-2 are due, 3 and 4 are not.
+    waiter = make_waiter(policy, 3)
+    chosen = steps(waiter, 5, len(expected))
+    assert [num for num, _ in chosen] == expected
+    # Only the last is not yet due.
+    late = [True] * (len(expected) - 1) + [False]
+    assert [late for _, late in chosen] == late
+    assert waiter.skipped == skipped
+
+
+@pytest.mark.parametrize("policy, expected", [
+    ("catchup", [0, 1, 2, 3]),
+    ("skip", [3]),
+    ("newest", [3, 0, 1, 2]),
+])
+def test_waiter_exposures(policy, expected):
+    # With no interval every exposure is due at once.
+    waiter = make_waiter(policy, 4, interval=0)
+    assert list(waiter.exposures(4, 0)) == expected
+    assert waiter.started == len(expected)
+
+
+def test_waiter_resume():
+    waiter = make_waiter("catchup", 5, interval=0)
+    assert list(waiter.exposures(5, 0, first=3)) == [3, 4]
+
+
+def test_waiter_unknown_policy():
+    with pytest.raises(ValueError):
+        Waiter(0, 0, 1, policy="later")
+
+
+# TransferPolicy
+
+
+class FakeUploader(harness.Uploader):
+    """Uploader failing a number of times, then slow or fast in turn.
+
+    ``delays`` holds the duration of each successive successful attempt;
+    slow attempts stop early if cancelled.
+    """
+
+    def __init__(self, failures=0, delays=()):
+        self.failures = failures
+        self.delays = list(delays)
+        self.lock = threading.Lock()
+        self.attempts = 0
+        self.cancelled = 0
+
+    def transfer(self, payload):
+        with self.lock:
+            self.attempts += 1
+            if self.failures > 0:
+                self.failures -= 1
+                raise ConnectionError("flaky")
+            delay = self.delays.pop(0) if self.delays else 0.0
+        end = time.monotonic() + delay
+        while time.monotonic() < end:
+            try:
+                harness.check_cancelled()
+            except harness.TransferCancelled:
+                with self.lock:
+                    self.cancelled += 1
+                raise
+            time.sleep(0.005)
+
+
+def test_retry_succeeds():
+    uploader = FakeUploader(failures=2)
+    policy = TransferPolicy(uploader, retries=2, backoff=0)
+    policy.transfer(make_payload())
+    assert uploader.attempts == 3
+    assert (policy.transfers, policy.retried, policy.failures) == (1, 2, 0)
+
+
+def test_retry_gives_up():
+    uploader = FakeUploader(failures=3)
+    policy = TransferPolicy(uploader, retries=1, backoff=0)
+    with pytest.raises(ConnectionError):
+        policy.transfer(make_payload())
+    assert uploader.attempts == 2
+    assert (policy.transfers, policy.retried, policy.failures) == (0, 1, 1)
+
+
+def test_retry_backoff():
+    policy = TransferPolicy(FakeUploader(), retries=20, backoff=1.0)
+    payload = make_payload()
+    for attempt, low, high in [(0, 0.5, 1.0), (3, 4.0, 8.0),
+                               (10, 15.0, TransferPolicy.MAX_BACKOFF)]:
+        for _ in range(20):
+            delay = policy._retry_delay(payload, attempt, OSError())
+            assert low <= delay <= high
+
+
+def primed_policy(uploader):
+    """Return a policy hedging after the median of 10 ms transfers."""
+    policy = TransferPolicy(uploader, retries=0, hedge_percentile=50)
+    policy.recent.extend([0.01] * TransferPolicy.MIN_SAMPLES)
+    return policy
+
+
+def test_hedge_wins():
+    uploader = FakeUploader(delays=[5.0, 0.0])
+    policy = primed_policy(uploader)
+    start = time.monotonic()
+    policy.transfer(make_payload())
+    policy.executor.shutdown(wait=True)
+    # The slow primary was cancelled rather than run to the end.
+    assert time.monotonic() - start < 2.0
+    assert (policy.hedged, policy.hedge_wins) == (1, 1)
+    assert uploader.attempts == 2
+    assert uploader.cancelled == 1
+
+
+def test_no_hedge_before_samples():
+    uploader = FakeUploader(delays=[0.05])
+    policy = TransferPolicy(uploader, retries=0, hedge_percentile=50)
+    policy.transfer(make_payload())
+    assert (policy.hedged, uploader.attempts) == (0, 1)
+
+
+def test_hedge_wins_async():
+    uploader = FakeUploader(delays=[5.0, 0.0])
+    policy = primed_policy(uploader)
+
+    async def run():
+        start = time.monotonic()
+        await policy.transfer_async(make_payload())
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) < 2.0
+    assert (policy.hedged, policy.hedge_wins) == (1, 1)
+
+
+# log_timing
+
+
+def test_log_timing_skips_failures(caplog):
+    class Uploader:
+        @harness.log_timing
+        def transfer(self, fail):
+            if fail:
+                raise ConnectionError("flaky")
+
+    before = len(harness.metrics.samples)
+    with caplog.at_level("INFO"):
+        Uploader().transfer(False)
+        with pytest.raises(ConnectionError):
+            Uploader().transfer(True)
+    messages = [record.getMessage() for record in caplog.records]
+    assert sum(m.startswith("End transfer") for m in messages) == 1
+    assert sum(m.startswith("Failed transfer") for m in messages) == 1
+    assert len(harness.metrics.samples) == before + 1
@@ -0,0 +1,75 @@
+"""Check the bookkeeping and CPU placement of the worker supervisor."""
+
+import pytest
+
+import supervisor
+from supervisor import CcdProgress, affinity_plan
+
+
+def test_parse_cpulist():
+    assert supervisor._parse_cpulist("0-3,8,10-11\n") == {0, 1, 2, 3, 8,
+                                                          10, 11}
+    assert supervisor._parse_cpulist("") == set()
+
+
+def test_resume():
+    progress = CcdProgress("0-0")
+    for num in (0, 1, 3):
+        progress.update({"event": "transfer", "exposure": num, "bytes": 10,
+                         "seconds": 0.1})
+    progress.update({"event": "skipped", "exposure": 4})
+    # Exposure 2 is redone, and with it 3 and 4.
+    assert progress.resume(6) == 2
+    progress.update({"event": "transfer", "exposure": 2, "bytes": 10,
+                     "seconds": 0.1})
+    assert progress.resume(6) == 5
+    assert progress.to_dict()["exposures_done"] == 5
+    assert progress.to_dict()["transfers"] == 4
+
+
+def test_affinity_plan(monkeypatch):
+    nodes = [{0, 1, 2}, {4, 5}]
+    monkeypatch.setattr(supervisor, "numa_nodes", lambda: nodes)
+    assert affinity_plan("none", 3) == [None] * 3
+    assert affinity_plan("numa", 3) == [nodes[0], nodes[1], nodes[0]]
+    # One CPU each, alternating between nodes.
+    assert affinity_plan("cpu", 6) == [{0}, {4}, {1}, {5}, {2}, {0}]
+
+
+def test_numa_nodes():
+    nodes = supervisor.numa_nodes()
+    assert nodes
+    assert all(nodes)
+
+
+def run_supervised(tmp_path, failures, max_restarts):
+    """Supervise one CCD whose workers fail ``failures`` times."""
+    count = tmp_path / "failures"
+    count.write_text("0")
+
+    def run_worker(name, first, path):
+        failed = int(count.read_text())
+        if failed < failures:
+            count.write_text(str(failed + 1))
+            raise RuntimeError("worker failed")
+
+    sup = supervisor.Supervisor(tmp_path / "supervisor.sock", ["0-0"], 2,
+                                run_worker, max_restarts=max_restarts)
+    sup.spawn("0-0")
+    sup.start()
+    ok = sup.wait()
+    sup.close()
+    return ok, sup.ccds["0-0"]
+
+
+@pytest.mark.parametrize("failures, restarts", [(0, 0), (2, 2)])
+def test_restart(tmp_path, failures, restarts):
+    ok, progress = run_supervised(tmp_path, failures, max_restarts=2)
+    assert ok
+    assert (progress.state, progress.restarts) == ("done", restarts)
+
+
+def test_give_up(tmp_path):
+    ok, progress = run_supervised(tmp_path, 3, max_restarts=2)
+    assert not ok
+    assert (progress.state, progress.restarts) == ("failed", 2)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""Benchmark DAX generation as the quantum graph grows.
+
+Writes synthetic ``pipetask qgraph --show workflow`` output with the shape
+of a DRP graph (quanta in task order, each with a few parents among the
+earlier quanta), runs ``python/pegasusize.py`` on it in a fresh process for
+each size, and reports the wall time and peak resident set size of each
+run.  Flat peak RSS as the quantum count grows means memory is bounded.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+PEGASUSIZE = Path(__file__).resolve().parent.parent / "python" / "pegasusize.py"
+TASKS = ["IsrTask", "CharacterizeImageTask", "CalibrateTask", "MakeWarpTask",
+         "CompareWarpAssembleCoaddTask", "DetectCoaddSourcesTask",
+         "MeasureMergedCoaddSourcesTask", "ForcedPhotCoaddTask"]
+
+
+def write_workflow(path, quanta, fanin, seed=0):
+    """Write synthetic workflow output with ``quanta`` quanta.
+
+    Returns the number of dependencies written.
+    """
+    rng = random.Random(seed)
+    per_task = -(-quanta // len(TASKS))
+    edges = 0
+    with open(path, "w") as f:
+        for iq in range(quanta):
+            task = TASKS[iq // per_task]
+            f.write("Quantum %d: %s\n" % (iq, task))
+            # Parents come from the previous task, as in a pipeline.
+            first = (iq // per_task - 1) * per_task
+            if first < 0:
+                continue
+            for parent in rng.sample(range(first, first + per_task),
+                                     min(fanin, per_task)):
+                f.write("Parent Quantum %d - Child Quantum %d\n"
+                        % (parent, iq))
+                edges += 1
+    return edges
+
+
+def run(workflow, dax):
+    """Run pegasusize and return its wall time and peak RSS in bytes."""
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, str(PEGASUSIZE),
+                             "-i", str(workflow), "-o", str(dax)],
+                            stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    delta = time.time() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
+    # ru_maxrss is in kilobytes on Linux.
+    return delta, usage.ru_maxrss * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark DAX generation time and peak memory."
+    )
+    parser.add_argument("-q", "--quanta", default="1000,10000,100000,1000000",
+                        help="comma-separated quantum counts")
+    parser.add_argument("-f", "--fanin", type=int, default=4,
+                        help="parents per quantum")
+    parser.add_argument("-o", "--output", type=Path,
+                        help="JSON file to write results to")
+    args = parser.parse_args()
+
+    results = []
+    print("%10s %10s %10s %12s %10s" % ("quanta", "edges", "seconds",
+                                        "quanta/s", "peak MB"))
+    with tempfile.TemporaryDirectory() as tmp:
+        workflow = Path(tmp, "wf")
+        dax = Path(tmp, "wf.dax")
+        for quanta in [int(q) for q in args.quanta.split(",") if q]:
+            edges = write_workflow(workflow, quanta, args.fanin)
+            seconds, rss = run(workflow, dax)
+            results.append({"quanta": quanta, "edges": edges,
+                            "seconds": seconds, "peak_rss": rss,
+                            "dax_bytes": dax.stat().st_size})
+            print("%10d %10d %10.2f %12.0f %10.1f"
+                  % (quanta, edges, seconds, quanta / seconds, rss / 1e6))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"fanin": args.fanin, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -19,9 +19,23 @@ pipetask run -b $BPATH \
    --output-run "$COLLECTION" \
    --init-only --register-dataset-types --qgraph $OUTDIR/$QGRAPH_FILE.qgraph
 
+# Set BUNDLE_URL to where the bundles will be uploaded, such as
+# s3://$BUCKET-wf/input, to pack the single quanta into a few bundles
+# that jobs read by range instead of staging one file each
+QUANTA_DIR=$OUTDIR/$INDIV
+if [ -n "$BUNDLE_URL" ]; then
+    QUANTA_DIR=$LOCALDIR/quanta
+fi
+
 pipetask qgraph --qgraph $OUTDIR/$QGRAPH_FILE.qgraph --show workflow -b $BPATH \
   -i "$INPUTCOLL" \
-  --save-single-quanta $OUTDIR/$INDIV/quantum-{:06d}.qgraph  >& $LOCALDIR/wf
+  --save-single-quanta $QUANTA_DIR/quantum-{:06d}.qgraph  >& $LOCALDIR/wf
 
 export DIR=`dirname "${BASH_SOURCE[0]}"`
-python $DIR/../python/pegasusize.py --initPickle $QGRAPH_FILE.qgraph -i $LOCALDIR/wf -o $LOCALDIR/wf.dax
+if [ -n "$BUNDLE_URL" ]; then
+    python $DIR/../python/qbundle.py pack $QUANTA_DIR -o $LOCALDIR && rm -r $QUANTA_DIR
+fi
+# Set RESOURCES to the output of resources.py to size jobs from past runs
+python $DIR/../python/pegasusize.py --initPickle $QGRAPH_FILE.qgraph -i $LOCALDIR/wf -o $LOCALDIR/wf.dax \
+    ${RESOURCES:+--resources $RESOURCES} \
+    ${BUNDLE_URL:+--bundles $LOCALDIR/qgraphs.json --bundleUrl $BUNDLE_URL}
@@ -1,20 +1,170 @@
 #!/usr/bin/env python
 
-import boto3, os, sys
+"""Sync the workflow inputs in the pegasus directory to a bucket.
 
-endpoint = os.environ.get("S3_ENDPOINT_URL", 'https://storage.googleapis.com')
-s3client = boto3.client("s3", endpoint_url=endpoint)
+Files are uploaded concurrently by a thread pool sharing one boto3 client
+and its connection pool.  Files already in the bucket with the same size
+and checksum are skipped, so a rerun only uploads what changed.  The
+checksum is the object's ETag: the MD5 of the file, or for objects
+uploaded in parts, the MD5 of the MD5s of its parts with the part count,
+which is recomputed with the part size used here.
+"""
 
-bucketName = sys.argv[1]
-thisDir = sys.argv[2]
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-s3client.create_bucket(Bucket=bucketName)
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 
-for folder in (thisDir+"/../pegasus/",):
-    for root, dirs, files in os.walk(folder):
-        for filename in files:
-            fullpath = os.path.join(root, filename)
-            # Put all qgraph files to the "input" subfolder
-            key = "input/" + filename if fullpath.endswith("qgraph") else filename
-            print(f"Upload {key} from {fullpath}")
-            s3client.upload_file(Bucket=bucketName, Key=key, Filename=fullpath)
+MB = 1024 * 1024
+
+
+def localFiles(thisDir):
+    """Yield the key, path, and size of each file to upload."""
+    for folder in (thisDir+"/../pegasus/",):
+        for root, dirs, files in os.walk(folder):
+            for filename in files:
+                fullpath = os.path.join(root, filename)
+                # Put all qgraph files and bundles to the "input" subfolder
+                key = "input/" + filename \
+                    if fullpath.endswith(("qgraph", "qbundle")) else filename
+                yield key, fullpath, os.path.getsize(fullpath)
+
+
+def remoteObjects(s3client, bucketName):
+    """Return the size and ETag of each object in the bucket by key."""
+    objects = {}
+    paginator = s3client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucketName):
+        for obj in page.get("Contents", ()):
+            objects[obj["Key"]] = (obj["Size"], obj["ETag"].strip('"'))
+    return objects
+
+
+def etag(path, size, config):
+    """Return the ETag an upload of a file with ``config`` would get."""
+    with open(path, "rb") as f:
+        if size < config.multipart_threshold:
+            digest = hashlib.md5()
+            for chunk in iter(lambda: f.read(config.multipart_chunksize), b""):
+                digest.update(chunk)
+            return digest.hexdigest()
+        digests = [hashlib.md5(chunk) for chunk in
+                   iter(lambda: f.read(config.multipart_chunksize), b"")]
+    combined = hashlib.md5(b"".join(d.digest() for d in digests))
+    return "%s-%d" % (combined.hexdigest(), len(digests))
+
+
+class Progress:
+    """Counts of files and bytes synced, reported periodically."""
+
+    def __init__(self, files, nbytes, interval=5.0):
+        self.lock = threading.Lock()
+        self.total = (files, nbytes)
+        self.done = [0, 0]
+        self.uploaded = [0, 0]
+        self.skipped = 0
+        self.failed = 0
+        self.interval = interval
+        self.start = self.last = time.time()
+
+    def record(self, size, uploaded=False, skipped=False, failed=False):
+        with self.lock:
+            self.done[0] += 1
+            self.done[1] += size
+            if uploaded:
+                self.uploaded[0] += 1
+                self.uploaded[1] += size
+            self.skipped += skipped
+            self.failed += failed
+            now = time.time()
+            if now - self.last >= self.interval:
+                self.last = now
+                self.report()
+
+    def report(self, final=False):
+        elapsed = time.time() - self.start
+        rate = self.uploaded[1] / elapsed / MB if elapsed else 0.0
+        print("%s%d/%d files, %.1f/%.1f MB; %d uploaded, %d unchanged,"
+              " %d failed; %.1f MB/s over %.1f s"
+              % ("Done: " if final else "", self.done[0], self.total[0],
+                 self.done[1] / MB, self.total[1] / MB, self.uploaded[0],
+                 self.skipped, self.failed, rate, elapsed), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Upload workflow inputs to a bucket, skipping unchanged"
+                    " files")
+    parser.add_argument("bucketName", help="bucket to upload to")
+    parser.add_argument("thisDir", help="directory of this script")
+    parser.add_argument("-j", "--workers", type=int, default=32,
+                        help="files to upload at once")
+    parser.add_argument("--multipartThreshold", type=int, default=64,
+                        help="size in MB from which files are uploaded in"
+                             " parts")
+    parser.add_argument("--partSize", type=int, default=16,
+                        help="part size in MB")
+    parser.add_argument("--force", action="store_true",
+                        help="upload every file, even if unchanged")
+    args = parser.parse_args()
+
+    endpoint = os.environ.get("S3_ENDPOINT_URL", 'https://storage.googleapis.com')
+    # One client and connection pool for all threads, with a connection
+    # for each part of each file in flight.
+    partThreads = 4
+    s3client = boto3.client(
+        "s3", endpoint_url=endpoint,
+        config=Config(max_pool_connections=args.workers * partThreads))
+    transferConfig = TransferConfig(
+        multipart_threshold=args.multipartThreshold * MB,
+        multipart_chunksize=args.partSize * MB,
+        max_concurrency=partThreads)
+
+    try:
+        s3client.create_bucket(Bucket=args.bucketName)
+    except (s3client.exceptions.BucketAlreadyOwnedByYou,
+            s3client.exceptions.BucketAlreadyExists):
+        pass
+
+    files = list(localFiles(args.thisDir))
+    existing = {} if args.force else remoteObjects(s3client, args.bucketName)
+    progress = Progress(len(files), sum(size for _, _, size in files))
+    print("Syncing %d files, %d already in %s"
+          % (len(files), len(existing), args.bucketName), flush=True)
+
+    def sync(key, fullpath, size):
+        remote = existing.get(key)
+        if (remote is not None and remote[0] == size
+                and remote[1] == etag(fullpath, size, transferConfig)):
+            return False
+        s3client.upload_file(Bucket=args.bucketName, Key=key,
+                             Filename=fullpath, Config=transferConfig)
+        return True
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(sync, *item): item for item in files}
+        for future in as_completed(futures):
+            key, fullpath, size = futures[future]
+            try:
+                uploaded = future.result()
+            except Exception as e:
+                print("Failed to upload %s from %s: %s" % (key, fullpath, e),
+                      file=sys.stderr, flush=True)
+                progress.record(size, failed=True)
+            else:
+                progress.record(size, uploaded=uploaded,
+                                skipped=not uploaded)
+    progress.report(final=True)
+    if progress.failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
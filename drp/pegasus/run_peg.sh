@@ -1,6 +1,8 @@
 #!/bin/bash
 export S3_ENDPOINT_URL=https://storage.googleapis.com
 export HOME=/tmp
+# For the qbundle transformation; jobs get the environment of the submitter
+export DRP_DIR=${DRP_DIR:-$(cd "$(dirname "$0")/.." && pwd)}
 export COL=`date +%y%m%d%H%M`
 export REP=s/OUTCOL/hfc\\/$COL/
 sed $REP wf.dax > wfx.dax
@@ -11,6 +13,7 @@ pegasus-plan \
         --dax wfx.dax \
         --dir submit \
         --cleanup none \
+        --cluster label \
         --sites gcp \
         --input-dir input \
         --output-dir output 2>&1 \
@@ -1,78 +1,578 @@
 #!/usr/bin/env python
 
+"""Generate a Pegasus DAX workflow from ``pipetask qgraph --show workflow``.
+
+The DAX is written while the workflow is parsed: each job goes straight to
+the output, and dependencies, which the DAX schema places after all jobs,
+are spooled to a temporary file and appended at the end.  Memory use thus
+stays flat however many quanta and edges the graph has.
+
+Options that need the whole graph, such as clustering, load it into a
+compact `Workflow` first.
+"""
+
 import argparse
-import os
+from array import array
+import heapq
+import math
 import re
-import Pegasus.DAX3 as peg
-
-def generateDax(f, name="dax", noInitJob=False, initPickle=None):
-    """Generate a Pegasus DAX abstract workflow"""
-    dax = peg.ADAG(name)
-
-    if not noInitJob:
-        # Add the init job
-        init = peg.Job(name="pipetask", id=999999) # need a unique number
-        pickle = peg.File(initPickle)
-        dax.addFile(pickle)
-        init.uses(pickle, link=peg.Link.INPUT)
-        init.addArguments("run", "-b BUTLER -i INCOL --output-run OUTCOL",
-                          "--init-only --register-dataset-types --qgraph", pickle)
-        logfile = peg.File("log.init.out")
-        dax.addFile(logfile)
-        init.setStderr(logfile)
-        init.uses(logfile, link=peg.Link.OUTPUT)
-        dax.addJob(init)
+import tempfile
+from xml.sax.saxutils import escape, quoteattr
+
+DAX_SCHEMA = "http://pegasus.isi.edu/schema/DAX"
+DAX_VERSION = "3.6"
+
+QUANTUM_RE = re.compile(r"Quantum (\d+): (\w+)")
+EDGE_RE = re.compile(r"Parent Quantum (\d+) - Child Quantum (\d+)")
+
+# Id of the init job; quantum ids are "Q<index>", so they never collide
+# with it or with each other, and index 0 is valid.
+INIT_ID = "init"
+
+DEMANDING_TASKS = set(['MakeWarpTask', 'CompareWarpAssembleCoaddTask',
+                       'DeblendCoaddSourcesSingleTask',
+                       'MeasureMergedCoaddSourcesTask'])
+
+
+class File(str):
+    """Name of a file, rendered as a file element in job arguments."""
+
 
+def jobId(iq):
+    """Return the DAX job id of quantum ``iq``."""
+    return "Q%d" % iq
+
+
+def parseWorkflow(f):
+    """Parse the output of ``pipetask qgraph --show workflow``.
+
+    Yields ``("quantum", index, taskName)`` for each quantum and
+    ``("edge", parent, child)`` for each dependency, in input order.
+    """
     for line in f:
-        # To add a job
         if line.startswith("Quantum"):
-            match = re.search(r"(\d+): (\w+)", line)
-            iq = int(match.group(1))
-            taskname = match.group(2)
-            print("Adding job", iq, taskname, " #", line.rstrip('\n'))
-            # Pegasus Job cannot have id=0, hack it...FIXME
-            # Assuming there are <99999 jobs in total
-            job = peg.Job(name="pipetask", id=iq+100000)
-
-            demandingTasks = set(['MakeWarpTask', 'CompareWarpAssembleCoaddTask',
-                                  'DeblendCoaddSourcesSingleTask',
-                                  'MeasureMergedCoaddSourcesTask'])
-            job.addProfile(peg.Profile(peg.Namespace.CONDOR, "request_cpus", "1"))
-            if taskname in demandingTasks:
-                job.addProfile(peg.Profile(peg.Namespace.CONDOR, "request_memory", "28GB"))
+            match = QUANTUM_RE.search(line)
+            yield "quantum", int(match.group(1)), match.group(2)
+        elif line.startswith("Parent Quantum"):
+            match = EDGE_RE.search(line)
+            yield "edge", int(match.group(1)), int(match.group(2))
+
+
+class DaxWriter:
+    """Write a DAX incrementally.
+
+    Jobs are written as they are added; dependencies are spooled to disk
+    and written when the writer is closed.  Consecutive dependencies of the
+    same child share one child element.
+    """
+
+    def __init__(self, out, name="dax"):
+        self.out = out
+        self.spool = tempfile.TemporaryFile(mode="w+")
+        self.jobs = 0
+        self.edges = 0
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        out.write('<adag xmlns=%s version=%s name=%s>\n'
+                  % (quoteattr(DAX_SCHEMA), quoteattr(DAX_VERSION),
+                     quoteattr(name)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def addJob(self, id, arguments, inputs=(), stderr=None, profiles=(),
+               name="pipetask"):
+        """Write a job.
+
+        ``arguments`` may mix strings and `File` names; ``profiles`` holds
+        ``(namespace, key, value)`` tuples.
+        """
+        out = self.out
+        out.write('\t<job id=%s name=%s>\n' % (quoteattr(id), quoteattr(name)))
+        args = " ".join('<file name=%s/>' % quoteattr(a)
+                        if isinstance(a, File) else escape(a)
+                        for a in arguments)
+        out.write('\t\t<argument>%s</argument>\n' % args)
+        for namespace, key, value in profiles:
+            out.write('\t\t<profile namespace=%s key=%s>%s</profile>\n'
+                      % (quoteattr(namespace), quoteattr(key),
+                         escape(str(value))))
+        if stderr is not None:
+            out.write('\t\t<stderr name=%s link="output"/>\n'
+                      % quoteattr(stderr))
+        for f in inputs:
+            out.write('\t\t<uses name=%s link="input"/>\n' % quoteattr(f))
+        if stderr is not None:
+            out.write('\t\t<uses name=%s link="output"/>\n'
+                      % quoteattr(stderr))
+        out.write('\t</job>\n')
+        self.jobs += 1
+
+    def depends(self, parent, child):
+        """Make job ``child`` depend on job ``parent``."""
+        self.spool.write("%s %s\n" % (child, parent))
+        self.edges += 1
+
+    def close(self):
+        if self.spool is None:
+            return
+        out = self.out
+        self.spool.seek(0)
+        current = None
+        for line in self.spool:
+            child, parent = line.split()
+            if child != current:
+                if current is not None:
+                    out.write('\t</child>\n')
+                out.write('\t<child ref=%s>\n' % quoteattr(child))
+                current = child
+            out.write('\t\t<parent ref=%s/>\n' % quoteattr(parent))
+        if current is not None:
+            out.write('\t</child>\n')
+        out.write('</adag>\n')
+        self.spool.close()
+        self.spool = None
+
+
+def _groupBy(n, keys, values):
+    # Group values by key in 0..n-1, keeping their order (a counting sort),
+    # as offsets and values.
+    start = array("q", [0]) * (n + 1)
+    for key in keys:
+        start[key + 1] += 1
+    for i in range(n):
+        start[i + 1] += start[i]
+    fill = array("q", start)
+    grouped = array("q", [0]) * len(keys)
+    for key, value in zip(keys, values):
+        grouped[fill[key]] = value
+        fill[key] += 1
+    return start, grouped
+
+
+class Workflow:
+    """A quantum graph held compactly in memory for analysis.
+
+    Quanta are numbered by position in input order; ``index`` and ``task``
+    hold their quantum indices and task ids, and ``parentsOf`` gives the
+    positions of the parents of a quantum.
+    """
+
+    def __init__(self):
+        self.index = array("q")
+        self.task = array("l")
+        self.taskNames = []
+        self.taskIds = {}
+        self.position = {}
+        # Dependencies as quantum indices, in input order.
+        self.edgeParent = array("q")
+        self.edgeChild = array("q")
+        # Parents and children of each quantum by position, as offsets
+        # into lists of positions.
+        self.parentStart = self.parentList = None
+        self.childStart = self.childList = None
+
+    @classmethod
+    def read(cls, f):
+        wf = cls()
+        for kind, a, b in parseWorkflow(f):
+            if kind == "quantum":
+                wf.position[a] = len(wf.index)
+                wf.index.append(a)
+                wf.task.append(wf.taskIds.setdefault(b, len(wf.taskNames)))
+                if len(wf.taskIds) > len(wf.taskNames):
+                    wf.taskNames.append(b)
             else:
-                job.addProfile(peg.Profile(peg.Namespace.CONDOR, "request_memory", "2GB"))
-
-            filename = "quantum-%06d.qgraph" % iq
-            pickle = peg.File(filename)
-            dax.addFile(pickle)
-            job.uses(pickle, link=peg.Link.INPUT)
-            job.addArguments("run", "-b BUTLER -i INCOL --output-run OUTCOL",
-                             "--extend-run --skip-init-writes",
-                             "--clobber-partial-outputs --skip-existing --qgraph", pickle)
-
-            logfile = peg.File("log.%s.%06d.out" % (taskname, iq) )
-            dax.addFile(logfile)
-            job.setStderr(logfile)
-            job.uses(logfile, link=peg.Link.OUTPUT)
-   
-            dax.addJob(job)
+                wf.edgeParent.append(a)
+                wf.edgeChild.append(b)
+        wf._indexParents()
+        return wf
+
+    def __len__(self):
+        return len(self.index)
+
+    def _indexParents(self):
+        position = self.position
+        self._setParents([position[c] for c in self.edgeChild],
+                         [position[p] for p in self.edgeParent])
+
+    def _setParents(self, children, parents):
+        self.parentStart, self.parentList = _groupBy(len(self), children,
+                                                     parents)
+        self.childStart, self.childList = _groupBy(len(self), parents,
+                                                   children)
+
+    def parentsOf(self, pos):
+        """Return the positions of the parents of quantum ``pos``."""
+        return self.parentList[self.parentStart[pos]:self.parentStart[pos + 1]]
+
+    def childrenOf(self, pos):
+        """Return the positions of the children of quantum ``pos``."""
+        return self.childList[self.childStart[pos]:self.childStart[pos + 1]]
+
+    def edgeCount(self):
+        return len(self.parentList)
+
+    def topologicalOrder(self):
+        """Return the positions of the quanta with parents before children.
+
+        Raises `ValueError` if the quanta depend on each other in a cycle.
+        """
+        n = len(self)
+        waiting = array("q", (self.parentStart[i + 1] - self.parentStart[i]
+                              for i in range(n)))
+        order = array("q", (i for i in range(n) if waiting[i] == 0))
+        for pos in order:
+            for child in self.childrenOf(pos):
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    order.append(child)
+        if len(order) < n:
+            raise ValueError("Quanta depend on each other in a cycle")
+        return order
+
+    def reduce(self):
+        """Remove the dependencies implied by other paths.
+
+        A parent of a quantum is dropped if it is also an ancestor of
+        another parent.  Ancestors are searched only down to the lowest
+        level of the parents, so in graphs whose parents sit on one level,
+        as in pipelines, each check is immediate.  Duplicate dependencies
+        are dropped too.
+
+        Returns the number of dependencies removed.
+        """
+        n = len(self)
+        level = array("q", [0]) * n
+        for pos in self.topologicalOrder():
+            for child in self.childrenOf(pos):
+                level[child] = max(level[child], level[pos] + 1)
+        before = self.edgeCount()
+        children, parents = array("q"), array("q")
+        for pos in range(n):
+            candidates = set(self.parentsOf(pos))
+            redundant = set()
+            if len(candidates) > 1:
+                floor = min(level[p] for p in candidates)
+                visited = set()
+                for start in candidates:
+                    stack = [p for p in self.parentsOf(start)
+                             if level[p] >= floor]
+                    while stack:
+                        node = stack.pop()
+                        if node in visited:
+                            continue
+                        visited.add(node)
+                        if node in candidates:
+                            redundant.add(node)
+                        stack.extend(p for p in self.parentsOf(node)
+                                     if level[p] >= floor
+                                     and p not in visited)
+            for parent in sorted(candidates - redundant,
+                                 key=self.parentsOf(pos).index):
+                children.append(pos)
+                parents.append(parent)
+        self._setParents(children, parents)
+        return before - self.edgeCount()
+
+    def criticalPath(self, runtime):
+        """Return the critical-path length of each quantum.
+
+        That is the longest total ``runtime`` of a chain of dependencies
+        starting at the quantum, including its own run time.
+        """
+        length = array("d", runtime)
+        for pos in reversed(self.topologicalOrder()):
+            longest = 0.0
+            for child in self.childrenOf(pos):
+                longest = max(longest, length[child])
+            length[pos] += longest
+        return length
+
+    def makespan(self, runtime, slots, priority=None):
+        """Simulate list scheduling of the quanta on ``slots`` slots.
+
+        Ready quanta start in order of decreasing ``priority``, or in input
+        order if it is None.  Returns the time at which the last finishes.
+        """
+        n = len(self)
+        waiting = array("q", (self.parentStart[i + 1] - self.parentStart[i]
+                              for i in range(n)))
+
+        def key(pos):
+            return (-priority[pos] if priority is not None else 0, pos)
+
+        ready = [key(i) for i in range(n) if waiting[i] == 0]
+        heapq.heapify(ready)
+        running = []
+        now = 0.0
+        while ready or running:
+            while ready and len(running) < slots:
+                _, pos = heapq.heappop(ready)
+                heapq.heappush(running, (now + runtime[pos], pos))
+            now, pos = heapq.heappop(running)
+            for child in self.childrenOf(pos):
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    heapq.heappush(ready, key(child))
+        return now
+
+    def taskRanks(self):
+        """Rank tasks so that every dependency goes to a higher rank.
+
+        Raises `ValueError` if the tasks depend on each other in a cycle,
+        including a task depending on itself.
+        """
+        successors = [set() for _ in self.taskNames]
+        for child in range(len(self)):
+            for parent in self.parentsOf(child):
+                successors[self.task[parent]].add(self.task[child])
+        indegree = [0] * len(self.taskNames)
+        for succ in successors:
+            for t in succ:
+                indegree[t] += 1
+        rank = [0] * len(self.taskNames)
+        ready = [t for t, d in enumerate(indegree) if d == 0]
+        done = 0
+        while ready:
+            t = ready.pop()
+            done += 1
+            for s in successors[t]:
+                rank[s] = max(rank[s], rank[t] + 1)
+                indegree[s] -= 1
+                if indegree[s] == 0:
+                    ready.append(s)
+        if done < len(self.taskNames):
+            cyclic = [self.taskNames[t] for t, d in enumerate(indegree) if d]
+            raise ValueError("Tasks depend on each other in a cycle: %s"
+                             % ", ".join(cyclic))
+        return rank
+
+
+def clusterLabels(wf, sizes, chainTasks=()):
+    """Assign the quanta of a workflow to clustered jobs.
+
+    Vertical clustering first contracts linear chains, in which each
+    quantum is the only child of the previous one and has it as its only
+    parent, into single units; only quanta of tasks in ``chainTasks`` (or
+    of any task if it contains ``"*"``) are chained.  Horizontal
+    clustering then groups units with the same sequence of tasks, up to
+    ``sizes[task]`` units per job for the task at the head of the chain
+    (``sizes["*"]`` for tasks not listed, 1 by default).
+
+    Units of one group cannot depend on each other, and a chain can only be
+    entered at its head and left at its tail, so as long as the tasks form
+    a DAG the clustered jobs do too.
+
+    Returns an array of cluster numbers by quantum position, with -1 for
+    quanta left in jobs of their own.
+    """
+    n = len(wf)
+    wf.taskRanks()
+
+    def chained(pos):
+        return "*" in chainTasks or wf.taskNames[wf.task[pos]] in chainTasks
+
+    # Count children and remember the last, to find links of chains.
+    childCount = array("q", [0]) * n
+    onlyChild = array("q", [-1]) * n
+    for child in range(n):
+        for parent in wf.parentsOf(child):
+            childCount[parent] += 1
+            onlyChild[parent] = child
+    nextInChain = array("q", [-1]) * n
+    linked = bytearray(n)
+    for pos in range(n):
+        child = onlyChild[pos]
+        if (child >= 0 and childCount[pos] == 1
+                and len(wf.parentsOf(child)) == 1
+                and chained(pos) and chained(child)):
+            nextInChain[pos] = child
+            linked[child] = 1
+
+    labels = array("q", [-1]) * n
+    groups = {}
+    clusters = 0
+    for head in range(n):
+        if linked[head]:
+            continue
+        unit = [head]
+        while nextInChain[unit[-1]] >= 0:
+            unit.append(nextInChain[unit[-1]])
+        signature = tuple(wf.task[pos] for pos in unit)
+        headTask = wf.taskNames[signature[0]]
+        size = sizes.get(headTask, sizes.get("*", 1))
+        members = groups.setdefault(signature, [])
+        members.append(unit)
+        if len(members) >= size:
+            clusters = _closeGroup(labels, groups.pop(signature), clusters)
+    for members in groups.values():
+        clusters = _closeGroup(labels, members, clusters)
+    return labels
+
+
+def _closeGroup(labels, units, clusters):
+    # A single quantum stays a job of its own.
+    if len(units) == 1 and len(units[0]) == 1:
+        return clusters
+    for unit in units:
+        for pos in unit:
+            labels[pos] = clusters
+    return clusters + 1
+
+
+def taskRuntimes(wf, resources=None):
+    """Return the estimated run time of each quantum of a workflow.
+
+    Tasks without an estimate in ``resources`` get the mean of those with
+    one, or 1 second, so that critical paths count jobs.
+    """
+    known = {}
+    if resources is not None:
+        for t, taskname in enumerate(wf.taskNames):
+            seconds = resources.runtime(taskname)
+            if seconds is not None:
+                known[t] = seconds
+    default = sum(known.values()) / len(known) if known else 1.0
+    perTask = [known.get(t, default) for t in range(len(wf.taskNames))]
+    return array("d", (perTask[t] for t in wf.task))
+
+
+def quantumJob(dax, iq, taskname, profiles=(), resources=None,
+               bundles=None):
+    """Write the job running quantum ``iq`` of task ``taskname``.
+
+    Memory and CPUs are requested from ``resources``, a
+    `resources.ResourceProfiles`, falling back to fixed defaults for tasks
+    it has no profile of.  With ``bundles``, a `qbundle.Manifest`, the job
+    reads its quantum from a bundle through ``qbundle.py run`` instead of
+    having it staged.
+    """
+    memory = cpus = None
+    if resources is not None:
+        memory = resources.memory(taskname)
+        cpus = resources.cpus(taskname)
+    if memory is None:
+        memory = "28GB" if taskname in DEMANDING_TASKS else "2GB"
+    if cpus is None:
+        cpus = 1
+    pickle = "quantum-%06d.qgraph" % iq
+    arguments = ["run", "-b BUTLER -i INCOL --output-run OUTCOL",
+                 "--extend-run --skip-init-writes",
+                 "--clobber-partial-outputs --skip-existing --qgraph"]
+    if bundles is None:
+        name, inputs = "pipetask", [pickle]
+        arguments.append(File(pickle))
+    else:
+        url, offset, size = bundles.locate(pickle)
+        name, inputs = "qbundle", []
+        arguments = (["run", url, str(offset), str(size), pickle,
+                      "--", "pipetask"] + arguments + ["{qgraph}"])
+    dax.addJob(jobId(iq), arguments, inputs=inputs,
+               stderr="log.%s.%06d.out" % (taskname, iq),
+               profiles=[("condor", "request_cpus", str(cpus)),
+                         ("condor", "request_memory", memory),
+                         *profiles],
+               name=name)
+
+
+def generateDax(f, out, name="dax", noInitJob=False, initPickle=None,
+                clusterSizes=None, chainTasks=(), resources=None,
+                reduce=False, prioritize=False, slots=100, bundles=None):
+    """Generate a Pegasus DAX abstract workflow
+
+    Reads the workflow from ``f`` and writes the DAX to ``out``; returns
+    the `DaxWriter` for its job and dependency counts.  With
+    ``clusterSizes`` or ``chainTasks`` (see `clusterLabels`), quanta are
+    given Pegasus labels for ``pegasus-plan --cluster label`` to merge;
+    dependencies stay between the quanta, and Pegasus carries them over to
+    the clustered jobs.  ``resources`` sets the requests of each task; see
+    `quantumJob`.
+
+    With ``reduce``, dependencies implied by others are left out, including
+    those on the init job of quanta with other parents.  With
+    ``prioritize``, each job gets a Condor priority of its critical-path
+    length in seconds, from the run times in ``resources``, so that the
+    longest chains start first; the makespans with and without priorities
+    on ``slots`` slots are estimated and reported.  ``bundles`` locates
+    quanta packed by ``qbundle.py``; see `quantumJob`.
+    """
+    with DaxWriter(out, name) as dax:
+        if not noInitJob:
+            dax.addJob(INIT_ID,
+                       ["run", "-b BUTLER -i INCOL --output-run OUTCOL",
+                        "--init-only --register-dataset-types --qgraph",
+                        File(initPickle)],
+                       inputs=[initPickle], stderr="log.init.out")
+
+        if not (clusterSizes or chainTasks or reduce or prioritize):
+            for kind, a, b in parseWorkflow(f):
+                if kind == "quantum":
+                    quantumJob(dax, a, b, resources=resources,
+                               bundles=bundles)
+                    if not noInitJob:
+                        # Every job depends on the init job
+                        dax.depends(INIT_ID, jobId(a))
+                else:
+                    dax.depends(jobId(a), jobId(b))
+            return dax
+
+        wf = Workflow.read(f)
+        if reduce:
+            before = wf.edgeCount() + (0 if noInitJob else len(wf))
+            wf.reduce()
+            after = wf.edgeCount()
             if not noInitJob:
-                # Every job depends on the init job
-                dax.depends(parent=init, child=job)
-
-        # To add a job dependency
-        if line.startswith("Parent Quantum"):
-            match = re.search(r"Parent Quantum (\d+) - Child Quantum (\d+)", line)
-            # FIXME
-            parent = int(match.group(1))+100000
-            child = int(match.group(2))+100000
-            dax.depends(parent=parent, child=child)
-            print("Adding dependency", parent, child)
+                after += sum(1 for pos in range(len(wf))
+                             if not len(wf.parentsOf(pos)))
+            print("Transitive reduction kept %d of %d dependencies"
+                  " (%d removed)" % (after, before, before - after))
+        labels = None
+        if clusterSizes or chainTasks:
+            labels = clusterLabels(wf, clusterSizes or {}, chainTasks)
+        priority = None
+        if prioritize:
+            runtime = taskRuntimes(wf, resources)
+            priority = wf.criticalPath(runtime)
+            inOrder = wf.makespan(runtime, slots)
+            critical = wf.makespan(runtime, slots, priority)
+            print("Critical path %.0f s; expected makespan on %d slots"
+                  " %.0f s in input order, %.0f s by priority (%+.1f%%)"
+                  % (max(priority, default=0), slots, inOrder, critical,
+                     100 * (critical - inOrder) / inOrder if inOrder else 0))
 
+        for pos in range(len(wf)):
+            profiles = []
+            if labels is not None and labels[pos] >= 0:
+                profiles.append(("pegasus", "label", "C%d" % labels[pos]))
+            if priority is not None:
+                profiles.append(("condor", "priority",
+                                 str(int(math.ceil(priority[pos])))))
+            quantumJob(dax, wf.index[pos], wf.taskNames[wf.task[pos]],
+                       profiles, resources, bundles)
+        for pos in range(len(wf)):
+            iq = wf.index[pos]
+            parents = wf.parentsOf(pos)
+            if not noInitJob and not (reduce and len(parents)):
+                dax.depends(INIT_ID, jobId(iq))
+            for parent in parents:
+                dax.depends(jobId(wf.index[parent]), jobId(iq))
+        if labels is not None:
+            clustered = len(set(labels)) - (1 if -1 in labels else 0)
+            print("Clustered %d quanta into %d jobs"
+                  % (len(wf), clustered + labels.count(-1)))
     return dax
 
 
+def parseClusterSize(text):
+    task, _, size = text.rpartition("=")
+    if not task or not size.isdigit() or int(size) < 1:
+        raise argparse.ArgumentTypeError("expected TASK=N, got %r" % text)
+    return task, int(size)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate a DAX")
     parser.add_argument("-i", "--inputData", default="wf",
@@ -83,10 +583,51 @@ if __name__ == "__main__":
                         help="a flag to ignore the init job")
     parser.add_argument("--initPickle", type=str, default="test.qgraph",
                         help="file name of the wf pickle that will be used in the init job ")
+    parser.add_argument("--cluster", metavar="TASK=N", action="append",
+                        type=parseClusterSize, default=[],
+                        help="run N independent quanta (or chains) of TASK"
+                             " per job; TASK * applies to all tasks")
+    parser.add_argument("--chain", metavar="TASKS", default="",
+                        help="comma-separated tasks whose linear chains of"
+                             " dependent quanta run as one job; * for all")
+    parser.add_argument("--resources", metavar="FILE",
+                        help="per-task estimates written by resources.py to"
+                             " set memory and CPU requests from")
+    parser.add_argument("--resourceMargin", type=float, default=1.2,
+                        help="factor applied to memory estimates")
+    parser.add_argument("--minSamples", type=int, default=3,
+                        help="samples a task needs for its estimates to be"
+                             " used instead of the defaults")
+    parser.add_argument("--reduce", action="store_true",
+                        help="leave out dependencies implied by others")
+    parser.add_argument("--prioritize", action="store_true",
+                        help="give jobs Condor priorities by critical-path"
+                             " length")
+    parser.add_argument("--slots", type=int, default=100,
+                        help="job slots to estimate the makespan on")
+    parser.add_argument("--bundles", metavar="MANIFEST",
+                        help="manifest written by qbundle.py pack; jobs read"
+                             " their quanta from the bundles")
+    parser.add_argument("--bundleUrl", default="s3://BUCKET/input",
+                        help="URL of the directory holding the bundles")
 
     args = parser.parse_args()
 
-    with open(args.inputData, "r") as f:
-        dax = generateDax(f, "ciHsc", args.noInit, args.initPickle)
-    with open(args.outputFile, "w") as f:
-        dax.writeXML(f)
+    bundles = None
+    if args.bundles:
+        from qbundle import Manifest
+        bundles = Manifest.load(args.bundles, args.bundleUrl)
+    resources = None
+    if args.resources:
+        from resources import ResourceProfiles
+        resources = ResourceProfiles.load(args.resources,
+                                          margin=args.resourceMargin,
+                                          minSamples=args.minSamples)
+    chainTasks = [t for t in args.chain.split(",") if t]
+    with open(args.inputData, "r") as f, open(args.outputFile, "w") as out:
+        dax = generateDax(f, out, "ciHsc", args.noInit, args.initPickle,
+                          dict(args.cluster), chainTasks, resources,
+                          args.reduce, args.prioritize, args.slots,
+                          bundles)
+    print("Wrote %d jobs and %d dependencies to %s"
+          % (dax.jobs, dax.edges, args.outputFile))
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+
+"""Quantum bundles: many single-quantum pickles packed into few objects.
+
+Staging one ``quantum-NNNNNN.qgraph`` per job floods the object store with
+small requests.  ``pack`` concatenates them into bundles of bounded size,
+each laid out as::
+
+    MAGIC | index length | JSON index | pickles
+
+where the header is `HEADER` (8-byte magic, little-endian 64-bit index
+length) and the index maps each member name to its ``[offset, size]``
+within the bundle.  A manifest listing the bundles and the location of
+every member is written alongside for ``pegasusize.py --bundles``, which
+then passes the location of its quantum to each job instead of staging a
+file.
+
+On the worker, ``run`` fetches just the bytes of the quantum by ranged
+read and starts pipetask on them.  Fetched ranges are kept in a cache per
+node, in `BLOCK`-sized blocks of a sparse copy of each bundle, so jobs on
+the same node reading neighbouring quanta share requests.  Processes
+coordinate through a lock file per bundle.
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+
+MAGIC = b"QGBUNDLE"
+HEADER = struct.Struct("<8sQ")
+
+# Bytes per cache block, and so the smallest ranged read.
+BLOCK = 4 * 1024 * 1024
+
+DEFAULT_CACHE = os.path.join(tempfile.gettempdir(), "qbundle-cache")
+
+
+def pack(paths, outDir, maxSize=1024 ** 3, prefix="qgraphs"):
+    """Pack files into bundles of at most about ``maxSize`` bytes.
+
+    Members are packed in name order, so quanta with neighbouring indices,
+    which tend to belong to the same task, share bundles.
+
+    Returns the manifest, also written to ``<prefix>.json`` in ``outDir``.
+    """
+    os.makedirs(outDir, exist_ok=True)
+    groups, current, size = [], [], 0
+    for path in sorted(paths, key=os.path.basename):
+        n = os.path.getsize(path)
+        if current and size + n > maxSize:
+            groups.append(current)
+            current, size = [], 0
+        current.append((path, n))
+        size += n
+    if current:
+        groups.append(current)
+
+    manifest = {"bundles": [], "members": {}}
+    for number, group in enumerate(groups):
+        name = "%s-%04d.qbundle" % (prefix, number)
+        # Offsets depend on the length of the index that holds them; lay
+        # out with a provisional length until it stops changing.
+        indexLength = 0
+        while True:
+            offset = HEADER.size + indexLength
+            members = {}
+            for path, n in group:
+                members[os.path.basename(path)] = [offset, n]
+                offset += n
+            index = json.dumps({"members": members}).encode()
+            if len(index) == indexLength:
+                break
+            indexLength = len(index)
+        with open(os.path.join(outDir, name), "wb") as out:
+            out.write(HEADER.pack(MAGIC, len(index)))
+            out.write(index)
+            for path, _ in group:
+                with open(path, "rb") as f:
+                    out.write(f.read())
+        manifest["bundles"].append(name)
+        for member, (start, n) in members.items():
+            manifest["members"][member] = [number, start, n]
+    with open(os.path.join(outDir, prefix + ".json"), "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+class Manifest:
+    """Locations of packed quanta, as written by `pack`.
+
+    ``baseUrl`` is where the bundles are stored, such as
+    ``s3://bucket/input``.
+    """
+
+    def __init__(self, manifest, baseUrl):
+        self.bundles = ["%s/%s" % (baseUrl.rstrip("/"), name)
+                        for name in manifest["bundles"]]
+        self.members = manifest["members"]
+
+    @classmethod
+    def load(cls, path, baseUrl):
+        with open(path) as f:
+            return cls(json.load(f), baseUrl)
+
+    def locate(self, member):
+        """Return the bundle URL, offset, and size of a member."""
+        number, offset, size = self.members[member]
+        return self.bundles[number], offset, size
+
+
+def fetcher(url):
+    """Return a function reading bytes ``[start, end)`` of ``url``.
+
+    ``url`` is an s3:// URL (using ``S3_ENDPOINT_URL`` if set), an http or
+    https URL, or a local path.
+    """
+    if url.startswith("s3://"):
+        import boto3
+        bucket, key = url[len("s3://"):].split("/", 1)
+        client = boto3.client("s3",
+                              endpoint_url=os.environ.get("S3_ENDPOINT_URL"))
+        return lambda start, end: client.get_object(
+            Bucket=bucket, Key=key, Range="bytes=%d-%d" % (start, end - 1)
+        )["Body"].read()
+    if url.startswith("http://") or url.startswith("https://"):
+        import requests
+        session = requests.Session()
+
+        def fetch(start, end):
+            r = session.get(url,
+                            headers={"Range": "bytes=%d-%d" % (start, end - 1)})
+            r.raise_for_status()
+            # A server that ignores ranges returns the whole object.
+            return r.content if r.status_code == 206 else r.content[start:end]
+
+        return fetch
+
+    def fetch(start, end):
+        with open(url, "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    return fetch
+
+
+def readIndex(fetch):
+    """Read the index of a bundle through ``fetch``."""
+    data = fetch(0, BLOCK)
+    magic, length = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a quantum bundle")
+    end = HEADER.size + length
+    if len(data) < end:
+        data += fetch(len(data), end)
+    return json.loads(data[HEADER.size:end])
+
+
+class BundleCache:
+    """Node-local cache of the blocks of bundles read so far."""
+
+    def __init__(self, cacheDir=DEFAULT_CACHE):
+        self.cacheDir = cacheDir
+        self.fetched = 0
+        os.makedirs(cacheDir, exist_ok=True)
+
+    def read(self, url, offset, size, fetch=None):
+        """Return bytes ``[offset, offset + size)`` of bundle ``url``."""
+        if size == 0:
+            return b""
+        base = os.path.join(self.cacheDir,
+                            hashlib.sha1(url.encode()).hexdigest())
+        first, last = offset // BLOCK, (offset + size - 1) // BLOCK
+        with open(base + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                blocks = bytearray()
+                if os.path.exists(base + ".blocks"):
+                    with open(base + ".blocks", "rb") as f:
+                        blocks = bytearray(f.read())
+                if len(blocks) <= last:
+                    blocks.extend(bytes(last + 1 - len(blocks)))
+                missing = [b for b in range(first, last + 1) if not blocks[b]]
+                if missing:
+                    self._fill(base, url, missing, blocks, fetch)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        with open(base + ".data", "rb") as f:
+            f.seek(offset)
+            data = f.read(size)
+        if len(data) != size:
+            raise IOError("Short read of %d bytes at %d from %s"
+                          % (size, offset, url))
+        return data
+
+    def _fill(self, base, url, missing, blocks, fetch):
+        fetch = fetch or fetcher(url)
+        mode = "r+b" if os.path.exists(base + ".data") else "w+b"
+        with open(base + ".data", mode) as f:
+            # One ranged read per run of consecutive missing blocks.
+            run = [missing[0]]
+            for b in missing[1:] + [None]:
+                if b is not None and b == run[-1] + 1:
+                    run.append(b)
+                    continue
+                data = fetch(run[0] * BLOCK, (run[-1] + 1) * BLOCK)
+                f.seek(run[0] * BLOCK)
+                f.write(data)
+                self.fetched += len(data)
+                for r in run:
+                    blocks[r] = 1
+                run = [b]
+        # The block map goes last so a crash cannot mark unwritten data.
+        with open(base + ".blocks.tmp", "wb") as f:
+            f.write(blocks)
+        os.replace(base + ".blocks.tmp", base + ".blocks")
+
+
+def runQuantum(url, offset, size, name, command, cacheDir=DEFAULT_CACHE):
+    """Fetch a quantum and replace this process with pipetask on it.
+
+    ``command`` is the pipetask command line, in which ``{qgraph}`` stands
+    for the path of the fetched quantum; a bare ``pipetask`` is resolved
+    through ``CTRL_MPEXEC_DIR`` if set.
+    """
+    data = BundleCache(cacheDir).read(url, offset, size)
+    with open(name, "wb") as f:
+        f.write(data)
+    command = [name if arg == "{qgraph}" else arg for arg in command]
+    if command[0] == "pipetask" and "CTRL_MPEXEC_DIR" in os.environ:
+        command[0] = os.path.join(os.environ["CTRL_MPEXEC_DIR"], "bin",
+                                  "pipetask")
+    sys.stdout.flush()
+    os.execvp(command[0], command)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pack, list, and read quantum bundles")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("pack", help="pack quantum files into bundles")
+    p.add_argument("files", nargs="+",
+                   help="quantum files, or directories of them, to pack")
+    p.add_argument("-o", "--outDir", default=".",
+                   help="directory to write bundles and manifest to")
+    p.add_argument("--maxSize", type=int, default=1024,
+                   help="maximum bundle size in MB")
+    p.add_argument("--prefix", default="qgraphs",
+                   help="name prefix of the bundles and manifest")
+    p = sub.add_parser("list", help="list the members of a bundle")
+    p.add_argument("url", help="bundle path or s3, http, or https URL")
+    p = sub.add_parser("run", help="fetch a quantum and run pipetask on it")
+    p.add_argument("url", help="bundle path or s3, http, or https URL")
+    p.add_argument("offset", type=int, help="offset of the quantum")
+    p.add_argument("size", type=int, help="size of the quantum")
+    p.add_argument("name", help="file name to give the quantum")
+    p.add_argument("--cacheDir",
+                   default=os.environ.get("QBUNDLE_CACHE", DEFAULT_CACHE),
+                   help="node-local cache directory")
+    p.add_argument("pipetask", nargs=argparse.REMAINDER,
+                   help="pipetask command line, with {qgraph} for the file")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        # Directories spare the argument list a million file names.
+        paths = []
+        for path in args.files:
+            if os.path.isdir(path):
+                paths.extend(entry.path for entry in os.scandir(path)
+                             if entry.name.endswith(".qgraph"))
+            else:
+                paths.append(path)
+        manifest = pack(paths, args.outDir, args.maxSize * 1024 ** 2,
+                        args.prefix)
+        print("Packed %d files into %d bundles"
+              % (len(manifest["members"]), len(manifest["bundles"])))
+    elif args.command == "list":
+        for member, (offset, size) in readIndex(
+                fetcher(args.url))["members"].items():
+            print("%s offset = %d, size = %d" % (member, offset, size))
+    else:
+        command = args.pipetask
+        if command and command[0] == "--":
+            command = command[1:]
+        runQuantum(args.url, args.offset, args.size, args.name, command,
+                   args.cacheDir)
+
+
+if __name__ == "__main__":
+    main()
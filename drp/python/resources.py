@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+
+"""Per-task resource estimates from the records of past workflow runs.
+
+Samples of peak memory, CPU usage, and run time are collected per job
+from, in increasing order of precedence:
+
+- pipetask logs (``log.<task>.<index>.out``), whose timing lines give the
+  run time of the quantum;
+- Pegasus kickstart records (``<job>.out.NNN``), which give the duration,
+  CPU time, and, where kickstart reports it, peak RSS of the job;
+- HTCondor job event logs (``*.log`` in the submit directory), whose
+  "Job terminated" events give the memory and CPUs used.
+
+Jobs are tied to tasks through their DAX ids, ``Q<index>``: the task of a
+quantum comes from the name of its pipetask log or from the workflow file
+given to ``pegasusize.py``.  Samples are reduced to a percentile per task.
+
+Run as a program, this writes the estimates as JSON for
+``pegasusize.py --resources``.
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+from pegasusize import parseWorkflow
+
+PIPETASK_LOG_RE = re.compile(r"log\.(\w+)\.(\d+)\.out$")
+KICKSTART_RE = re.compile(r"\.out\.\d+$")
+TOOK_RE = re.compile(r"took ([\d.]+) seconds")
+# DAX ids as they appear in Pegasus job names, e.g. pipetask_Q12.
+JOB_ID_RE = re.compile(r"(?:^|_)Q(\d+)$")
+EVENT_RE = re.compile(r"^(\d{3}) \((\d+)\.(\d+)\.\d+\) (\S+ \S+)")
+NODE_RE = re.compile(r"DAG Node: (\S+)")
+RESOURCE_RE = re.compile(r"^\s*(Cpus|Memory \(MB\))\s*:\s*([\d.]+)")
+NORMAL_RE = re.compile(r"Normal termination \(return value (\d+)\)")
+
+# Granularity of memory requests in MB.
+MEMORY_STEP = 128
+
+
+def _quantum(jobName):
+    match = JOB_ID_RE.search(jobName)
+    return int(match.group(1)) if match else None
+
+
+def _eventTime(text):
+    # Old event logs omit the year; only differences are used.
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%m/%d %H:%M:%S"):
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    return None
+
+
+def readPipetaskLog(path):
+    """Return the run time in a pipetask log, or None."""
+    seconds = None
+    with open(path, errors="replace") as f:
+        for line in f:
+            match = TOOK_RE.search(line)
+            if match:
+                seconds = (seconds or 0.0) + float(match.group(1))
+    return seconds
+
+
+def readKickstart(path):
+    """Return the job name and usage in a kickstart record, or None."""
+    try:
+        root = ET.parse(path).getroot()
+    except (ET.ParseError, OSError):
+        return None
+    name = root.get("derivation") or ""
+    sample = {}
+    for element in root.iter():
+        if element.tag.endswith("mainjob"):
+            duration = float(element.get("duration", 0))
+            if duration > 0:
+                sample["runtime"] = duration
+            for usage in element:
+                if not usage.tag.endswith("usage"):
+                    continue
+                cpu = (float(usage.get("utime", 0))
+                       + float(usage.get("stime", 0)))
+                if duration > 0:
+                    sample["cpus"] = cpu / duration
+                if usage.get("maxrss"):
+                    # Reported in KB.
+                    sample["memory_mb"] = float(usage.get("maxrss")) / 1024
+    return name, sample
+
+
+def readCondorLog(path):
+    """Yield the DAG node name and usage of each job that finished.
+
+    Only the last successful run of each job is reported.
+    """
+    names = {}
+    started = {}
+    results = {}
+    event = None
+    with open(path, errors="replace") as f:
+        for line in f:
+            match = EVENT_RE.match(line)
+            if match:
+                code, cluster = match.group(1), match.group(2)
+                event = (code, cluster, _eventTime(match.group(4)))
+                if code == "001":
+                    started[cluster] = event[2]
+                elif code == "005":
+                    results[cluster] = {"ok": False}
+                    start = started.get(cluster)
+                    if start is not None and event[2] is not None:
+                        results[cluster]["runtime"] = (
+                            event[2] - start).total_seconds()
+                continue
+            if event is None:
+                continue
+            code, cluster, _ = event
+            match = NODE_RE.search(line)
+            if match:
+                names[cluster] = match.group(1)
+            if code != "005":
+                continue
+            match = NORMAL_RE.search(line)
+            if match:
+                results[cluster]["ok"] = match.group(1) == "0"
+            match = RESOURCE_RE.match(line)
+            if match:
+                key = "cpus" if match.group(1) == "Cpus" else "memory_mb"
+                results[cluster][key] = float(match.group(2))
+    for cluster, result in results.items():
+        if result.pop("ok") and cluster in names:
+            yield names[cluster], result
+
+
+def collect(paths, workflow=None):
+    """Collect samples per task from run directories.
+
+    Parameters
+    ----------
+    paths : list of str
+        Directories (searched recursively) or files.
+    workflow : str, optional
+        Output of ``pipetask qgraph --show workflow``, naming the task of
+        each quantum.
+
+    Returns
+    -------
+    dict
+        Lists of sample dicts, keyed by task name.
+    """
+    tasks = {}
+    if workflow is not None:
+        with open(workflow) as f:
+            for kind, a, b in parseWorkflow(f):
+                if kind == "quantum":
+                    tasks[a] = b
+    logs, kickstarts, condorLogs = [], [], []
+    for path in paths:
+        walk = [(os.path.dirname(path), [], [os.path.basename(path)])] \
+            if os.path.isfile(path) else os.walk(path)
+        for root, _, files in walk:
+            for name in files:
+                full = os.path.join(root, name)
+                if PIPETASK_LOG_RE.search(name):
+                    logs.append(full)
+                elif KICKSTART_RE.search(name):
+                    kickstarts.append(full)
+                elif name.endswith(".log"):
+                    condorLogs.append(full)
+
+    samples = {}
+    for path in logs:
+        match = PIPETASK_LOG_RE.search(path)
+        iq = int(match.group(2))
+        tasks.setdefault(iq, match.group(1))
+        seconds = readPipetaskLog(path)
+        if seconds is not None:
+            samples.setdefault(iq, {})["runtime"] = seconds
+    for path in kickstarts:
+        record = readKickstart(path)
+        iq = _quantum(record[0]) if record else None
+        if iq is not None:
+            samples.setdefault(iq, {}).update(record[1])
+    for path in condorLogs:
+        for name, sample in readCondorLog(path):
+            iq = _quantum(name)
+            if iq is not None:
+                samples.setdefault(iq, {}).update(sample)
+
+    byTask = {}
+    for iq, sample in samples.items():
+        if iq in tasks and sample:
+            byTask.setdefault(tasks[iq], []).append(sample)
+    return byTask
+
+
+def percentile(values, q):
+    """Return the ``q``th percentile of ``values`` by nearest rank."""
+    values = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(values)))
+    return values[rank - 1]
+
+
+def estimate(byTask, q=95):
+    """Reduce samples to the ``q``th percentile of each quantity per task."""
+    estimates = {}
+    for task, samples in sorted(byTask.items()):
+        entry = {"samples": len(samples)}
+        for key in ("memory_mb", "cpus", "runtime"):
+            values = [s[key] for s in samples if key in s]
+            if values:
+                entry[key] = percentile(values, q)
+        estimates[task] = entry
+    return {"percentile": q, "tasks": estimates}
+
+
+class ResourceProfiles:
+    """Resource requests derived from estimates.
+
+    Memory is the estimate times ``margin``, rounded up to `MEMORY_STEP`;
+    CPUs are the estimate rounded up, ignoring a few percent of helper
+    thread time.  Tasks with fewer than ``minSamples`` samples have no
+    profile, and callers fall back to their defaults.
+    """
+
+    def __init__(self, estimates, margin=1.2, minSamples=3):
+        self.tasks = estimates.get("tasks", {})
+        self.margin = margin
+        self.minSamples = minSamples
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path) as f:
+            return cls(json.load(f), **kwargs)
+
+    def _entry(self, task):
+        entry = self.tasks.get(task)
+        if entry is None or entry["samples"] < self.minSamples:
+            return None
+        return entry
+
+    def memory(self, task):
+        """Return the memory request of a task, such as "2432MB", or None."""
+        entry = self._entry(task)
+        if entry is None or "memory_mb" not in entry:
+            return None
+        mb = entry["memory_mb"] * self.margin
+        return "%dMB" % (max(1, math.ceil(mb / MEMORY_STEP)) * MEMORY_STEP)
+
+    def cpus(self, task):
+        """Return the CPU request of a task, or None."""
+        entry = self._entry(task)
+        if entry is None or "cpus" not in entry:
+            return None
+        return max(1, math.ceil(entry["cpus"] - 0.05))
+
+    def runtime(self, task):
+        """Return the estimated run time of a task in seconds, or None."""
+        entry = self._entry(task)
+        return None if entry is None else entry.get("runtime")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Estimate per-task resources from past workflow runs")
+    parser.add_argument("paths", nargs="+",
+                        help="run directories or record files to read")
+    parser.add_argument("-w", "--workflow",
+                        help="pipetask --show workflow output naming the"
+                             " task of each quantum")
+    parser.add_argument("-p", "--percentile", type=float, default=95,
+                        help="percentile of the samples to estimate")
+    parser.add_argument("-o", "--outputFile", default="resources.json",
+                        help="file name for the output estimates")
+    args = parser.parse_args()
+
+    byTask = collect(args.paths, args.workflow)
+    if not byTask:
+        sys.exit("No job records found")
+    estimates = estimate(byTask, args.percentile)
+    with open(args.outputFile, "w") as f:
+        json.dump(estimates, f, indent=2)
+    for task, entry in estimates["tasks"].items():
+        print("%s: %s" % (task, ", ".join("%s = %s" % (k, v)
+                                          for k, v in entry.items())))
@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# The workflow tools are scripts in python/ and ci_hsc/, not an installed
+# package.
+for directory in ("python", "ci_hsc"):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / directory))
@@ -0,0 +1,242 @@
+"""Check the graph analyses of pegasusize on small hand-built workflows.
+
+Each transformation must keep the dependencies that matter: a quantum
+reachable from another before must still be reachable after.
+"""
+
+import io
+import random
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from pegasusize import INIT_ID, DAX_SCHEMA, Workflow, clusterLabels, \
+    generateDax, jobId
+
+
+def makeText(tasks, edges):
+    """Return ``pipetask qgraph --show workflow`` output for a graph.
+
+    ``tasks`` lists the task of each quantum, numbered from 0, and
+    ``edges`` holds ``(parent, child)`` pairs of quantum numbers.
+    """
+    lines = ["Quantum %d: %s" % (iq, task) for iq, task in enumerate(tasks)]
+    lines += ["Parent Quantum %d - Child Quantum %d" % edge for edge in edges]
+    return "\n".join(lines) + "\n"
+
+
+def makeWorkflow(tasks, edges):
+    return Workflow.read(io.StringIO(makeText(tasks, edges)))
+
+
+def reachability(nodes, childrenOf):
+    """Return the set of ``(ancestor, descendant)`` pairs of a graph."""
+    pairs = set()
+    for start in nodes:
+        stack = list(childrenOf(start))
+        seen = set()
+        while stack:
+            node = stack.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            pairs.add((start, node))
+            stack.extend(childrenOf(node))
+    return pairs
+
+
+def workflowReachability(wf):
+    return reachability(range(len(wf)), lambda pos: list(wf.childrenOf(pos)))
+
+
+def edges(wf):
+    return sorted((parent, pos) for pos in range(len(wf))
+                  for parent in wf.parentsOf(pos))
+
+
+def diamond():
+    # 0 -> {1, 2} -> 3, with a shortcut 0 -> 3.
+    return makeWorkflow(["A", "B", "C", "D"],
+                        [(0, 1), (0, 2), (1, 3), (2, 3), (0, 3)])
+
+
+def testReduceDropsShortcut():
+    wf = diamond()
+    before = workflowReachability(wf)
+    assert wf.reduce() == 1
+    assert edges(wf) == [(0, 1), (0, 2), (1, 3), (2, 3)]
+    assert workflowReachability(wf) == before
+
+
+def testReduceDropsDeepShortcut():
+    # The shortcut skips a chain several levels deep.
+    wf = makeWorkflow(["A", "B", "C", "D", "E"],
+                      [(0, 1), (1, 2), (2, 3), (3, 4), (0, 4), (1, 4)])
+    before = workflowReachability(wf)
+    assert wf.reduce() == 2
+    assert edges(wf) == [(0, 1), (1, 2), (2, 3), (3, 4)]
+    assert workflowReachability(wf) == before
+
+
+def testReduceDropsDuplicates():
+    wf = makeWorkflow(["A", "B"], [(0, 1), (0, 1)])
+    assert wf.reduce() == 1
+    assert edges(wf) == [(0, 1)]
+
+
+def testReduceKeepsIndependentParents():
+    # Parents on different levels that do not reach each other stay.
+    wf = makeWorkflow(["A", "B", "C", "D"], [(0, 1), (1, 3), (2, 3)])
+    before = edges(wf)
+    assert wf.reduce() == 0
+    assert edges(wf) == before
+
+
+def testReduceRandomGraphs():
+    rng = random.Random(1)
+    for _ in range(50):
+        n = rng.randint(2, 20)
+        graph = [(p, c) for c in range(n) for p in range(c)
+                 if rng.random() < 0.3]
+        wf = makeWorkflow(["T"] * n, graph)
+        before = workflowReachability(wf)
+        wf.reduce()
+        assert workflowReachability(wf) == before
+        # No dependency left is implied by the others.
+        for parent, child in edges(wf):
+            others = [edge for edge in edges(wf) if edge != (parent, child)]
+            pruned = makeWorkflow(["T"] * n, others)
+            assert (parent, child) not in workflowReachability(pruned)
+
+
+def testCycleRaises():
+    wf = makeWorkflow(["A", "B", "C"], [(0, 1), (1, 2), (2, 1)])
+    with pytest.raises(ValueError):
+        wf.topologicalOrder()
+
+
+def testCriticalPath():
+    wf = diamond()
+    assert list(wf.criticalPath([1, 2, 3, 4])) == [8, 6, 7, 4]
+
+
+def testMakespan():
+    wf = diamond()
+    runtime = [1, 2, 3, 4]
+    assert wf.makespan(runtime, 1) == 10
+    assert wf.makespan(runtime, 2) == 8
+    # Two short jobs ahead of the head of a long chain delay it in input
+    # order; critical-path priorities start the chain first.
+    wf = makeWorkflow(["A", "A", "B", "C"], [(2, 3)])
+    runtime = [1, 1, 1, 5]
+    assert wf.makespan(runtime, 2) == 7
+    assert wf.makespan(runtime, 2, wf.criticalPath(runtime)) == 6
+
+
+def clusteredGraph(wf, labels):
+    """Return the jobs of a clustered workflow and their children."""
+    def job(pos):
+        return ("C", labels[pos]) if labels[pos] >= 0 else ("Q", pos)
+
+    children = {}
+    for pos in range(len(wf)):
+        children.setdefault(job(pos), set())
+        for child in wf.childrenOf(pos):
+            if job(child) != job(pos):
+                children[job(pos)].add(job(child))
+    return job, children
+
+
+def checkClusters(wf, labels):
+    """Check that clustered jobs form a DAG keeping every dependency."""
+    job, children = clusteredGraph(wf, labels)
+    pairs = reachability(children, lambda node: children[node])
+    assert not any((node, node) in pairs for node in children)
+    for parent, child in workflowReachability(wf):
+        assert job(parent) == job(child) or (job(parent), job(child)) in pairs
+
+
+def testClusterChains():
+    # Two chains A -> B -> C, merged vertically and then horizontally.
+    wf = makeWorkflow(["A", "B", "C"] * 2,
+                      [(0, 1), (1, 2), (3, 4), (4, 5)])
+    labels = clusterLabels(wf, {"A": 2}, ["*"])
+    assert list(labels) == [0] * 6
+    checkClusters(wf, labels)
+    # One chain per job.
+    labels = clusterLabels(wf, {}, ["*"])
+    assert list(labels) == [0, 0, 0, 1, 1, 1]
+    checkClusters(wf, labels)
+
+
+def testClusterChainsOfSelectedTasks():
+    wf = makeWorkflow(["A", "B", "C"], [(0, 1), (1, 2)])
+    labels = clusterLabels(wf, {}, ["A", "B"])
+    assert list(labels) == [0, 0, -1]
+    checkClusters(wf, labels)
+
+
+def testClusterChainStopsAtFanOut():
+    # A quantum with two children, or a child with two parents, ends a
+    # chain.
+    wf = makeWorkflow(["A", "B", "B", "C"], [(0, 1), (0, 2), (1, 3), (2, 3)])
+    labels = clusterLabels(wf, {}, ["*"])
+    assert list(labels) == [-1] * 4
+    labels = clusterLabels(wf, {"B": 2}, ["*"])
+    assert list(labels) == [-1, 0, 0, -1]
+    checkClusters(wf, labels)
+
+
+def testClusterRejectsTaskCycle():
+    # A -> B -> A is a DAG of quanta, but not of tasks, so clusters of A
+    # could depend on each other through B.
+    wf = makeWorkflow(["A", "B", "A"], [(0, 1), (1, 2)])
+    with pytest.raises(ValueError):
+        clusterLabels(wf, {"*": 2})
+
+
+def testClusterRandomGraphs():
+    # Whatever the clustering, clustered jobs of a workflow whose tasks
+    # form a DAG form a DAG too, as argued in clusterLabels.
+    rng = random.Random(2)
+    for _ in range(200):
+        nTasks = rng.randint(1, 4)
+        tasks = sorted(rng.randrange(nTasks)
+                       for _ in range(rng.randint(2, 25)))
+        graph = [(p, c) for c in range(len(tasks)) for p in range(c)
+                 if tasks[p] < tasks[c] and rng.random() < 0.3]
+        wf = makeWorkflow(["T%d" % t for t in tasks], graph)
+        sizes = {"*": rng.randint(1, 4)}
+        chainTasks = rng.choice([(), ("*",), ("T0", "T1")])
+        checkClusters(wf, clusterLabels(wf, sizes, chainTasks))
+
+
+def daxDependencies(text):
+    """Return the jobs of a DAX and their children."""
+    root = ET.fromstring(text)
+    ns = {"dax": DAX_SCHEMA}
+    children = {job.get("id"): set() for job in root.findall("dax:job", ns)}
+    for child in root.findall("dax:child", ns):
+        for parent in child.findall("dax:parent", ns):
+            children[parent.get("ref")].add(child.get("ref"))
+    return children
+
+
+def testGenerateDaxReduceDropsInitEdges(capsys):
+    text = makeText(["A", "B", "C", "D"],
+                    [(0, 1), (0, 2), (1, 3), (2, 3), (0, 3)])
+    graphs = {}
+    for reduce in (False, True):
+        out = io.StringIO()
+        # Clustering makes the plain run load the graph too.
+        generateDax(io.StringIO(text), out, initPickle="init.qgraph",
+                    chainTasks=["X"], reduce=reduce)
+        graphs[reduce] = daxDependencies(out.getvalue())
+    full, reduced = graphs[False], graphs[True]
+    assert full[INIT_ID] == {jobId(iq) for iq in range(4)}
+    # Only the quantum without parents still depends on the init job.
+    assert reduced[INIT_ID] == {jobId(0)}
+    assert jobId(3) not in reduced[jobId(0)]
+    assert (reachability(full, lambda job: full[job])
+            == reachability(reduced, lambda job: reduced[job]))
+    assert "kept 5 of 9 dependencies (4 removed)" in capsys.readouterr().out
@@ -0,0 +1,43 @@
+"""Check the ETags that upload.py expects against the files' contents."""
+
+import hashlib
+
+import pytest
+
+pytest.importorskip("boto3")
+
+from boto3.s3.transfer import TransferConfig
+
+from upload import etag
+
+KB = 1024
+
+
+@pytest.fixture
+def config():
+    return TransferConfig(multipart_threshold=64 * KB,
+                          multipart_chunksize=16 * KB)
+
+
+def writeFile(tmp_path, size):
+    data = bytes(range(256)) * (size // 256) + b"x" * (size % 256)
+    path = tmp_path / "file"
+    path.write_bytes(data)
+    return path, data
+
+
+@pytest.mark.parametrize("size", [0, 1000, 16 * KB, 30 * KB, 64 * KB - 1])
+def testSinglePart(tmp_path, config, size):
+    # Files below the threshold are uploaded in one piece, even if larger
+    # than a part, and their ETag is the MD5 of the whole file.
+    path, data = writeFile(tmp_path, size)
+    assert etag(path, size, config) == hashlib.md5(data).hexdigest()
+
+
+@pytest.mark.parametrize("size", [64 * KB, 70 * KB])
+def testMultipart(tmp_path, config, size):
+    path, data = writeFile(tmp_path, size)
+    parts = [data[i:i + 16 * KB] for i in range(0, size, 16 * KB)]
+    combined = hashlib.md5(b"".join(hashlib.md5(p).digest() for p in parts))
+    assert etag(path, size, config) == "%s-%d" % (combined.hexdigest(),
+                                                  len(parts))